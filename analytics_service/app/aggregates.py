@@ -0,0 +1,145 @@
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlmodel import Session, func, select
+from app.models import HealthReading, HealthStatsBase, HealthStatsRollup
+
+# Every numeric metric carried by health events
+METRICS = (
+    "steps", "sleep_hours", "weight", "heart_rate",
+    "systolic", "diastolic", "blood_sugar", "body_temperature",
+)
+
+# Metrics reported as daily totals. Their sum lives in a legacy column and they have no avg_ column.
+TOTAL_COLUMNS = {
+    "steps": "total_steps",
+    "sleep_hours": "sleep_hours",
+}
+
+def sum_column(metric: str) -> str:
+    return TOTAL_COLUMNS.get(metric, f"{metric}_sum")
+
+def _refresh_avg(daily: HealthStatsBase, metric: str):
+    if metric in TOTAL_COLUMNS:
+        return
+    count = getattr(daily, f"{metric}_count")
+    setattr(daily, f"avg_{metric}", getattr(daily, sum_column(metric)) / count if count else 0.0)
+
+def add_reading(daily: HealthStatsBase, metric: str, value):
+    """Folds one reading into the count/sum/min/max columns of `metric`."""
+    count = getattr(daily, f"{metric}_count")
+    column = sum_column(metric)
+    setattr(daily, column, getattr(daily, column) + value)
+    if count == 0:
+        setattr(daily, f"min_{metric}", value)
+        setattr(daily, f"max_{metric}", value)
+    else:
+        for bound, pick in ((f"min_{metric}", min), (f"max_{metric}", max)):
+            current = getattr(daily, bound)
+            if current is not None: # NULL: unknown since a removal (see recompute_bounds)
+                setattr(daily, bound, pick(current, value))
+    setattr(daily, f"{metric}_count", count + 1)
+    _refresh_avg(daily, metric)
+
+def remove_reading(daily: HealthStatsBase, metric: str, value) -> bool:
+    """
+    Takes one reading out of `metric`. Returns True when it was the min or max
+    of the readings left: the caller must then call recompute_bounds.
+    """
+    count = getattr(daily, f"{metric}_count")
+    if count <= 0:
+        return False
+    column = sum_column(metric)
+    count -= 1
+    setattr(daily, f"{metric}_count", count)
+    if count > 0:
+        setattr(daily, column, getattr(daily, column) - value)
+    else:
+        # Reset exactly rather than accumulating float drift
+        setattr(daily, column, type(getattr(daily, column))(0))
+        setattr(daily, f"min_{metric}", None)
+        setattr(daily, f"max_{metric}", None)
+    _refresh_avg(daily, metric)
+    # An unknown (NULL) bound may be recomputable too
+    bounds = (getattr(daily, f"min_{metric}"), getattr(daily, f"max_{metric}"))
+    return count > 0 and (value in bounds or None in bounds)
+
+def replace_reading(daily: HealthStatsBase, metric: str, old_value: Optional[float], new_value: Optional[float]) -> bool:
+    """Same return value as remove_reading."""
+    stale = old_value is not None and remove_reading(daily, metric, old_value)
+    if new_value is not None:
+        add_reading(daily, metric, new_value)
+    return stale
+
+ROLLUP_GRANULARITIES = ("week", "month")
+
+def period_start(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+def period_end(start: date, granularity: str) -> date:
+    if granularity == "week":
+        return start + timedelta(days=6)
+    if granularity == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    return start
+
+def covered_days(stats_row: HealthStatsBase) -> Tuple[date, date]:
+    if isinstance(stats_row, HealthStatsRollup):
+        return stats_row.period_start, period_end(stats_row.period_start, stats_row.granularity)
+    return stats_row.date, stats_row.date
+
+def recompute_bounds(session: Session, stats_row: HealthStatsBase, metric: str):
+    """
+    Recomputes min_/max_ of `metric` from the stored HealthReading rows of the
+    days `stats_row` covers; they must already reflect the update or deletion.
+    Readings aggregated before HealthReading existed are missing from it, so
+    when the counts disagree both bounds become NULL (unknown) instead.
+    """
+    first, last = covered_days(stats_row)
+    column = getattr(HealthReading, metric)
+    statement = select(func.count(column), func.min(column), func.max(column)).where(
+        HealthReading.username == stats_row.username,
+        HealthReading.date >= first,
+        HealthReading.date <= last
+    )
+    count, low, high = session.exec(statement).one()
+    if count != getattr(stats_row, f"{metric}_count"):
+        low = high = None
+    setattr(stats_row, f"min_{metric}", low)
+    setattr(stats_row, f"max_{metric}", high)
+
+def get_rollups(session: Session, username: str, day: date) -> List[HealthStatsRollup]:
+    """Weekly and monthly rows containing `day`, created if missing."""
+    starts = {g: period_start(day, g) for g in ROLLUP_GRANULARITIES}
+    statement = select(HealthStatsRollup).where(
+        HealthStatsRollup.username == username,
+        HealthStatsRollup.period_start.in_(set(starts.values()))
+    )
+    existing: Dict[str, HealthStatsRollup] = {}
+    for rollup in session.exec(statement).all():
+        if starts.get(rollup.granularity) == rollup.period_start:
+            existing[rollup.granularity] = rollup
+
+    return [
+        existing.get(g) or HealthStatsRollup(username=username, granularity=g, period_start=starts[g])
+        for g in ROLLUP_GRANULARITIES
+    ]
+
+def merge_stats(target: HealthStatsBase, source: HealthStatsBase):
+    """Adds every aggregate of `source` into `target` (used to rebuild rollups)."""
+    for metric in METRICS:
+        count = getattr(source, f"{metric}_count")
+        if not count:
+            continue
+        column = sum_column(metric)
+        setattr(target, column, getattr(target, column) + getattr(source, column))
+        for bound, pick in ((f"min_{metric}", min), (f"max_{metric}", max)):
+            current = getattr(target, bound)
+            value = getattr(source, bound)
+            if value is not None:
+                setattr(target, bound, value if current is None else pick(current, value))
+        setattr(target, f"{metric}_count", getattr(target, f"{metric}_count") + count)
+        _refresh_avg(target, metric)
@@ -1,31 +1,97 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlmodel import Session, select
-from app.models import AnalyticsStats, DailyHealthStats, HealthInsight
-from app.database import get_session
+from app.models import AnalyticsStats, DailyHealthStats, HealthInsight, HealthStatsRollup, HealthStatsPeriod
+from app.database import get_read_session
+from app.aggregates import period_start
+from app.cache import cache
+from hts_common.responses import fetch_rows
 
 router = APIRouter()
 
 @router.get("/stats/{username}", response_model=AnalyticsStats)
-def get_stats(username: str, session: Session = Depends(get_session)):
-    statement = select(AnalyticsStats).where(AnalyticsStats.username == username)
-    result = session.exec(statement).first()
-    if not result:
-        raise HTTPException(status_code=404, detail="Stats not found")
-    return result
+def get_stats(username: str, request: Request, session: Session = Depends(get_read_session)):
+    def load():
+        statement = select(AnalyticsStats).where(AnalyticsStats.username == username)
+        result = session.exec(statement).first()
+        if not result:
+            raise HTTPException(status_code=404, detail="Stats not found")
+        return result
+    return cache.respond(request, username, load)
 
 @router.get("/stats/daily/{username}", response_model=List[DailyHealthStats])
-def get_daily_stats(username: str, session: Session = Depends(get_session)):
-    statement = select(DailyHealthStats).where(DailyHealthStats.username == username).order_by(DailyHealthStats.date.desc())
-    return session.exec(statement).all()
+def get_daily_stats(username: str, request: Request, session: Session = Depends(get_read_session)):
+    def load():
+        statement = select(DailyHealthStats).where(DailyHealthStats.username == username).order_by(DailyHealthStats.date.desc())
+        return fetch_rows(session, statement)
+    return cache.respond(request, username, load)
+
+@router.get("/stats/range/{username}", response_model=List[HealthStatsPeriod])
+def get_stats_range(
+    username: str,
+    request: Request,
+    from_date: date = Query(alias="from"),
+    to_date: date = Query(alias="to"),
+    granularity: Optional[Literal["day", "week", "month"]] = None,
+    session: Session = Depends(get_read_session)
+):
+    """
+    Stats between two dates at day, week or month resolution. Week and month
+    rows come from the rollup table, so a year is ~12 rows instead of 365.
+    Without `granularity`, the coarsest level that still shows the shape of
+    the range is used: days up to a month, weeks up to six months, then months.
+    """
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+
+    if granularity is None:
+        span = (to_date - from_date).days + 1
+        granularity = "day" if span <= 31 else "week" if span <= 183 else "month"
+
+    def load():
+        if granularity == "day":
+            statement = select(DailyHealthStats).where(
+                DailyHealthStats.username == username,
+                DailyHealthStats.date >= from_date,
+                DailyHealthStats.date <= to_date
+            ).order_by(DailyHealthStats.date.asc())
+            rows = fetch_rows(session, statement)
+            for row in rows:
+                del row["id"]
+                row["granularity"] = "day"
+                row["period_start"] = row.pop("date")
+            return rows
+
+        # Include the period that contains `from`
+        statement = select(HealthStatsRollup).where(
+            HealthStatsRollup.username == username,
+            HealthStatsRollup.granularity == granularity,
+            HealthStatsRollup.period_start >= period_start(from_date, granularity),
+            HealthStatsRollup.period_start <= to_date
+        ).order_by(HealthStatsRollup.period_start.asc())
+        rows = fetch_rows(session, statement)
+        for row in rows:
+            del row["id"]
+        return rows
+    return cache.respond(request, username, load)
 
 @router.get("/insights/{username}", response_model=List[HealthInsight])
-def get_insights(username: str, session: Session = Depends(get_session)):
-    statement = select(HealthInsight).where(HealthInsight.username == username).order_by(HealthInsight.timestamp.desc())
-    return session.exec(statement).all()
+def get_insights(username: str, request: Request, session: Session = Depends(get_read_session)):
+    def load():
+        statement = select(HealthInsight).where(HealthInsight.username == username).order_by(HealthInsight.timestamp.desc())
+        return fetch_rows(session, statement)
+    return cache.respond(request, username, load)
 
 @router.get("/summary/{username}", response_model=dict)
-def get_summary(username: str, session: Session = Depends(get_session)):
+def get_summary(username: str, request: Request, session: Session = Depends(get_read_session)):
     from app.engine import generate_summary_text
-    summary_text = generate_summary_text(username, session)
-    return {"summary": summary_text}
+    def load():
+        summary_text = generate_summary_text(username, session)
+        return {"summary": summary_text}
+    return cache.respond(request, username, load)
+
+@router.get("/cache/stats", response_model=dict)
+def get_cache_stats():
+    """Hit ratio and memory of the read cache (this process, or the shared Redis)."""
+    return cache.stats()
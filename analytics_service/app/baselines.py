@@ -0,0 +1,130 @@
+"""
+Per-user streaming baselines for anomaly detection.
+
+Each metric keeps an exponentially weighted mean and variance of its daily value
+(the daily total for steps/sleep, the daily average otherwise). Updates use the
+weighted Welford recurrence, so a new day costs O(1) and no history is read:
+
+    weight = DECAY * weight + 1
+    mean  += (x - mean) / weight
+    m2     = DECAY * m2 + (x - old_mean) * (x - mean)      variance = m2 / weight
+
+The day in progress is not part of the baseline. It is scored against it and
+folded in once an event for a later day arrives. baseline_from_series() computes
+the same state in one vectorized pass for backfills.
+"""
+import os
+import math
+from typing import List, NamedTuple, Optional, Sequence
+from sqlmodel import Session, select
+from app.models import DailyHealthStats, UserBaseline
+from app.aggregates import METRICS, TOTAL_COLUMNS, sum_column
+
+BASELINE_SPAN_DAYS = int(os.getenv("BASELINE_SPAN_DAYS", "28"))
+BASELINE_MIN_DAYS = int(os.getenv("BASELINE_MIN_DAYS", "7"))
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3"))
+
+DECAY = 1 - 2 / (BASELINE_SPAN_DAYS + 1)
+# Very stable metrics (e.g. weight) would otherwise flag tiny changes
+MIN_RELATIVE_STD = 0.02
+
+DAYS, WEIGHT, MEAN, M2, OPEN = range(5)
+
+class Anomaly(NamedTuple):
+    metric: str
+    value: float
+    mean: float
+    z: float
+
+def daily_value(daily: DailyHealthStats, metric: str) -> Optional[float]:
+    if not getattr(daily, f"{metric}_count"):
+        return None
+    if metric in TOTAL_COLUMNS:
+        return getattr(daily, sum_column(metric))
+    return getattr(daily, f"avg_{metric}")
+
+def fold(stats: list, value: float):
+    stats[WEIGHT] = DECAY * stats[WEIGHT] + 1
+    delta = value - stats[MEAN]
+    stats[MEAN] += delta / stats[WEIGHT]
+    stats[M2] = DECAY * stats[M2] + delta * (value - stats[MEAN])
+    stats[DAYS] += 1
+
+def zscore(stats: list, value: float) -> Optional[float]:
+    if stats[DAYS] < BASELINE_MIN_DAYS:
+        return None
+    std = max(math.sqrt(max(stats[M2], 0.0) / stats[WEIGHT]), abs(stats[MEAN]) * MIN_RELATIVE_STD)
+    if std == 0:
+        return None
+    return (value - stats[MEAN]) / std
+
+def observe_day(session: Session, username: str, daily: DailyHealthStats, metrics: Sequence[str]) -> List[Anomaly]:
+    """
+    Records the current values of `metrics` for `daily` and returns the ones that
+    deviate from the user's baseline by ANOMALY_Z_THRESHOLD or more. Caller commits.
+    """
+    statement = select(UserBaseline).where(UserBaseline.username == username).with_for_update()
+    baseline = session.exec(statement).first()
+    if not baseline:
+        baseline = UserBaseline(username=username)
+
+    # Copy so the JSON column is seen as modified
+    state = {metric: list(stats) for metric, stats in baseline.state.items()}
+
+    if baseline.day is None or daily.date > baseline.day:
+        for stats in state.values():
+            if stats[OPEN] is not None:
+                fold(stats, stats[OPEN])
+                stats[OPEN] = None
+        baseline.day = daily.date
+
+    anomalies = []
+    for metric in metrics:
+        value = daily_value(daily, metric)
+        stats = state.setdefault(metric, [0, 0.0, 0.0, 0.0, None])
+        if daily.date == baseline.day:
+            stats[OPEN] = value
+        # Older days are already part of the baseline and are only scored
+        if value is None:
+            continue
+
+        z = zscore(stats, value)
+        if z is None or abs(z) < ANOMALY_Z_THRESHOLD:
+            continue
+        if metric in TOTAL_COLUMNS and z < 0:
+            continue # The day is still in progress, a low total is expected
+        anomalies.append(Anomaly(metric, value, stats[MEAN], z))
+
+    baseline.state = state
+    session.add(baseline)
+    return anomalies
+
+def baseline_from_series(values: Sequence[float]) -> list:
+    """Vectorized equivalent of folding `values` (oldest first) one by one."""
+    import numpy as np # Only needed by backfills
+
+    x = np.asarray(values, dtype=float)
+    if x.size == 0:
+        return [0, 0.0, 0.0, 0.0, None]
+    weights = DECAY ** np.arange(x.size - 1, -1, -1, dtype=float)
+    weight = weights.sum()
+    mean = float(weights @ x / weight)
+    m2 = float(weights @ (x - mean) ** 2)
+    return [int(x.size), float(weight), mean, m2, None]
+
+def rebuild_baseline(username: str, days: List[DailyHealthStats]) -> UserBaseline:
+    """Baseline state from a user's full daily history; the latest day stays open."""
+    days = sorted(days, key=lambda d: d.date)
+    if not days:
+        return UserBaseline(username=username)
+
+    closed, current = days[:-1], days[-1]
+    state = {}
+    for metric in METRICS:
+        series = [v for v in (daily_value(d, metric) for d in closed) if v is not None]
+        stats = baseline_from_series(series)
+        stats[OPEN] = daily_value(current, metric)
+        if stats[DAYS] or stats[OPEN] is not None:
+            state[metric] = stats
+
+    return UserBaseline(username=username, day=current.date, state=state)
@@ -0,0 +1,262 @@
+"""
+Read-through cache for the analytics read endpoints.
+
+Responses are cached as serialized JSON (orjson) plus an ETag, keyed per user,
+so a hit skips both Postgres and serialization, and a matching If-None-Match
+costs a 304.
+
+Backends:
+- memory (default): bounded LRU with TTL, per API process.
+- redis (CACHE_REDIS_URL set): one hash per user shared by all processes. Any
+  Redis-compatible server works.
+
+The worker writes stats and insights in another process, so after each event it
+publishes `analytics.cache.invalidate` and every API process drops that user
+(see listen_for_invalidations). The TTL bounds staleness if a message is missed.
+"""
+import os
+import json
+import asyncio
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set, Tuple
+from fastapi import Request, Response
+from hts_common.responses import dumps
+from hts_common.instrumentation import amqp_headers, consume_span, get_logger
+
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+RABBITMQ_URL = os.getenv("RABBITMQ_URL")
+
+INVALIDATE_ROUTING_KEY = "analytics.cache.invalidate"
+
+# Entry overhead beyond key and body (tuple, OrderedDict node, floats)
+ENTRY_OVERHEAD_BYTES = 200
+
+logger = get_logger("analytics.cache")
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[float, str, bytes]]" = OrderedDict()
+        self.user_keys: Dict[str, Set[str]] = {}
+        self.bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _size(self, key: Tuple[str, str], body: bytes) -> int:
+        return len(key[0]) + len(key[1]) + len(body) + ENTRY_OVERHEAD_BYTES
+
+    def _remove(self, key: Tuple[str, str]):
+        _, _, body = self.entries.pop(key)
+        self.bytes -= self._size(key, body)
+        keys = self.user_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key[1])
+            if not keys:
+                del self.user_keys[key[0]]
+
+    def get(self, username: str, key: str) -> Optional[Tuple[str, bytes]]:
+        with self.lock:
+            entry = self.entries.get((username, key))
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove((username, key))
+                return None
+            self.entries.move_to_end((username, key))
+            return entry[1], entry[2]
+
+    def set(self, username: str, key: str, etag: str, body: bytes):
+        size = self._size((username, key), body)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if (username, key) in self.entries:
+                self._remove((username, key))
+            self.entries[(username, key)] = (time.monotonic() + self.ttl, etag, body)
+            self.user_keys.setdefault(username, set()).add(key)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, username: str):
+        with self.lock:
+            for key in list(self.user_keys.get(username, ())):
+                self._remove((username, key))
+
+    def info(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "memory_bytes": self.bytes, "evictions": self.evictions}
+
+class RedisBackend:
+    """Hash `analytics:cache:<username>` of key -> "<etag> <body>", expiring as a whole."""
+    name = "redis"
+
+    def __init__(self, url: str, ttl: float):
+        import redis # Only needed when CACHE_REDIS_URL is set
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.ttl = max(1, int(ttl))
+
+    def _hash(self, username: str) -> str:
+        return f"analytics:cache:{username}"
+
+    def get(self, username: str, key: str) -> Optional[Tuple[str, bytes]]:
+        value = self.client.hget(self._hash(username), key)
+        if value is None:
+            return None
+        etag, _, body = value.partition(b" ")
+        return etag.decode(), body
+
+    def set(self, username: str, key: str, etag: str, body: bytes):
+        pipe = self.client.pipeline()
+        pipe.hset(self._hash(username), key, etag.encode() + b" " + body)
+        pipe.expire(self._hash(username), self.ttl)
+        pipe.execute()
+
+    def invalidate(self, username: str):
+        self.client.delete(self._hash(username))
+
+    def info(self) -> dict:
+        memory = self.client.info("memory")
+        return {"entries": None, "memory_bytes": memory.get("used_memory"), "evictions": None}
+
+class ResponseCache:
+    def __init__(self):
+        if CACHE_REDIS_URL:
+            self.backend = RedisBackend(CACHE_REDIS_URL, CACHE_TTL_SECONDS)
+        else:
+            self.backend = MemoryBackend(CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.errors = 0
+
+    def _get(self, username: str, key: str) -> Optional[Tuple[str, bytes]]:
+        try:
+            return self.backend.get(username, key)
+        except Exception as e:
+            # A cache outage must not take the endpoints down
+            self.errors += 1
+            logger.warning("Cache read failed", error=str(e))
+            return None
+
+    def _set(self, username: str, key: str, etag: str, body: bytes):
+        try:
+            self.backend.set(username, key, etag, body)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Cache write failed", error=str(e))
+
+    def invalidate(self, username: str):
+        try:
+            self.backend.invalidate(username)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Cache invalidation failed", username=username, error=str(e))
+
+    def respond(self, request: Request, username: str, load: Callable[[], object]) -> Response:
+        """
+        Serves `load()` through the cache. `load` may raise HTTPException,
+        which is never cached.
+        """
+        key = request.url.path
+        if request.url.query:
+            key += "?" + request.url.query
+
+        cached = self._get(username, key)
+        if cached:
+            self.hits += 1
+            etag, body = cached
+        else:
+            self.misses += 1
+            body = dumps(load())
+            etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+            self._set(username, key, etag, body)
+
+        # Clients must revalidate, which is what makes the 304s possible
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag in request.headers.get("if-none-match", ""):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            **self.backend.info(),
+        }
+
+cache = ResponseCache()
+
+async def publish_invalidation(channel, username: str):
+    """Called by the worker after it changed a user's stats or insights."""
+    from aio_pika import Message
+    cache.invalidate(username) # Shared backend (redis), or an API running in this process
+    exchange = await channel.declare_exchange("health_events", passive=True)
+    await exchange.publish(
+        Message(body=json.dumps({"username": username}).encode(), content_type="application/json", headers=amqp_headers()),
+        routing_key=INVALIDATE_ROUTING_KEY
+    )
+
+async def listen_for_invalidations():
+    """
+    Subscribes this API process to invalidation messages through its own
+    exclusive queue, so every replica receives every message. Runs as a
+    background task until cancelled: it retries with backoff until RabbitMQ is
+    up, and the robust connection then re-declares the queue and resumes
+    consuming after a broker restart. Until subscribed, the TTL bounds staleness.
+    """
+    from aio_pika import IncomingMessage
+    from app.database import reads
+    from hts_common.readiness import connect_broker, wait_for
+    from hts_common.replicas import REPLICA_CHECK_INTERVAL, REPLICA_MAX_LAG
+
+    async def on_invalidate(message: IncomingMessage):
+        async with message.process():
+            with consume_span(message):
+                try:
+                    username = json.loads(message.body)["username"]
+                except (ValueError, KeyError):
+                    logger.warning("Ignoring malformed cache invalidation")
+                    return
+                cache.invalidate(username)
+                # Refill from the primary: a replica may not have the worker's write yet,
+                # and a stale refill would be served until the TTL
+                reads.pin(username, REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL)
+
+    async def subscribe():
+        connection = await connect_broker(RABBITMQ_URL)
+        try:
+            channel = await connection.channel()
+            exchange = await channel.declare_exchange("health_events", type="topic")
+            queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+            await queue.bind(exchange, routing_key=INVALIDATE_ROUTING_KEY)
+            await queue.consume(on_invalidate)
+        except BaseException:
+            await connection.close()
+            raise
+        return connection
+
+    try:
+        connection = await wait_for("rabbitmq", subscribe)
+    except TimeoutError as e: # STARTUP_TIMEOUT
+        logger.warning("Cache invalidation listener unavailable, relying on TTL", error=str(e))
+        return
+    try:
+        await asyncio.Future()
+    finally:
+        await connection.close()
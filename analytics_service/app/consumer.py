@@ -1,26 +1,30 @@
-import json
-from datetime import datetime
-from aio_pika import IncomingMessage
+from datetime import date, datetime
+from typing import Optional
 from sqlmodel import Session, select
 from app.database import engine
-from app.models import AnalyticsStats, DailyHealthStats, HealthInsight
+from app.models import AnalyticsStats, DailyHealthStats, HealthInsight, HealthReading
 from app.engine import generate_insights
+from app.aggregates import METRICS, add_reading, get_rollups, recompute_bounds, remove_reading, replace_reading
+from app.baselines import observe_day
+from app.cache import publish_invalidation
+from hts_common.envelope import Event, decode_event, event_message, from_ms, new_event
+from hts_common.instrumentation import AMQP_PUBLISH_LATENCY, amqp_headers, get_logger
+from hts_common.retry import PermanentError, routing_key_of
 
-async def process_creation_event(event: dict):
-    username = event.get('username')
-    steps = event.get('steps') or 0
-    sleep = event.get('sleep_hours') or 0.0
-    weight = event.get('weight') or 0.0
-    heart_rate = event.get('heart_rate')
+logger = get_logger("analytics.consumer")
+
+def record_date(timestamp_ms) -> Optional[date]:
+    return from_ms(timestamp_ms).date() if isinstance(timestamp_ms, int) else None
+
+async def process_creation_event(event: Event):
+    username = event.username
+    data = event.data
+    steps = data.get('steps') or 0
     
-    timestamp_str = event.get('timestamp')
-    try:
-        dt = datetime.fromisoformat(timestamp_str)
-        date_obj = dt.date()
-    except (ValueError, TypeError):
-        date_obj = datetime.utcnow().date()
+    date_obj = record_date(data.get('timestamp')) or datetime.utcnow().date()
         
-    with Session(engine) as session:
+    # Insights are read again by the caller to publish them, after this session is closed
+    with Session(engine, expire_on_commit=False) as session:
         # 1. Update Global Stats (Legacy)
         statement = select(AnalyticsStats).where(AnalyticsStats.username == username)
         stats = session.exec(statement).first()
@@ -41,31 +45,24 @@ async def process_creation_event(event: dict):
         if not daily:
             daily = DailyHealthStats(username=username, date=date_obj)
             
-        daily.total_steps += steps
-        daily.sleep_hours += sleep
-        if weight > 0:
-            daily.avg_weight = weight # Simplified: just take latest or we can avg
-            
-        if heart_rate:
-            if daily.heart_rate_count == 0:
-                daily.avg_heart_rate = float(heart_rate)
-                daily.min_heart_rate = heart_rate
-                daily.max_heart_rate = heart_rate
-            else:
-                # Iterative average
-                total_hr = daily.avg_heart_rate * daily.heart_rate_count + heart_rate
-                daily.avg_heart_rate = total_hr / (daily.heart_rate_count + 1)
-                
-                daily.min_heart_rate = min(daily.min_heart_rate, heart_rate)
-                daily.max_heart_rate = max(daily.max_heart_rate, heart_rate)
-            daily.heart_rate_count += 1
-            
-        session.add(daily)
-        session.commit()
-        session.refresh(daily)
+        # Weekly/monthly rollups receive exactly the same readings as the day
+        metrics = [metric for metric in METRICS if data.get(metric) is not None]
+        if event.record_id is not None:
+            session.merge(HealthReading(
+                username=username, record_id=event.record_id, date=date_obj,
+                **{metric: data[metric] for metric in metrics}
+            ))
+        for stats_row in [daily] + get_rollups(session, username, date_obj):
+            for metric in metrics:
+                add_reading(stats_row, metric, data[metric])
+            session.add(stats_row)
+
+        # 3. Score against (and advance) the user's baseline
+        anomalies = observe_day(session, username, daily, metrics)
         
-        # 3. Generate Insights
-        insights = generate_insights(username, daily, session)
+        # 4. Generate Insights, committed with the stats: a retried event must
+        # not find its reading counted but its insights missing
+        insights = generate_insights(username, daily, anomalies)
         for insight in insights:
             session.add(insight)
             # Publish event for Notification Service
@@ -79,58 +76,65 @@ async def process_creation_event(event: dict):
             # But wait, we are in `on_message` scope in the caller.
             
         session.commit()
-        print(f" [Analytics] Processed event for {username}. Generated {len(insights)} insights.")
+        logger.info("Processed event", username=username, insights=len(insights))
         
         return insights # Return insights so caller can publish
 
-async def on_message(message: IncomingMessage):
-    async with message.process():
-        event = json.loads(message.body)
-        routing_key = message.routing_key
-        
-        print(f" [Analytics] Received event: {routing_key}")
-        
-        if "created" in routing_key:
-            insights = await process_creation_event(event)
-            # ... (Publishing logic kept same, see below) ...
-            if insights:
-                channel = message.channel
-                exchange = await channel.declare_exchange("health_events", passive=True)
-                from aio_pika import Message
-                for insight in insights:
-                    # ... (Publishing code) ...
-                    insight_event = {
-                        "username": insight.username,
-                        "type": insight.type,
-                        "severity": insight.severity,
-                        "message": insight.message,
-                        "timestamp": insight.timestamp.isoformat()
-                    }
-                    await exchange.publish(
-                        Message(
-                            body=json.dumps(insight_event).encode(),
-                            content_type="application/json"
-                        ),
-                        routing_key=f"analysis.insight.{insight.type}"
-                    )
+async def handle_message(message):
+    """An aio_pika IncomingMessage, consumed through hts_common/retry.py:
+    exceptions are retried, PermanentError dead-lettered."""
+    routing_key = routing_key_of(message)
+    try:
+        event = decode_event(message.body, message.content_type, routing_key)
+    except ValueError as e:
+        raise PermanentError(f"Undecodable event: {e}")
+    
+    logger.info("Received event", routing_key=routing_key, event_id=event.id, schema=event.schema)
+    
+    if "created" in routing_key:
+        insights = await process_creation_event(event)
+        if insights:
+            # Stats are committed by now: a retry would count the reading twice
+            try:
+                await publish_insights(message.channel, event, insights)
+            except Exception as e:
+                logger.error("Failed to publish insights", username=event.username, insights=len(insights), error=str(e))
 
-        elif "updated" in routing_key:
-            await process_update_event(event)
-        
-        elif "deleted" in routing_key:
-            await process_deletion_event(event)
+    elif "updated" in routing_key:
+        await process_update_event(event)
+    
+    elif "deleted" in routing_key:
+        await process_deletion_event(event)
 
-async def process_update_event(event: dict):
-    username = event.get('username')
-    updated_fields = event.get('updated_fields', {})
-    old_data = event.get('old_data', {})
-    timestamp_str = event.get('timestamp')
+    # Stats and insights of this user changed; drop their cached responses
+    username = event.username
+    if username:
+        try:
+            await publish_invalidation(message.channel, username)
+        except Exception as e:
+            logger.warning("Cache invalidation failed", username=username, error=str(e))
+
+async def publish_insights(channel, event: Event, insights):
+    exchange = await channel.declare_exchange("health_events", passive=True)
+    for insight in insights:
+        insight_key = f"analysis.insight.{insight.type}"
+        insight_event = new_event(insight_key, insight.username, {
+            "type": insight.type,
+            "severity": insight.severity,
+            "message": insight.message,
+            "timestamp": insight.timestamp
+        }, record_id=event.record_id, at=insight.timestamp)
+        with AMQP_PUBLISH_LATENCY.time(routing_key=insight_key):
+            await exchange.publish(event_message(insight_event, headers=amqp_headers()), routing_key=insight_key)
+
+async def process_update_event(event: Event):
+    username = event.username
+    updated_fields = event.data.get('updated_fields', {})
+    old_data = event.data.get('old_data', {})
     
-    try:
-        dt = datetime.fromisoformat(timestamp_str)
-        date_obj = dt.date()
-    except:
-        return
+    date_obj = record_date(event.data.get('timestamp'))
+    if date_obj is None:
+        raise PermanentError("Update event without a valid timestamp")
 
     with Session(engine) as session:
         # Get Daily Stats
@@ -142,40 +146,28 @@ async def process_update_event(event: dict):
         if not daily:
             return # Nothing to update if no stats exist
             
-        # 1. Update Steps
-        if 'steps' in updated_fields:
-            delta = updated_fields['steps'] - old_data.get('steps', 0)
-            daily.total_steps += delta
-            
-        # 2. Update Sleep
-        if 'sleep_hours' in updated_fields:
-            delta = updated_fields['sleep_hours'] - old_data.get('sleep_hours', 0.0)
-            daily.sleep_hours += delta
-            
-        # 3. Update Heart Rate (Approximate: Update Avg)
-        if 'heart_rate' in updated_fields:
-            new_hr = updated_fields['heart_rate']
-            old_hr = old_data.get('heart_rate')
-            if old_hr and daily.heart_rate_count > 0:
-                current_total = daily.avg_heart_rate * daily.heart_rate_count
-                new_total = current_total - old_hr + new_hr
-                daily.avg_heart_rate = new_total / daily.heart_rate_count
-                # Note: Min/Max endpoints are hard to correct without full history re-scan
-                
-        session.add(daily)
+        metrics = [metric for metric in METRICS if metric in updated_fields]
+        reading = session.get(HealthReading, (username, event.record_id)) if event.record_id is not None else None
+        if reading:
+            for metric in metrics:
+                setattr(reading, metric, updated_fields[metric])
+            session.add(reading)
+        for stats_row in [daily] + get_rollups(session, username, date_obj):
+            for metric in metrics:
+                if replace_reading(stats_row, metric, old_data.get(metric), updated_fields[metric]):
+                    recompute_bounds(session, stats_row, metric)
+            session.add(stats_row)
+        observe_day(session, username, daily, metrics) # Keeps the open day's values current
         session.commit()
-        print(f" [Analytics] Updated stats for {username}")
+        logger.info("Updated stats", username=username)
 
-async def process_deletion_event(event: dict):
-    username = event.get('username')
-    deleted_record = event.get('deleted_record', {})
-    timestamp_str = deleted_record.get('timestamp')
+async def process_deletion_event(event: Event):
+    username = event.username
+    deleted_record = event.data.get('deleted_record', {})
     
-    try:
-        dt = datetime.fromisoformat(timestamp_str)
-        date_obj = dt.date()
-    except:
-        return
+    date_obj = record_date(deleted_record.get('timestamp'))
+    if date_obj is None:
+        raise PermanentError("Deletion event without a valid timestamp")
 
     with Session(engine) as session:
         stmt = select(DailyHealthStats).where(
@@ -186,25 +178,15 @@ async def process_deletion_event(event: dict):
         if not daily:
             return
 
-        # 1. Subtract Steps
-        daily.total_steps -= deleted_record.get('steps', 0)
-        
-        # 2. Subtract Sleep
-        daily.sleep_hours -= deleted_record.get('sleep_hours', 0.0)
-        
-        # 3. Adjust Heart Rate
-        hr = deleted_record.get('heart_rate')
-        if hr and daily.heart_rate_count > 0:
-            current_total = daily.avg_heart_rate * daily.heart_rate_count
-            new_total = current_total - hr
-            daily.heart_rate_count -= 1
-            if daily.heart_rate_count > 0:
-                daily.avg_heart_rate = new_total / daily.heart_rate_count
-            else:
-                daily.avg_heart_rate = 0.0
-                daily.min_heart_rate = None
-                daily.max_heart_rate = None
-
-        session.add(daily)
+        metrics = [metric for metric in METRICS if deleted_record.get(metric) is not None]
+        reading = session.get(HealthReading, (username, event.record_id)) if event.record_id is not None else None
+        if reading:
+            session.delete(reading)
+        for stats_row in [daily] + get_rollups(session, username, date_obj):
+            for metric in metrics:
+                if remove_reading(stats_row, metric, deleted_record[metric]):
+                    recompute_bounds(session, stats_row, metric)
+            session.add(stats_row)
+        observe_day(session, username, daily, metrics)
         session.commit()
-        print(f" [Analytics] Adjusted stats for {username} (Deletion)")
+        logger.info("Adjusted stats after deletion", username=username)
@@ -1,24 +1,51 @@
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List
 from sqlmodel import Session, select
 from app.models import DailyHealthStats, HealthInsight
+from app.aggregates import sum_column
+from app.baselines import Anomaly
 
-def generate_insights(username: str, current_stats: DailyHealthStats, session: Session) -> List[HealthInsight]:
+# metric -> (label, unit suffix, severity of a deviation)
+ANOMALY_LABELS = {
+    "heart_rate": ("average heart rate", " bpm", "WARNING"),
+    "systolic": ("average systolic pressure", " mmHg", "WARNING"),
+    "diastolic": ("average diastolic pressure", " mmHg", "WARNING"),
+    "blood_sugar": ("average blood sugar", "", "WARNING"),
+    "body_temperature": ("average body temperature", "", "WARNING"),
+    "weight": ("average weight", "", "INFO"),
+    "sleep_hours": ("sleep", " hours", "INFO"),
+}
+
+def generate_insights(username: str, current_stats: DailyHealthStats, anomalies: List[Anomaly]) -> List[HealthInsight]:
     """
-    Analyzes the user's latest daily stats against history to generate insights.
+    Turns the user's latest daily stats, and the metrics that deviate from their
+    baseline (see app/baselines.py), into insights.
     """
     insights = []
     
-    # 1. Anomaly Detection: Heart Rate
-    if current_stats.avg_heart_rate > 100:
+    # 1. Anomaly Detection: deviations from the user's own baseline
+    for anomaly in anomalies:
+        if anomaly.metric not in ANOMALY_LABELS:
+            continue
+        label, unit, severity = ANOMALY_LABELS[anomaly.metric]
+        direction = "above" if anomaly.z > 0 else "below"
         insights.append(HealthInsight(
             username=username,
             type="Anomaly",
-            severity="WARNING",
-            message=f"Your average heart rate today was high ({current_stats.avg_heart_rate:.1f} bpm). Resting heart rates above 100 bpm may indicate stress or other issues."
+            severity=severity,
+            message=f"Your {label} today ({anomaly.value:.1f}{unit}) is well {direction} your recent baseline ({anomaly.mean:.1f}{unit})."
         ))
     
-    # 2. Anomaly Detection: Sleep
+    # 2. Anomaly Detection: Blood Pressure
+    if current_stats.systolic_count > 0 and (current_stats.avg_systolic >= 140 or current_stats.avg_diastolic >= 90):
+        insights.append(HealthInsight(
+            username=username,
+            type="Anomaly",
+            severity="WARNING",
+            message=f"Your average blood pressure today was {current_stats.avg_systolic:.0f}/{current_stats.avg_diastolic:.0f} mmHg. Readings of 140/90 or above are considered high."
+        ))
+
+    # 3. Anomaly Detection: Sleep
     if current_stats.sleep_hours > 0 and current_stats.sleep_hours < 6:
         insights.append(HealthInsight(
             username=username,
@@ -27,7 +54,7 @@ def generate_insights(username: str, current_stats: DailyHealthStats, session: S
             message=f"You only slept {current_stats.sleep_hours} hours. Adequate sleep (7-9 hours) is crucial for recovery."
         ))
 
-    # 3. Achievement: Steps
+    # 4. Achievement: Steps
     if current_stats.total_steps >= 10000:
         insights.append(HealthInsight(
             username=username,
@@ -43,22 +70,14 @@ def generate_insights(username: str, current_stats: DailyHealthStats, session: S
             message="You've been quite sedentary today (<1000 steps). Try taking a short walk."
         ))
 
-    # 4. Trend Analysis (Simple: Compare with yesterday)
-    yesterday = current_stats.date - timedelta(days=1)
-    statement = select(DailyHealthStats).where(
-        DailyHealthStats.username == username, 
-        DailyHealthStats.date == yesterday
-    )
-    yesterday_stats = session.exec(statement).first()
-    
-    if yesterday_stats:
-        # Steps Trend
-        if current_stats.total_steps > yesterday_stats.total_steps * 1.2:
-             insights.append(HealthInsight(
+    # 5. Trend Analysis: steps well above the user's baseline
+    for anomaly in anomalies:
+        if anomaly.metric == "steps":
+            insights.append(HealthInsight(
                 username=username,
                 type="Trend",
                 severity="INFO",
-                message="Your activity levels are trending up! You walked 20% more than yesterday."
+                message=f"Your activity levels are trending up! You walked {anomaly.value:,.0f} steps today, well above your usual {anomaly.mean:,.0f}."
             ))
         
     
@@ -88,9 +107,15 @@ def generate_summary_text(username: str, session: Session) -> str:
     total_sleep = sum(s.sleep_hours for s in stats)
     avg_sleep = total_sleep / days_logged if days_logged else 0
     
-    avg_hr = sum(s.avg_heart_rate for s in stats if s.avg_heart_rate > 0)
-    hr_days = sum(1 for s in stats if s.avg_heart_rate > 0)
-    final_avg_hr = avg_hr / hr_days if hr_days else 0
+    # Count-weighted averages straight from the pre-aggregated sums
+    def weekly_avg(metric: str) -> float:
+        count = sum(getattr(s, f"{metric}_count") for s in stats)
+        return sum(getattr(s, sum_column(metric)) for s in stats) / count if count else 0
+
+    final_avg_hr = weekly_avg("heart_rate")
+    avg_systolic = weekly_avg("systolic")
+    avg_diastolic = weekly_avg("diastolic")
+    avg_weight = weekly_avg("weight")
     
     # Narrative Generation
     parts = [f"Health Summary for the last {days_logged} days:"]
@@ -117,5 +142,16 @@ def generate_summary_text(username: str, session: Session) -> str:
              parts.append(f"Your average heart rate is healthy at {int(final_avg_hr)} bpm.")
         else:
              parts.append(f"Your average heart rate ({int(final_avg_hr)} bpm) is a bit high. Watch out for stress.")
+
+    # Blood Pressure
+    if avg_systolic > 0:
+        if avg_systolic >= 140 or avg_diastolic >= 90:
+            parts.append(f"Your blood pressure averaged {int(avg_systolic)}/{int(avg_diastolic)} mmHg, which is high. Consider talking to a doctor.")
+        else:
+            parts.append(f"Your blood pressure averaged {int(avg_systolic)}/{int(avg_diastolic)} mmHg.")
+
+    # Weight
+    if avg_weight > 0:
+        parts.append(f"Your weight averaged {avg_weight:.1f} kg.")
              
     return " ".join(parts)
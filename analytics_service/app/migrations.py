@@ -0,0 +1,63 @@
+"""
+Schema migrations of this service, applied in order by the shared runner
+(hts_common.migrations, which documents the rules). Append new ones, never
+edit applied ones.
+"""
+from typing import List
+from sqlalchemy import text
+import app.models # Registers the tables the migrations refer to
+from hts_common import migrations as runner
+from hts_common.migrations import Migration, add_columns, create_models
+
+def add_blood_pressure_columns(connection):
+    add_columns(connection, "dailyhealthstats", [
+        f"{prefix}{metric}{suffix}"
+        for metric in ("systolic", "diastolic")
+        for prefix, suffix in (("avg_", ""), ("min_", ""), ("max_", ""), ("", "_count"))
+    ])
+
+def add_metric_aggregate_columns(connection):
+    from app.models import DailyHealthStats
+    add_columns(connection, "dailyhealthstats", DailyHealthStats.__table__.columns.keys())
+
+def backfill_metric_aggregates(connection):
+    """
+    Fills the count/sum/min/max columns of days aggregated before every metric
+    kept them, so later removals and rollup merges see their readings.
+    """
+    from app.aggregates import sum_column
+    from app.models import DailyHealthStats
+
+    # Averaged metrics kept avg and count, which give the sum
+    for metric in ("heart_rate", "systolic", "diastolic", "weight"):
+        total = f"avg_{metric} * {metric}_count"
+        if DailyHealthStats.__table__.c[f"{metric}_sum"].type.python_type is int:
+            total = f"CAST(ROUND({total}) AS INTEGER)"
+        connection.execute(text(
+            f"UPDATE dailyhealthstats SET {metric}_sum = {total} WHERE {metric}_count > 0 AND {metric}_sum = 0"
+        ))
+    # Weight kept only the latest reading, steps and sleep a daily total: such days count as one reading
+    for metric, value in (("weight", "avg_weight"), ("steps", "total_steps"), ("sleep_hours", "sleep_hours")):
+        connection.execute(text(
+            f"UPDATE dailyhealthstats SET {sum_column(metric)} = {value}, {metric}_count = 1, "
+            f"min_{metric} = {value}, max_{metric} = {value} WHERE {metric}_count = 0 AND {value} > 0"
+        ))
+
+def create_health_readings(connection):
+    from app.models import HealthReading
+    HealthReading.__table__.create(connection, checkfirst=True)
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", create_models),
+    Migration(2, "blood_pressure_columns", add_blood_pressure_columns),
+    Migration(3, "metric_aggregate_columns", add_metric_aggregate_columns),
+    Migration(4, "backfill_metric_aggregates", backfill_metric_aggregates),
+    Migration(5, "health_readings", create_health_readings),
+]
+
+def pending_migrations(engine) -> List[Migration]:
+    return runner.pending_migrations(engine, MIGRATIONS)
+
+def migrate(engine) -> int:
+    """Applies pending migrations, each in its own transaction. Returns how many."""
+    return runner.migrate(engine, MIGRATIONS)
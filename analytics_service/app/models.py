@@ -1,5 +1,6 @@
 from datetime import date as dt_date, datetime
 from typing import Optional
+from sqlalchemy import JSON, Column, Index, UniqueConstraint
 from sqlmodel import Field, SQLModel
 
 class AnalyticsStats(SQLModel, table=True):
@@ -9,25 +10,120 @@ class AnalyticsStats(SQLModel, table=True):
     record_count: int = 0
     average_steps: float = 0.0
 
-class DailyHealthStats(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    username: str = Field(index=True)
-    date: dt_date = Field(index=True)
-    
-    # Daily Aggregates
-    total_steps: int = 0
-    sleep_hours: float = 0.0
+class HealthStatsBase(SQLModel):
+    """
+    Aggregate columns shared by daily stats and rollups. Every metric keeps
+    count/sum/min/max (see app/aggregates.py); averaged metrics also keep
+    avg_<metric> = sum / count.
+    """
+    # Totals
+    total_steps: int = 0 # Sum of steps
+    steps_count: int = 0
+    min_steps: Optional[int] = None
+    max_steps: Optional[int] = None
+
+    sleep_hours: float = 0.0 # Sum of sleep
+    sleep_hours_count: int = 0
+    min_sleep_hours: Optional[float] = None
+    max_sleep_hours: Optional[float] = None
     
     # Heart Rate Stats
     avg_heart_rate: float = 0.0
+    heart_rate_sum: int = 0
     min_heart_rate: Optional[int] = None
     max_heart_rate: Optional[int] = None
-    heart_rate_count: int = 0 # Helper for avg calculation
+    heart_rate_count: int = 0
+
+    # Blood Pressure Stats (from the parsed systolic/diastolic readings)
+    avg_systolic: float = 0.0
+    systolic_sum: int = 0
+    min_systolic: Optional[int] = None
+    max_systolic: Optional[int] = None
+    systolic_count: int = 0
+    avg_diastolic: float = 0.0
+    diastolic_sum: int = 0
+    min_diastolic: Optional[int] = None
+    max_diastolic: Optional[int] = None
+    diastolic_count: int = 0
     
-    # Weight (taking the latest or avg)
+    # Weight (running average over the day's readings)
     avg_weight: float = 0.0
+    weight_sum: float = 0.0
+    min_weight: Optional[float] = None
+    max_weight: Optional[float] = None
     weight_count: int = 0
 
+    # Blood Sugar
+    avg_blood_sugar: float = 0.0
+    blood_sugar_sum: float = 0.0
+    min_blood_sugar: Optional[float] = None
+    max_blood_sugar: Optional[float] = None
+    blood_sugar_count: int = 0
+
+    # Body Temperature
+    avg_body_temperature: float = 0.0
+    body_temperature_sum: float = 0.0
+    min_body_temperature: Optional[float] = None
+    max_body_temperature: Optional[float] = None
+    body_temperature_count: int = 0
+
+class DailyHealthStats(HealthStatsBase, table=True):
+    __table_args__ = (
+        Index("ix_dailyhealthstats_username_date", "username", "date"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    username: str = Field(index=True)
+    date: dt_date = Field(index=True)
+
+class HealthStatsRollup(HealthStatsBase, table=True):
+    """Weekly (period_start = Monday) and monthly (period_start = 1st) totals of DailyHealthStats."""
+    __table_args__ = (
+        UniqueConstraint("username", "granularity", "period_start"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    username: str
+    granularity: str # "week" or "month"
+    period_start: dt_date
+
+class HealthReading(SQLModel, table=True):
+    """
+    The metrics of one health record, kept so that removing or changing the
+    reading a min/max came from can recompute it (app/aggregates.py).
+    """
+    __table_args__ = (
+        Index("ix_healthreading_username_date", "username", "date"),
+    )
+
+    username: str = Field(primary_key=True)
+    record_id: int = Field(primary_key=True)
+    date: dt_date
+    steps: Optional[int] = None
+    sleep_hours: Optional[float] = None
+    weight: Optional[float] = None
+    heart_rate: Optional[int] = None
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
+    blood_sugar: Optional[float] = None
+    body_temperature: Optional[float] = None
+
+class HealthStatsPeriod(HealthStatsBase):
+    """One row of a /stats/range response, whatever level it was read from."""
+    username: str
+    granularity: str
+    period_start: dt_date
+
+class UserBaseline(SQLModel, table=True):
+    """
+    Streaming per-user baseline of each metric's daily value (see app/baselines.py).
+    state maps metric -> [days, weight, mean, m2, open_value]; open_value is the
+    latest value of `day`, folded into the baseline once a later day arrives.
+    """
+    username: str = Field(primary_key=True)
+    day: Optional[dt_date] = None
+    state: dict = Field(default_factory=dict, sa_column=Column(JSON))
+
 class HealthInsight(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(index=True)
@@ -0,0 +1,43 @@
+"""
+Rebuilds the per-user anomaly baselines from DailyHealthStats.
+
+    python backfill_baselines.py [--username alice]
+
+Run once after deploying baselines (the consumer maintains them from then on),
+or after changing BASELINE_SPAN_DAYS. Each user's history is folded in a single
+vectorized pass (app/baselines.py: baseline_from_series), which gives the same
+state the consumer would have reached event by event.
+"""
+import argparse
+from sqlmodel import Session, select, delete
+from app.database import engine, create_db_and_tables
+from app.models import DailyHealthStats, UserBaseline
+from app.baselines import rebuild_baseline
+
+def rebuild_user(session: Session, username: str) -> int:
+    statement = select(DailyHealthStats).where(DailyHealthStats.username == username)
+    days = session.exec(statement).all()
+
+    session.exec(delete(UserBaseline).where(UserBaseline.username == username))
+    session.add(rebuild_baseline(username, days))
+    session.commit()
+    return len(days)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild per-user anomaly baselines")
+    parser.add_argument("--username", help="Only rebuild this user")
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        if args.username:
+            usernames = [args.username]
+        else:
+            usernames = session.exec(select(DailyHealthStats.username).distinct()).all()
+
+        for username in usernames:
+            count = rebuild_user(session, username)
+            print(f" [Baselines] {username}: {count} days")
+
+if __name__ == "__main__":
+    main()
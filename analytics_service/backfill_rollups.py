@@ -0,0 +1,48 @@
+"""
+Rebuilds the weekly and monthly rollups from DailyHealthStats.
+
+    python backfill_rollups.py [--username alice]
+
+Run once after deploying rollups (the consumer maintains them from then on),
+or at any time to repair drift. Each user is rebuilt in its own transaction.
+"""
+import argparse
+from sqlmodel import Session, select, delete
+from app.database import engine, create_db_and_tables
+from app.models import DailyHealthStats, HealthStatsRollup
+from app.aggregates import ROLLUP_GRANULARITIES, merge_stats, period_start
+
+def rebuild_user(session: Session, username: str) -> int:
+    session.exec(delete(HealthStatsRollup).where(HealthStatsRollup.username == username))
+
+    rollups = {}
+    statement = select(DailyHealthStats).where(DailyHealthStats.username == username)
+    for daily in session.exec(statement).all():
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (granularity, period_start(daily.date, granularity))
+            if key not in rollups:
+                rollups[key] = HealthStatsRollup(username=username, granularity=granularity, period_start=key[1])
+            merge_stats(rollups[key], daily)
+
+    session.add_all(rollups.values())
+    session.commit()
+    return len(rollups)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild weekly/monthly rollups")
+    parser.add_argument("--username", help="Only rebuild this user")
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        if args.username:
+            usernames = [args.username]
+        else:
+            usernames = session.exec(select(DailyHealthStats.username).distinct()).all()
+
+        for username in usernames:
+            count = rebuild_user(session, username)
+            print(f" [Rollups] {username}: {count} rollup rows")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,36 @@
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from app.database import create_db_and_tables
 from app.api import router as analytics_router
+from app.cache import listen_for_invalidations
+from hts_common.instrumentation import InstrumentationMiddleware, render_metrics, setup_logging
+
+setup_logging("analytics_service")
 
 app = FastAPI(title="Analytics Service")
+app.add_middleware(InstrumentationMiddleware)
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     create_db_and_tables()
+    # Subscribes in the background, so requests are served while RabbitMQ is down
+    app.state.invalidation_listener = asyncio.create_task(listen_for_invalidations())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.invalidation_listener.cancel()
+    try:
+        await app.state.invalidation_listener
+    except asyncio.CancelledError:
+        pass
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    return render_metrics()
+
 app.include_router(analytics_router)
@@ -0,0 +1,29 @@
+"""
+Applies pending schema migrations (app/migrations.py) and exits. Run it once
+before starting a release's processes; they would otherwise race to do it at
+startup (safe, but every one of them waits on the lock).
+
+    python migrate.py [--status]
+"""
+import argparse
+from app.database import engine
+from app.migrations import MIGRATIONS, migrate, pending_migrations
+from hts_common.readiness import wait_for_database
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--status", action="store_true", help="List migrations and whether they are applied")
+    args = parser.parse_args()
+
+    wait_for_database(engine)
+    if args.status:
+        pending = {m.version for m in pending_migrations(engine)}
+        for migration in MIGRATIONS:
+            print(f" [Migrations] {migration.version:>4} {migration.name}: {'pending' if migration.version in pending else 'applied'}")
+        return
+
+    count = migrate(engine)
+    print(f" [Migrations] Applied {count}, schema is up to date")
+
+if __name__ == "__main__":
+    main()
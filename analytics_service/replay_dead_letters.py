@@ -0,0 +1,38 @@
+"""
+Moves messages from analytics_queue.dlq back onto analytics_queue, for another
+RETRY_MAX_ATTEMPTS tries. Run it once whatever failed them is fixed.
+
+    python replay_dead_letters.py [--limit 10] [--dry-run]
+
+--dry-run only logs the dead letters (routing key, retries, last error) and
+leaves them in the queue. See hts_common/retry.py for the topology.
+"""
+import os
+import asyncio
+import argparse
+from aio_pika import connect
+from hts_common.retry import declare_retry_topology, replay_dead_letters
+from hts_common.instrumentation import setup_logging
+
+RABBITMQ_URL = os.getenv("RABBITMQ_URL")
+QUEUE = "analytics_queue"
+
+async def replay(limit, dry_run: bool) -> int:
+    connection = await connect(RABBITMQ_URL)
+    async with connection:
+        channel = await connection.channel()
+        await declare_retry_topology(channel, QUEUE)
+        return await replay_dead_letters(channel, QUEUE, limit=limit, dry_run=dry_run)
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Replay dead-lettered messages of {QUEUE}")
+    parser.add_argument("--limit", type=int, help="Replay at most this many messages")
+    parser.add_argument("--dry-run", action="store_true", help="List the messages without moving them")
+    args = parser.parse_args()
+
+    setup_logging("replay_dead_letters")
+    count = asyncio.run(replay(args.limit, args.dry_run))
+    print(f" [DLQ] {QUEUE}: {count} messages {'listed' if args.dry_run else 'replayed'}")
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,42 @@
 import os
 import asyncio
-from aio_pika import connect
 from app.database import create_db_and_tables
-from app.consumer import on_message
+from app.consumer import handle_message
+from hts_common.readiness import connect_broker
+from hts_common.retry import declare_retry_topology, monitor_queue_depths, topology_queues, with_retries
+from hts_common.instrumentation import get_logger, serve_metrics, setup_logging
 
 RABBITMQ_URL = os.getenv("RABBITMQ_URL")
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+
+setup_logging("analytics_worker")
+logger = get_logger("analytics.worker")
 
 async def main():
-    # Ensure tables exist (worker might start before API)
+    # Waits for Postgres; the worker may start before the API has migrated
     create_db_and_tables()
+
+    # Consume/publish latency, queue lag and DB time of this process
+    await serve_metrics(WORKER_METRICS_PORT)
     
-    await asyncio.sleep(10) # Wait for RMQ
-    print(" [Analytics Worker] Connecting to RabbitMQ...")
-    
-    try:
-        connection = await connect(RABBITMQ_URL)
-    except Exception as e:
-         print(f" [Analytics Worker] Connection failed: {e}")
-         return
+    logger.info("Connecting to RabbitMQ")
+    # Retries until the broker is up, then reconnects (and resumes consuming) by itself
+    connection = await connect_broker(RABBITMQ_URL)
 
     async with connection:
         channel = await connection.channel()
         exchange = await channel.declare_exchange("health_events", type="topic")
         queue = await channel.declare_queue("analytics_queue", durable=True)
         
-        # Bind specifically to creation events for aggregation
-        await queue.bind(exchange, routing_key="health.record.created")
+        # Bind to creation, update and deletion events so aggregates stay in sync
+        await queue.bind(exchange, routing_key="health.record.*")
+
+        # Failed messages wait in delay queues, then the dead-letter queue
+        await declare_retry_topology(channel, "analytics_queue")
+        depth_monitor = asyncio.create_task(monitor_queue_depths(connection, topology_queues("analytics_queue")))
         
-        print(" [Analytics Worker] Waiting for messages...")
-        await queue.consume(on_message)
+        logger.info("Waiting for messages", queue="analytics_queue")
+        await queue.consume(with_retries(channel, "analytics_queue", handle_message))
         await asyncio.Future()
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+"""
+Per-user, per-route rate limiting at the edge.
+
+Each request takes a token from the bucket of (user, route prefix, read|write).
+Authenticated requests are keyed by the token's `sub`, others by client address.
+Limits come from RATE_LIMITS as "name=rate_per_second:burst" entries, where name
+is "<prefix>.<read|write>", "<prefix>" or "default" (most specific wins), e.g.
+
+    RATE_LIMITS="health.write=2:20,health=10:40,default=20:40"
+
+Buckets live in memory, or in Redis when GATEWAY_REDIS_URL is set so several
+gateway replicas share them. If Redis is unreachable the local buckets are used.
+"""
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from jose import JWTError
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from app.security import decode_access_token
+from hts_common.instrumentation import get_logger
+
+RATE_LIMITS = os.getenv("RATE_LIMITS") or "auth=2:10,health.write=5:20,dashboard=2:10,default=20:40"
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+GATEWAY_REDIS_URL = os.getenv("GATEWAY_REDIS_URL")
+
+# Never limited: liveness, metrics, docs and CORS preflights
+EXEMPT_PATHS = {"/", "/health", "/metrics", "/docs", "/openapi.json", "/redoc"}
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+logger = get_logger("gateway.admission")
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for entry in spec.split(","):
+        name, _, value = entry.strip().partition("=")
+        rate, _, burst = value.partition(":")
+        if name and rate:
+            limits[name] = (float(rate), float(burst or rate))
+    limits.setdefault("default", (20.0, 40.0))
+    return limits
+
+class TokenBucketLimiter:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> (tokens, last refill time); ordered by last use so the oldest are evicted first
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, key: str, rate: float, burst: float) -> float:
+        """Takes one token. Returns 0 if allowed, otherwise seconds until a token is available."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                retry_after = 0.0
+            else:
+                self.buckets[key] = (tokens, now)
+                retry_after = (1 - tokens) / rate
+
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return retry_after
+
+# Same algorithm, atomically in Redis. Uses the server clock so replicas agree.
+REDIS_TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry_after)
+"""
+
+class RedisTokenBucketLimiter:
+    def __init__(self, url: str, fallback: TokenBucketLimiter):
+        import redis.asyncio as redis # Only needed when GATEWAY_REDIS_URL is set
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self.script = self.client.register_script(REDIS_TOKEN_BUCKET)
+        self.fallback = fallback
+
+    async def acquire(self, key: str, rate: float, burst: float) -> float:
+        try:
+            return float(await self.script(keys=[f"ratelimit:{key}"], args=[rate, burst]))
+        except Exception as e:
+            logger.warning("Shared rate limit backend unavailable, using local buckets", error=str(e))
+            return self.fallback.acquire(key, rate, burst)
+
+def request_identity(headers: Headers, client: Optional[Tuple[str, int]]) -> str:
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            username = decode_access_token(token).get("sub")
+            if username:
+                return f"user:{username}"
+        except JWTError:
+            pass # Limited as anonymous; the upstream rejects the token
+    return f"ip:{client[0] if client else 'unknown'}"
+
+def too_many_requests(retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests"},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+class RateLimitMiddleware:
+    def __init__(self, app, limits: str = RATE_LIMITS):
+        self.app = app
+        self.limits = parse_limits(limits)
+        self.local = TokenBucketLimiter(RATE_LIMIT_MAX_KEYS)
+        self.shared = RedisTokenBucketLimiter(GATEWAY_REDIS_URL, self.local) if GATEWAY_REDIS_URL else None
+
+    def limit_for(self, prefix: str, kind: str) -> Tuple[float, float]:
+        return self.limits.get(f"{prefix}.{kind}") or self.limits.get(prefix) or self.limits["default"]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        prefix = scope["path"].strip("/").split("/", 1)[0]
+        kind = "read" if scope["method"] in READ_METHODS else "write"
+        rate, burst = self.limit_for(prefix, kind)
+        key = f"{request_identity(Headers(scope=scope), scope.get('client'))}:{prefix}:{kind}"
+
+        if self.shared:
+            retry_after = await self.shared.acquire(key, rate, burst)
+        else:
+            retry_after = self.local.acquire(key, rate, burst)
+
+        if retry_after > 0:
+            await too_many_requests(retry_after)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
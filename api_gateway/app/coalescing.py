@@ -0,0 +1,109 @@
+"""
+Request coalescing (single-flight) for identical upstream GETs.
+
+Concurrent GETs for the same URL, query, Authorization, Accept-Encoding and
+conditional headers (several tabs of one user, a re-rendering frontend) share
+one upstream call: the first starts it and the others wait for its response.
+The call runs in its own task, so a caller that disconnects does not cancel it
+for the rest. Errors are shared the same way.
+
+With COALESCE_CACHE_MS set, a successful response is also reused for that many
+milliseconds after it arrives, absorbing bursts that do not overlap exactly.
+Any other method sent with the same Authorization drops that caller's cached
+responses, so a user reads their own writes; a client sending
+Cache-Control: no-cache skips the cache.
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+from app.resilience import UpstreamResponse, call_upstream
+from hts_common.instrumentation import Counter
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+COALESCE_CACHE_MS = float(os.getenv("COALESCE_CACHE_MS", "0")) # 0: share in-flight calls only
+COALESCE_CACHE_MAX_ENTRIES = int(os.getenv("COALESCE_CACHE_MAX_ENTRIES", "1000"))
+
+COALESCED_REQUESTS = Counter("gateway_coalesced_requests_total", "Upstream GETs by how they were answered", ("outcome",))
+
+# A response may differ by any of these request headers
+KEY_HEADERS = ("authorization", "accept-encoding", "if-none-match", "if-modified-since")
+
+Key = tuple # url, query, then the KEY_HEADERS values
+
+class SingleFlight:
+    def __init__(self, cache_seconds: float, max_entries: int):
+        self.cache_seconds = cache_seconds
+        self.max_entries = max_entries
+        self.in_flight: Dict[Key, asyncio.Future] = {}
+        self.cache: "OrderedDict[Key, Tuple[float, UpstreamResponse]]" = OrderedDict()
+
+    def _finished(self, key: Key, task: asyncio.Future):
+        self.in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None: # Also marks the exception retrieved
+            return
+        response = task.result()
+        if self.cache_seconds > 0 and 200 <= response.status_code < 300:
+            self.cache[key] = (time.monotonic() + self.cache_seconds, response)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def cached(self, key: Key) -> Optional[UpstreamResponse]:
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.cache[key]
+            return None
+        return entry[1]
+
+    async def call(self, key: Key, start) -> Tuple[UpstreamResponse, str]:
+        """(response, outcome): "upstream" when this caller started the call, else "shared"."""
+        task = self.in_flight.get(key)
+        outcome = "shared"
+        if task is None:
+            task = asyncio.ensure_future(start())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            outcome = "upstream"
+        return await asyncio.shield(task), outcome
+
+    def invalidate(self, authorization: str):
+        for key in [key for key in self.cache if key[2] == authorization]: # The first of KEY_HEADERS
+            del self.cache[key]
+
+flights = SingleFlight(COALESCE_CACHE_MS / 1000, COALESCE_CACHE_MAX_ENTRIES)
+
+async def coalesced_call(
+    method: str,
+    url: str,
+    params: Optional[Union[dict, List[Tuple[str, str]]]] = None,
+    headers: Optional[dict] = None,
+    content: bytes = b"",
+    timeout: Optional[float] = None
+) -> UpstreamResponse:
+    """call_upstream, with identical concurrent GETs sharing one call."""
+    headers = headers or {}
+    authorization = headers.get("authorization", "")
+    if method.upper() != "GET" or content or not COALESCE_ENABLED:
+        try:
+            return await call_upstream(method, url, params=params, headers=headers, content=content, timeout=timeout)
+        finally:
+            if method.upper() not in ("GET", "HEAD", "OPTIONS"):
+                flights.invalidate(authorization)
+
+    # Query items in request order: repeated parameters all count, and may be order-sensitive
+    query = tuple(params.items() if isinstance(params, dict) else params or ())
+    key = (url, query, *(headers.get(name, "") for name in KEY_HEADERS))
+    if "no-cache" not in headers.get("cache-control", ""):
+        response = flights.cached(key)
+        if response is not None:
+            COALESCED_REQUESTS.inc(outcome="cached")
+            return response
+    response, outcome = await flights.call(
+        key, lambda: call_upstream(method, url, params=params, headers=headers, content=content, timeout=timeout)
+    )
+    COALESCED_REQUESTS.inc(outcome=outcome)
+    return response
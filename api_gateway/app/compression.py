@@ -0,0 +1,99 @@
+"""
+Response compression negotiated from Accept-Encoding (br preferred, then gzip).
+
+Bodies that already carry a Content-Encoding (e.g. forwarded from an upstream
+that compressed them) are passed through untouched, as are small bodies,
+non-text types and streamed responses.
+"""
+import os
+import gzip
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Quality 4-5 is close to gzip -6 in speed with noticeably smaller output
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and float(params[2:] or 0) == 0:
+            continue
+        accepted.add(coding.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        except ValueError:
+            encoding = None # Malformed q-value
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # Streaming or not worth it: send as is
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            body = compress(body, encoding)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            etag = headers.get("etag")
+            if etag and etag.startswith('"'):
+                headers["etag"] = "W/" + etag # Bytes differ from the upstream representation
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
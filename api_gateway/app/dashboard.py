@@ -0,0 +1,68 @@
+"""
+GET /dashboard: everything a dashboard render needs in one round trip.
+
+The upstream calls run concurrently on the shared pools (app/upstream.py), each
+with its own timeout. A failed section is reported under "errors" and left
+null instead of failing the whole document. Upstream bodies are already JSON
+and are spliced into the response as-is rather than parsed and re-encoded.
+"""
+import os
+import json
+import asyncio
+from typing import Dict, List, Optional, Tuple
+import httpx
+from fastapi import Request, Response
+from app.upstream import UpstreamBusy
+from app.resilience import CircuitOpen
+from app.coalescing import coalesced_call
+
+DASHBOARD_CALL_TIMEOUT = float(os.getenv("DASHBOARD_CALL_TIMEOUT", "2"))
+
+async def fetch_section(url: str, headers: Dict[str, str], params: Optional[dict] = None) -> Tuple[Optional[bytes], Optional[dict]]:
+    """Returns (json_body, None) on success or (None, error)."""
+    try:
+        response = await coalesced_call("GET", url, params=params, headers=headers, timeout=DASHBOARD_CALL_TIMEOUT)
+    except UpstreamBusy:
+        return None, {"status": 503, "detail": "Service overloaded"}
+    except CircuitOpen:
+        return None, {"status": 503, "detail": "Service unavailable"}
+    except httpx.TimeoutException:
+        return None, {"status": 504, "detail": "Upstream timed out"}
+    except httpx.RequestError as e:
+        return None, {"status": 503, "detail": f"Service unavailable: {str(e) or type(e).__name__}"}
+
+    if response.status_code != 200:
+        try:
+            detail = json.loads(response.content).get("detail")
+        except (ValueError, AttributeError):
+            detail = None
+        return None, {"status": response.status_code, "detail": detail}
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        return None, {"status": 502, "detail": "Upstream returned a non-JSON body"}
+    return response.content, None
+
+async def build_dashboard(request: Request, username: str, sections: List[Tuple[str, str, Optional[dict]]]) -> Response:
+    """`sections` is a list of (name, url, params); the caller has authenticated `username`."""
+    # Bodies are spliced into the document, so they must arrive uncompressed
+    headers = {"authorization": request.headers.get("authorization", ""), "accept-encoding": "identity"}
+    if request.client:
+        forwarded = request.headers.get("x-forwarded-for")
+        headers["x-forwarded-for"] = f"{forwarded}, {request.client.host}" if forwarded else request.client.host
+
+    results = await asyncio.gather(*(fetch_section(url, headers, params) for _, url, params in sections))
+
+    parts = []
+    errors = {}
+    for (name, _, _), (body, error) in zip(sections, results):
+        parts.append(json.dumps(name).encode() + b":" + (body if body is not None else b"null"))
+        if error:
+            errors[name] = error
+
+    content = b"".join([
+        b'{"username":', json.dumps(username).encode(),
+        b',"sections":{', b",".join(parts),
+        b'},"errors":', json.dumps(errors).encode(), b"}",
+    ])
+    # Partial results are still useful; only fail when nothing could be fetched
+    status_code = 503 if len(errors) == len(sections) else 200
+    return Response(content=content, status_code=status_code, media_type="application/json")
@@ -0,0 +1,314 @@
+"""
+Failure handling for upstream calls.
+
+- Circuit breaker per upstream: UPSTREAM_FAILURE_THRESHOLD consecutive failures
+  (connection errors, timeouts, 502/503/504) open it for UPSTREAM_OPEN_SECONDS,
+  during which calls fail immediately. Then a single trial call is let through
+  (half-open); its outcome closes or re-opens the breaker.
+- Active probing: every UPSTREAM_PROBE_INTERVAL seconds each upstream's /health
+  is polled. A failed probe opens the breaker, a good probe of an open breaker
+  moves it to half-open, and one of a half-open breaker whose trial has not
+  finished within UPSTREAM_OPEN_SECONDS lets another trial through.
+- Retries: idempotent requests are retried up to UPSTREAM_MAX_RETRIES times with
+  jittered backoff (any request when the connection could not be made), but only
+  while the retry budget has tokens. Every request adds RETRY_BUDGET_RATIO
+  tokens, so retries add at most that fraction of extra load during an outage.
+- Hedging: a GET still running after the upstream's recent p95 latency gets a
+  second, parallel attempt (paid from the retry budget); the first good answer wins.
+"""
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+import httpx
+from app.upstream import get_client, origin_of, upstream_slot
+from hts_common.instrumentation import HTTP_CLIENT_LATENCY, get_logger, inject_headers, start_span
+
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5"))
+UPSTREAM_OPEN_SECONDS = float(os.getenv("UPSTREAM_OPEN_SECONDS", "10"))
+UPSTREAM_PROBE_INTERVAL = float(os.getenv("UPSTREAM_PROBE_INTERVAL", "5"))
+UPSTREAM_PROBE_TIMEOUT = float(os.getenv("UPSTREAM_PROBE_TIMEOUT", "1"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("RETRY_BACKOFF_SECONDS", "0.05"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", "10"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_MIN_SAMPLES = 50
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+FAILURE_STATUSES = {502, 503, 504}
+
+logger = get_logger("gateway.resilience")
+
+class CircuitOpen(Exception):
+    def __init__(self, origin: str, retry_after: float):
+        super().__init__(f"{origin} is unavailable")
+        self.retry_after = retry_after
+
+class UpstreamResponse(NamedTuple):
+    status_code: int
+    headers: httpx.Headers
+    content: bytes # Raw bytes, still in the upstream's content-encoding
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int, open_seconds: float):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.trial_started = 0.0
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            self.trial_started = time.monotonic()
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        if self.state != self.OPEN:
+            return 1.0
+        return max(1.0, self.open_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.trip()
+
+    def release(self):
+        """The allowed call never reached the upstream; let another one try."""
+        self.trial_in_flight = False
+
+    def record_probe(self, healthy: bool):
+        if not healthy and self.state != self.OPEN:
+            self.trip()
+        elif healthy and self.state == self.OPEN:
+            # Let live traffic confirm the recovery
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        elif healthy and self.trial_in_flight and time.monotonic() - self.trial_started >= self.open_seconds:
+            # A trial that never reported back (e.g. a hung call) must not hold the breaker half-open
+            self.trial_in_flight = False
+
+    def trip(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+class RetryBudget:
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class LatencyWindow:
+    """Recent successful latencies; p95 is recomputed every 16 samples."""
+    def __init__(self, size: int = 256):
+        self.samples = deque(maxlen=size)
+        self.since_refresh = 0
+        self.cached_p95: Optional[float] = None
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.since_refresh += 1
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        if self.cached_p95 is None or self.since_refresh >= 16:
+            ordered = sorted(self.samples)
+            self.cached_p95 = ordered[int(len(ordered) * 0.95)]
+            self.since_refresh = 0
+        return self.cached_p95
+
+class Upstream:
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.breaker = CircuitBreaker(UPSTREAM_FAILURE_THRESHOLD, UPSTREAM_OPEN_SECONDS)
+        self.budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MAX)
+        self.latency = LatencyWindow()
+        self.retries = 0
+        self.hedges = 0
+        self.rejected = 0
+
+    def status(self) -> dict:
+        p95 = self.latency.p95()
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "retry_budget": round(self.budget.tokens, 2),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "rejected": self.rejected,
+        }
+
+_upstreams: Dict[str, Upstream] = {}
+_probes: List[asyncio.Task] = []
+
+def get_upstream(url: str) -> Upstream:
+    origin = origin_of(url)
+    upstream = _upstreams.get(origin)
+    if upstream is None:
+        upstream = _upstreams[origin] = Upstream(origin)
+    return upstream
+
+def is_failure(response: UpstreamResponse) -> bool:
+    # A 503 with Retry-After is deliberate load shedding (e.g. the auth hashing pool), not an outage
+    if response.status_code == 503 and "retry-after" in response.headers:
+        return False
+    return response.status_code in FAILURE_STATUSES
+
+async def _attempt(upstream: Upstream, method: str, url: str, params, headers, content, timeout) -> UpstreamResponse:
+    client = get_client(url)
+    async with upstream_slot(url):
+        # Each attempt (retry or hedge) is its own client span, so the upstream's span is its child
+        with start_span("http.client", method=method, url=url) as span:
+            request = client.build_request(method, url, params=params, headers=inject_headers(headers), content=content, timeout=timeout)
+            start = time.monotonic()
+            status = "error"
+            try:
+                response = await client.send(request, stream=True)
+                status = response.status_code
+                try:
+                    # Raw bytes: an already-compressed body is passed through without decoding
+                    body = b"".join([chunk async for chunk in response.aiter_raw()])
+                finally:
+                    await response.aclose()
+            finally:
+                span.attributes["status"] = status
+                HTTP_CLIENT_LATENCY.observe(time.monotonic() - start, upstream=upstream.origin, method=method, status=status)
+    result = UpstreamResponse(response.status_code, response.headers, body)
+    if not is_failure(result):
+        upstream.latency.observe(time.monotonic() - start)
+    return result
+
+async def _hedged(upstream: Upstream, *args) -> UpstreamResponse:
+    primary = asyncio.ensure_future(_attempt(upstream, *args))
+    delay = upstream.latency.p95()
+    if delay is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done or not upstream.budget.withdraw():
+        return await primary
+
+    upstream.hedges += 1
+    pending = {primary, asyncio.ensure_future(_attempt(upstream, *args))}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and not is_failure(task.result()):
+                    return task.result()
+        # Both attempts failed: report the primary's outcome
+        return primary.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def call_upstream(
+    method: str,
+    url: str,
+    params: Optional[Union[dict, List[Tuple[str, str]]]] = None,
+    headers: Optional[dict] = None,
+    content: bytes = b"",
+    timeout: Optional[float] = None
+) -> UpstreamResponse:
+    """
+    One logical upstream call with breaker, retries and hedging applied.
+    Raises CircuitOpen, UpstreamBusy or httpx.RequestError when no response could be had.
+    """
+    upstream = get_upstream(url)
+    if not upstream.breaker.allow():
+        upstream.rejected += 1
+        raise CircuitOpen(upstream.origin, upstream.breaker.retry_after())
+    upstream.budget.deposit()
+
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    timeout = timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+    args = (method, url, params, headers, content, timeout)
+    attempt = 0
+    while True:
+        result, error = None, None
+        try:
+            if idempotent and HEDGE_ENABLED:
+                result = await _hedged(upstream, *args)
+            else:
+                result = await _attempt(upstream, *args)
+        except httpx.RequestError as e:
+            error = e
+        except BaseException:
+            # UpstreamBusy, or the caller was cancelled: the attempt has no outcome,
+            # and a half-open trial must not stay claimed
+            upstream.breaker.release()
+            raise
+
+        if result is not None and not is_failure(result):
+            upstream.breaker.record_success()
+            return result
+
+        upstream.breaker.record_failure()
+        attempt += 1
+        # A request that never connected was not processed, so it is safe to resend
+        retryable = idempotent or isinstance(error, httpx.ConnectError)
+        if not retryable or attempt > UPSTREAM_MAX_RETRIES or not upstream.breaker.allow() or not upstream.budget.withdraw():
+            if result is not None:
+                return result
+            raise error
+
+        upstream.retries += 1
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+async def _probe(url: str):
+    upstream = get_upstream(url)
+    health_url = f"{upstream.origin.rstrip('/')}/health"
+    while True:
+        try:
+            response = await get_client(url).get(health_url, timeout=UPSTREAM_PROBE_TIMEOUT)
+            healthy = response.status_code == 200
+        except httpx.RequestError:
+            healthy = False
+
+        if not healthy and upstream.breaker.state != upstream.breaker.OPEN:
+            logger.warning("Health probe failed, opening circuit", upstream=upstream.origin)
+        upstream.breaker.record_probe(healthy)
+        await asyncio.sleep(UPSTREAM_PROBE_INTERVAL * random.uniform(0.9, 1.1))
+
+def start_probes(urls: List[str]):
+    for url in urls:
+        _probes.append(asyncio.create_task(_probe(url)))
+
+async def stop_probes():
+    for task in _probes:
+        task.cancel()
+    await asyncio.gather(*_probes, return_exceptions=True)
+    _probes.clear()
+
+def upstream_status() -> dict:
+    return {origin: upstream.status() for origin, upstream in _upstreams.items()}
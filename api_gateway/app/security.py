@@ -0,0 +1,30 @@
+import os
+from functools import lru_cache
+from typing import Dict
+from jose import JWTError, jwt
+
+# Configuration (should match Auth Service)
+SECRET_KEY = os.getenv("SECRET_KEY", "secret")
+ALGORITHM = "HS256"
+JWT_KEYS = os.getenv("JWT_KEYS") # "kid:secret,kid:secret"
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID") or "default"
+
+@lru_cache()
+def get_signing_keys() -> Dict[str, str]:
+    """Parses the key set once per process."""
+    if not JWT_KEYS:
+        return {"default": SECRET_KEY}
+    keys = {}
+    for entry in JWT_KEYS.split(","):
+        kid, _, secret = entry.strip().partition(":")
+        if kid and secret:
+            keys[kid] = secret
+    return keys
+
+def decode_access_token(token: str) -> dict:
+    """Verifies a token against the key named by its `kid` header. Raises JWTError."""
+    kid = jwt.get_unverified_header(token).get("kid") or JWT_ACTIVE_KID
+    key = get_signing_keys().get(kid)
+    if key is None:
+        raise JWTError("Unknown signing key")
+    return jwt.decode(token, key, algorithms=[ALGORITHM])
@@ -0,0 +1,90 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+import httpx
+
+# One keep-alive pool per upstream service, so a slow service cannot hold every
+# connection and requests skip the TCP handshake.
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "5"))
+
+# Admission control: at most UPSTREAM_MAX_CONCURRENCY requests in flight per
+# upstream and UPSTREAM_MAX_QUEUE waiting for a slot, each for at most
+# UPSTREAM_QUEUE_TIMEOUT seconds. Anything beyond is shed with a 503, so an
+# overloaded service sees a bounded load and callers a bounded wait.
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "64"))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "128"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "1"))
+
+class UpstreamBusy(Exception):
+    """Raised when an upstream has no free slot; retry_after is a hint in seconds."""
+    def __init__(self, origin: str, retry_after: float):
+        super().__init__(f"{origin} is at capacity")
+        self.retry_after = retry_after
+
+class ConcurrencyLimiter:
+    def __init__(self, origin: str, limit: int, max_queue: int, queue_timeout: float):
+        self.origin = origin
+        self.semaphore = asyncio.Semaphore(limit)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.shed = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                raise UpstreamBusy(self.origin, self.queue_timeout)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed += 1
+                raise UpstreamBusy(self.origin, self.queue_timeout)
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_limiters: Dict[str, ConcurrencyLimiter] = {}
+
+def origin_of(url: str) -> str:
+    return str(httpx.URL(url).copy_with(path="/", query=None, fragment=None))
+
+def upstream_slot(url: str):
+    """`async with upstream_slot(url):` around every upstream call. Raises UpstreamBusy."""
+    key = origin_of(url)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = _limiters[key] = ConcurrencyLimiter(
+            key, UPSTREAM_MAX_CONCURRENCY, UPSTREAM_MAX_QUEUE, UPSTREAM_QUEUE_TIMEOUT
+        )
+    return limiter.slot()
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """Shared client for the origin of `url`."""
+    key = origin_of(url)
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            ),
+            timeout=UPSTREAM_TIMEOUT,
+        )
+    return client
+
+async def close_clients():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
@@ -0,0 +1,118 @@
+import os
+import re
+import asyncio
+import logging
+from typing import Optional
+import websockets
+from fastapi import WebSocket, WebSocketDisconnect, status
+from jose import JWTError
+from app.security import decode_access_token
+from hts_common.instrumentation import get_logger
+
+# Keepalives towards the upstream service. Client-facing pings are handled by
+# uvicorn itself (--ws-ping-interval / --ws-ping-timeout).
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "20"))
+
+# Keep per-connection buffers small: notifications are tiny JSON payloads, and
+# thousands of mostly idle sockets should not each reserve megabytes.
+WS_MAX_MESSAGE_SIZE = int(os.getenv("WS_MAX_MESSAGE_SIZE", str(64 * 1024)))
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "4"))
+WS_OPEN_TIMEOUT = float(os.getenv("WS_OPEN_TIMEOUT", "5"))
+
+logger = get_logger("gateway.ws_proxy")
+
+TOKEN_PARAM = re.compile(r"([?&]token=)[^&\s\"]*")
+
+class RedactTokenFilter(logging.Filter):
+    """Masks ?token= in uvicorn's request lines, which log the path with its query string."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple):
+            record.args = tuple(TOKEN_PARAM.sub(r"\1[redacted]", arg) if isinstance(arg, str) else arg for arg in record.args)
+        return True
+
+def redact_tokens_in_server_logs():
+    # uvicorn.error logs WebSocket handshakes ("WebSocket /path?query" [accepted]), uvicorn.access HTTP requests
+    for name in ("uvicorn.access", "uvicorn.error"):
+        logging.getLogger(name).addFilter(RedactTokenFilter())
+
+def get_ws_username(websocket: WebSocket) -> Optional[str]:
+    """
+    Validates the bearer token of a WebSocket handshake.
+    Browsers cannot set headers on WebSocket requests, so `?token=` is accepted as well
+    (and masked in the server logs, see RedactTokenFilter).
+    """
+    token = websocket.query_params.get("token")
+    if not token:
+        authorization = websocket.headers.get("authorization", "")
+        scheme, _, credentials = authorization.partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials
+    if not token:
+        return None
+
+    try:
+        payload = decode_access_token(token)
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+async def proxy_websocket(websocket: WebSocket, upstream_url: str):
+    """
+    Pipes frames between the client and the upstream service until either side closes.
+    """
+    try:
+        upstream = await websockets.connect(
+            upstream_url,
+            ping_interval=WS_PING_INTERVAL,
+            ping_timeout=WS_PING_TIMEOUT,
+            max_size=WS_MAX_MESSAGE_SIZE,
+            max_queue=WS_MAX_QUEUE,
+            open_timeout=WS_OPEN_TIMEOUT,
+            compression=None, # permessage-deflate costs ~64KB of zlib state per socket
+        )
+    except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake) as e:
+        logger.warning("WebSocket upstream unavailable", upstream_url=upstream_url, error=str(e))
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+
+    await websocket.accept()
+
+    async def upstream_to_client():
+        async for message in upstream:
+            if isinstance(message, str):
+                await websocket.send_text(message)
+            else:
+                await websocket.send_bytes(message)
+
+    # Only one extra task per connection: the client side is pumped from the current task
+    pump = asyncio.create_task(upstream_to_client())
+    close_code = status.WS_1000_NORMAL_CLOSURE
+    try:
+        while not pump.done():
+            receive = asyncio.ensure_future(websocket.receive())
+            done, _ = await asyncio.wait({receive, pump}, return_when=asyncio.FIRST_COMPLETED)
+            if receive not in done:
+                receive.cancel()
+                break
+            message = receive.result()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("text") is not None:
+                await upstream.send(message["text"])
+            elif message.get("bytes") is not None:
+                await upstream.send(message["bytes"])
+    except (WebSocketDisconnect, websockets.ConnectionClosed):
+        pass
+    finally:
+        if not pump.done():
+            pump.cancel()
+        elif not pump.cancelled() and pump.exception() is not None:
+            # The upstream dropped (or a send to the client failed): report it instead of losing it
+            logger.warning("WebSocket proxy failed", upstream_url=upstream_url, error=repr(pump.exception()))
+            close_code = status.WS_1011_INTERNAL_ERROR
+        await upstream.close()
+        try:
+            await websocket.close(code=close_code)
+        except RuntimeError:
+            pass # Client already gone
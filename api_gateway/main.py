@@ -1,8 +1,26 @@
 import os
+import math
+from datetime import datetime
+from typing import Optional
 import httpx
-from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi import FastAPI, Request, Response, HTTPException, WebSocket, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.openapi.utils import get_openapi
+from jose import JWTError
+from app.security import decode_access_token
+from app.upstream import UpstreamBusy, close_clients
+from app.resilience import CircuitOpen, start_probes, stop_probes, upstream_status
+from app.coalescing import coalesced_call
+from app.compression import CompressionMiddleware
+from app.admission import RateLimitMiddleware
+from app.dashboard import build_dashboard
+from app.ws_proxy import get_ws_username, proxy_websocket, redact_tokens_in_server_logs
+from hts_common.instrumentation import InstrumentationMiddleware, get_logger, render_metrics, setup_logging
+
+setup_logging("api_gateway")
+redact_tokens_in_server_logs()
+logger = get_logger("gateway.main")
 
 app = FastAPI(title="Health Tracking API Gateway")
 
@@ -13,13 +31,19 @@ if not FRONTEND_ORIGINS:
 
 allowed_origins = [origin.strip() for origin in FRONTEND_ORIGINS.split(",") if origin.strip()]
 
+# Middleware added last runs first: instrumentation (so shed requests are
+# measured too), CORS, rate limiting, then compression
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"], # Record versions, sent back in If-Match
 )
+app.add_middleware(InstrumentationMiddleware)
 
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth_service:8000")
 HEALTH_SERVICE_URL = os.getenv("HEALTH_SERVICE_URL", "http://health_service:8000")
@@ -27,39 +51,42 @@ ANALYTICS_SERVICE_URL = os.getenv("ANALYTICS_SERVICE_URL", "http://analytics_ser
 NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://notification_service:8000")
 
 async def forward_request(url: str, request: Request):
-    client = httpx.AsyncClient()
     try:
         # Forward query params, headers (excluding host), and body
-        params = dict(request.query_params)
+        params = request.query_params.multi_items() # Keeps repeated parameters (?id=1&id=2)
         headers = dict(request.headers)
         headers.pop("host", None)
         headers.pop("content-length", None) # Let httpx handle content-length
+        if request.client:
+            forwarded = headers.get("x-forwarded-for")
+            headers["x-forwarded-for"] = f"{forwarded}, {request.client.host}" if forwarded else request.client.host
+        # Upstreams may only compress with codings the client accepts (httpx would add its own)
+        headers.setdefault("accept-encoding", "identity")
         
         # Read body
         body = await request.body()
 
-        response = await client.request(
-            request.method,
-            url,
-            params=params,
-            headers=headers,
-            content=body
-        )
+        # Identical concurrent GETs share one upstream call (app/coalescing.py)
+        response = await coalesced_call(request.method, url, params=params, headers=headers, content=body)
+
         # Filter out hop-by-hop headers and others that might conflict
         filtered_headers = {
             k: v for k, v in response.headers.items() 
             if k.lower() not in [
-                "content-length", "content-encoding", "transfer-encoding", 
+                "content-length", "transfer-encoding", 
                 "connection", "keep-alive", "proxy-authenticate", 
                 "proxy-authorization", "te", "trailers", "upgrade", "host"
             ]
         }
 
         return Response(content=response.content, status_code=response.status_code, headers=filtered_headers)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Upstream timed out")
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
-    finally:
-        await client.aclose()
+    except (UpstreamBusy, CircuitOpen) as e:
+        detail = "Service overloaded" if isinstance(e, UpstreamBusy) else "Service unavailable"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(math.ceil(e.retry_after))})
 
 def custom_openapi():
     if app.openapi_schema:
@@ -181,7 +208,7 @@ def custom_openapi():
                 openapi_schema["paths"][new_path] = methods
 
         except Exception as e:
-            print(f"Swagger fetch failed from {service_url}: {e}")
+            logger.warning("Swagger fetch failed", service_url=service_url, error=str(e))
 
 
 
@@ -203,6 +230,52 @@ async def root():
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/upstreams")
+async def upstreams():
+    """Breaker state, p95 latency and retry budget of each upstream."""
+    return upstream_status()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    return render_metrics()
+
+@app.on_event("startup")
+async def on_startup():
+    start_probes([AUTH_SERVICE_URL, HEALTH_SERVICE_URL, ANALYTICS_SERVICE_URL, NOTIFICATION_SERVICE_URL])
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_probes()
+    await close_clients()
+
+# -------------------------------------------------------------------------
+# Composition Routes
+# -------------------------------------------------------------------------
+
+@app.get("/dashboard")
+async def dashboard(request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    Health data, stats, daily stats, insights, summary and notifications of the
+    current user in one response. Sections that failed are null and listed in "errors".
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    try:
+        username = decode_access_token(token).get("sub") if scheme.lower() == "bearer" else None
+    except JWTError:
+        username = None
+    if not username:
+        raise HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+
+    data_params = {k: v.isoformat() for k, v in (("start", start), ("end", end)) if v}
+    return await build_dashboard(request, username, [
+        ("health_data", f"{HEALTH_SERVICE_URL}/data", data_params),
+        ("stats", f"{ANALYTICS_SERVICE_URL}/stats/{username}", None),
+        ("daily_stats", f"{ANALYTICS_SERVICE_URL}/stats/daily/{username}", None),
+        ("insights", f"{ANALYTICS_SERVICE_URL}/insights/{username}", None),
+        ("summary", f"{ANALYTICS_SERVICE_URL}/summary/{username}", None),
+        ("notifications", f"{NOTIFICATION_SERVICE_URL}/list/{username}", None),
+    ])
+
 # -------------------------------------------------------------------------
 # Generic Proxy Routes
 # -------------------------------------------------------------------------
@@ -224,3 +297,17 @@ async def proxy_analytics(request: Request, path: str):
 async def proxy_notifications(request: Request, path: str):
     return await forward_request(f"{NOTIFICATION_SERVICE_URL}/{path}", request)
 
+# -------------------------------------------------------------------------
+# WebSocket Proxy Routes
+# -------------------------------------------------------------------------
+
+@app.websocket("/notifications/ws/{username}")
+@app.websocket("/notifications/ws/{username}/")
+async def proxy_notifications_ws(websocket: WebSocket, username: str):
+    # Reject at the edge so unauthenticated sockets never reach the notification service
+    if get_ws_username(websocket) != username:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    upstream_url = NOTIFICATION_SERVICE_URL.replace("http", "ws", 1)
+    await proxy_websocket(websocket, f"{upstream_url}/ws/{username}")
@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlmodel import Session, select
-from app.models import User, UserCreate, UserUpdate, Token
+from sqlmodel import Session, select, update
+from app.models import User, UserCreate, UserUpdate, Token, RefreshToken, RefreshRequest
 from app.database import get_session
-from app.security import get_password_hash, verify_password, create_access_token, SECRET_KEY, ALGORITHM
-from jose import JWTError, jwt
+from app.security import (
+    get_password_hash_async, verify_password_async, create_access_token,
+    decode_access_token, create_refresh_token, hash_refresh_token, HashPoolBusy
+)
+from app.throttle import login_throttle
+from jose import JWTError
 
 router = APIRouter()
 
@@ -17,7 +24,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -30,32 +37,124 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
         raise credentials_exception
     return user
 
-@router.post("/register", response_model=User)
-def register(user: UserCreate, session: Session = Depends(get_session)):
-    statement = select(User).where(User.username == user.username)
-    results = session.exec(statement)
-    if results.first():
-        raise HTTPException(status_code=400, detail="Username already registered")
-    
-    hashed_password = get_password_hash(user.password)
-    db_user = User(username=user.username, hashed_password=hashed_password)
+def client_ip(request: Request) -> str:
+    # The gateway appends the caller's address to X-Forwarded-For
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[-1].strip() # Earlier entries are client-supplied
+    return request.client.host if request.client else "unknown"
+
+def hashing_busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication is busy, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+def find_user(session: Session, username: str):
+    return session.exec(select(User).where(User.username == username)).first()
+
+def add_user(session: Session, username: str, hashed_password: str) -> User:
+    db_user = User(username=username, hashed_password=hashed_password)
     session.add(db_user)
     session.commit()
     session.refresh(db_user)
     return db_user
 
+def finish_login(session: Session, user: User, new_hash: Optional[str]) -> dict:
+    if new_hash:
+        # Work-factor settings changed since this hash was created
+        user.hashed_password = new_hash
+        session.add(user)
+        session.commit()
+    return issue_tokens(user, session)
+
+# register and login are async so they can await the hash pool; their database
+# work runs in the threadpool, like sync endpoints, instead of on the event loop
+
+@router.post("/register", response_model=User)
+async def register(user: UserCreate, session: Session = Depends(get_session)):
+    if await run_in_threadpool(find_user, session, user.username):
+        raise HTTPException(status_code=400, detail="Username already registered")
+    
+    try:
+        hashed_password = await get_password_hash_async(user.password)
+    except HashPoolBusy:
+        raise hashing_busy_exception()
+    return await run_in_threadpool(add_user, session, user.username, hashed_password)
+
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    statement = select(User).where(User.username == form_data.username)
-    user = session.exec(statement).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
+    # Throttle before spending any bcrypt CPU on the attempt
+    retry_after = login_throttle.acquire(f"{form_data.username}|{client_ip(request)}")
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(int(retry_after) + 1)},
+        )
+
+    user = await run_in_threadpool(find_user, session, form_data.username)
+    valid, new_hash = False, None
+    if user:
+        try:
+            valid, new_hash = await verify_password_async(form_data.password, user.hashed_password)
+        except HashPoolBusy:
+            raise hashing_busy_exception()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    return await run_in_threadpool(finish_login, session, user, new_hash)
+
+def issue_tokens(user: User, session: Session) -> dict:
+    refresh_token, token_hash, expires_at = create_refresh_token()
+    session.add(RefreshToken(user_id=user.id, token_hash=token_hash, expires_at=expires_at))
+    session.commit()
+
     access_token = create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@router.post("/refresh", response_model=Token)
+def refresh(refresh_request: RefreshRequest, session: Session = Depends(get_session)):
+    """Exchanges a refresh token for a new access/refresh pair without re-running bcrypt."""
+    invalid_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    token_hash = hash_refresh_token(refresh_request.refresh_token)
+    # Rotate: each refresh token can be used exactly once. Claiming it is one
+    # UPDATE, so two concurrent refreshes cannot both succeed.
+    user_id = session.exec(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == token_hash,
+            RefreshToken.revoked == False,
+            RefreshToken.expires_at > datetime.utcnow()
+        )
+        .values(revoked=True)
+        .returning(RefreshToken.user_id)
+    ).scalar()
+    if user_id is None:
+        stored = session.exec(select(RefreshToken).where(RefreshToken.token_hash == token_hash)).first()
+        if stored and stored.revoked and stored.expires_at >= datetime.utcnow():
+            # A rotated token was presented again: assume it leaked and end every session of the user
+            session.exec(
+                update(RefreshToken)
+                .where(RefreshToken.user_id == stored.user_id, RefreshToken.revoked == False)
+                .values(revoked=True)
+            )
+            session.commit()
+        raise invalid_exception
+
+    user = session.get(User, user_id)
+    if user is None:
+        raise invalid_exception
+    return issue_tokens(user, session) # Commits the claim with the new token
 
 @router.get("/profile", response_model=User)
 def read_users_me(current_user: User = Depends(get_current_user)):
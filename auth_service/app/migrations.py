@@ -0,0 +1,20 @@
+"""
+Schema migrations of this service, applied in order by the shared runner
+(hts_common.migrations, which documents the rules). Append new ones, never
+edit applied ones.
+"""
+from typing import List
+import app.models # Registers the tables the migrations refer to
+from hts_common import migrations as runner
+from hts_common.migrations import Migration, create_models
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", create_models),
+]
+
+def pending_migrations(engine) -> List[Migration]:
+    return runner.pending_migrations(engine, MIGRATIONS)
+
+def migrate(engine) -> int:
+    """Applies pending migrations, each in its own transaction. Returns how many."""
+    return runner.migrate(engine, MIGRATIONS)
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Optional
 from sqlmodel import Field, SQLModel
 
@@ -20,6 +21,17 @@ class UserUpdate(SQLModel):
     height: Optional[float] = None
     weight: Optional[float] = None
 
+class RefreshToken(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True, foreign_key="user.id")
+    token_hash: str = Field(index=True, unique=True)
+    expires_at: datetime
+    revoked: bool = False
+
 class Token(SQLModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(SQLModel):
+    refresh_token: str
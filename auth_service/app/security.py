@@ -1,24 +1,130 @@
 import os
+import asyncio
+import hashlib
+import secrets
 from datetime import datetime, timedelta
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
 from passlib.context import CryptContext
-from jose import jwt
+from jose import JWTError, jwt
+from hts_common.instrumentation import Histogram
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Signing keys as "kid:secret,kid:secret". Tokens are signed with JWT_ACTIVE_KID;
+# older keys stay listed until the tokens they signed have expired.
+# Without JWT_KEYS, SECRET_KEY is used under the "default" kid.
+JWT_KEYS = os.getenv("JWT_KEYS")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID") or "default"
+
+# Work factor. Raising it re-hashes existing passwords on their next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# bcrypt is pure CPU, so it runs in a dedicated process pool instead of the
+# request threadpool. HASH_MAX_PENDING bounds how many calls may queue for it.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(HASH_WORKERS * 8)))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+class HashPoolBusy(Exception):
+    """Raised when the hashing pool already has HASH_MAX_PENDING calls queued."""
+
+# Buckets tuned around bcrypt costs (tens to hundreds of ms); includes pool queueing
+HASH_LATENCY = Histogram(
+    "auth_password_hash_seconds", "Password hashing and verification latency, including pool queueing", ("op",),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending: Optional[asyncio.Semaphore] = None
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def _run_in_pool(op: str, func, *args):
+    global _pool, _pending
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        _pending = asyncio.Semaphore(HASH_MAX_PENDING)
+
+    if _pending.locked():
+        raise HashPoolBusy()
+
+    async with _pending:
+        with HASH_LATENCY.time(op=op):
+            return await asyncio.get_running_loop().run_in_executor(_pool, func, *args)
+
+async def verify_password_async(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies off the event loop. Returns (valid, new_hash); new_hash is set when
+    the stored hash uses outdated settings and should be replaced.
+    """
+    return await _run_in_pool("verify", verify_and_update_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    return await _run_in_pool("hash", get_password_hash, password)
+
+def shutdown_hash_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+@lru_cache()
+def get_signing_keys() -> Dict[str, str]:
+    """Parses the key set once per process."""
+    if not JWT_KEYS:
+        return {"default": SECRET_KEY}
+    keys = {}
+    for entry in JWT_KEYS.split(","):
+        kid, _, secret = entry.strip().partition(":")
+        if kid and secret:
+            keys[kid] = secret
+    return keys
+
+def check_signing_keys():
+    """Fails startup when JWT_ACTIVE_KID names no key, instead of every token issue."""
+    if JWT_ACTIVE_KID not in get_signing_keys():
+        raise RuntimeError(f"JWT_ACTIVE_KID {JWT_ACTIVE_KID!r} is not one of the JWT_KEYS kids")
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(
+        to_encode,
+        get_signing_keys()[JWT_ACTIVE_KID],
+        algorithm=ALGORITHM,
+        headers={"kid": JWT_ACTIVE_KID}
+    )
     return encoded_jwt
+
+def decode_access_token(token: str) -> dict:
+    """Verifies a token against the key named by its `kid` header. Raises JWTError."""
+    kid = jwt.get_unverified_header(token).get("kid") or JWT_ACTIVE_KID # Tokens issued before kids
+    key = get_signing_keys().get(kid)
+    if key is None:
+        raise JWTError("Unknown signing key")
+    return jwt.decode(token, key, algorithms=[ALGORITHM])
+
+def create_refresh_token() -> Tuple[str, str, datetime]:
+    """Returns (token, token_hash, expires_at). Only the hash is ever stored."""
+    token = secrets.token_urlsafe(32)
+    expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    return token, hash_refresh_token(token), expires_at
+
+def hash_refresh_token(token: str) -> str:
+    # Refresh tokens are 256 random bits, so a fast hash is enough (no bcrypt needed)
+    return hashlib.sha256(token.encode()).hexdigest()
@@ -0,0 +1,41 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+# Login attempts: a burst of LOGIN_BURST, refilled at LOGIN_RATE attempts per minute
+LOGIN_BURST = float(os.getenv("LOGIN_BURST", "5"))
+LOGIN_RATE = float(os.getenv("LOGIN_RATE_PER_MINUTE", "10")) / 60.0
+MAX_TRACKED_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
+class TokenBucketThrottle:
+    def __init__(self, capacity: float, rate: float, max_keys: int):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        # key -> (tokens, last refill time); ordered by last use so the oldest are evicted first
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """
+        Takes one token for `key`. Returns 0 if allowed, otherwise the number of
+        seconds until a token becomes available.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                retry_after = 0.0
+            else:
+                self.buckets[key] = (tokens, now)
+                retry_after = (1 - tokens) / self.rate
+
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return retry_after
+
+login_throttle = TokenBucketThrottle(LOGIN_BURST, LOGIN_RATE, MAX_TRACKED_KEYS)
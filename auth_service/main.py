@@ -1,15 +1,30 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from app.database import create_db_and_tables
 from app.api import router as auth_router
+from hts_common.instrumentation import InstrumentationMiddleware, render_metrics, setup_logging
+from app.security import check_signing_keys, shutdown_hash_pool
+
+setup_logging("auth_service")
 
 app = FastAPI(title="Auth Service")
+app.add_middleware(InstrumentationMiddleware)
 
 @app.on_event("startup")
 def on_startup():
+    check_signing_keys()
     create_db_and_tables()
 
+@app.on_event("shutdown")
+def on_shutdown():
+    shutdown_hash_pool()
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    return render_metrics()
+
 app.include_router(auth_router)
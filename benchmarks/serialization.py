@@ -0,0 +1,114 @@
+"""
+Serialization cost of list endpoints: the default response_model path versus
+orjson over plain rows (hts_common/responses.py), plus gateway compression of
+the result.
+
+    python benchmarks/serialization.py --model healthrecord --rows 100 1000 10000
+    python benchmarks/serialization.py --model dailystats --rows 30 365 3650
+
+Paths, per payload size:
+- jsonable_encoder: validate into the response_model, jsonable_encoder, json.dumps
+- response_model: validate into the response_model, pydantic dump_json
+- orjson_rows: orjson.dumps of the row dicts returned by fetch_rows
+Compression is measured on the orjson body at the gateway's default levels.
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import argparse
+from datetime import datetime, date, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def load_model(name):
+    service = "health_service" if name == "healthrecord" else "analytics_service"
+    sys.path.insert(0, os.path.join(ROOT, service))
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    if name == "healthrecord":
+        from app.models import HealthRecord
+        return HealthRecord
+    from app.models import DailyHealthStats
+    return DailyHealthStats
+
+def make_rows(model, count):
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        if model.__name__ == "HealthRecord":
+            systolic, diastolic = rng.randint(105, 140), rng.randint(65, 90)
+            rows.append({
+                "id": i + 1, "username": "alice", "steps": rng.randint(0, 200),
+                "sleep_hours": None, "weight": round(rng.uniform(60, 90), 1),
+                "heart_rate": rng.randint(55, 110), "blood_pressure": f"{systolic}/{diastolic}",
+                "systolic": systolic, "diastolic": diastolic, "blood_sugar": None,
+                "body_temperature": round(rng.uniform(36.2, 37.4), 1),
+                "timestamp": start + timedelta(minutes=i),
+            })
+        else:
+            row = {"id": i + 1, "username": "alice", "date": date(2024, 1, 1) + timedelta(days=i)}
+            for field, info in model.model_fields.items():
+                if field in row:
+                    continue
+                row[field] = rng.randint(1, 20) if info.annotation in (int, "int") or field.endswith("_count") else round(rng.uniform(1, 200), 2)
+            rows.append(row)
+    return rows
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="List endpoint serialization benchmark")
+    parser.add_argument("--model", choices=["healthrecord", "dailystats"], default="healthrecord")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5, help="Best of N")
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    from typing import List
+    import orjson
+    from pydantic import TypeAdapter
+    from fastapi.encoders import jsonable_encoder
+    from hts_common.responses import dumps
+    sys.path.insert(0, os.path.join(ROOT, "api_gateway"))
+    from app.compression import compress, brotli
+
+    adapter = TypeAdapter(List[model])
+    results = []
+    for count in args.rows:
+        rows = make_rows(model, count)
+        objects = [model(**row) for row in rows] # What session.exec(...).all() returns
+
+        encoder_s, _ = timed(lambda: json.dumps(jsonable_encoder(adapter.validate_python(objects, from_attributes=True))).encode(), args.repeat)
+        response_model_s, _ = timed(lambda: adapter.dump_json(adapter.validate_python(objects, from_attributes=True)), args.repeat)
+        orjson_s, body = timed(lambda: dumps(rows), args.repeat)
+
+        result = {
+            "model": model.__name__,
+            "rows": count,
+            "json_bytes": len(body),
+            "jsonable_encoder_ms": round(encoder_s * 1000, 2),
+            "response_model_ms": round(response_model_s * 1000, 2),
+            "orjson_rows_ms": round(orjson_s * 1000, 2),
+            "speedup_vs_response_model": round(response_model_s / orjson_s, 1),
+        }
+        for encoding in ("gzip", "br"):
+            if encoding == "br" and brotli is None:
+                continue
+            seconds, compressed = timed(lambda: compress(body, encoding), args.repeat)
+            result[f"{encoding}_bytes"] = len(compressed)
+            result[f"{encoding}_ms"] = round(seconds * 1000, 2)
+        results.append(result)
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
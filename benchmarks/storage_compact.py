@@ -0,0 +1,142 @@
+"""
+Compares the row-per-reading HealthRecord table with compact chunk storage
+(health_service/app/timeseries.py): bytes per reading and range-scan latency.
+
+    python benchmarks/storage_compact.py --users 5 --days 2
+
+By default each mode gets its own SQLite file and size is the file size after
+VACUUM. With --database-url postgresql://... both modes share that database
+and size is pg_total_relation_size of the tables involved (indexes and TOAST
+included).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "health_service"))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import text
+from sqlmodel import SQLModel, Session, create_engine, delete, select
+from app.models import HealthRecord, SeriesChunk, SeriesUser
+from app import timeseries
+
+def generate_readings(users: int, days: int):
+    """Heart rate every 10s, steps every minute, weight once a day."""
+    start = datetime(2024, 1, 1)
+    rng = random.Random(42)
+    for u in range(users):
+        username = f"user{u}"
+        hr = 70
+        for second in range(0, days * 86400, 10):
+            ts = start + timedelta(seconds=second)
+            hr = max(45, min(180, hr + rng.randint(-3, 3)))
+            record = HealthRecord(username=username, timestamp=ts, heart_rate=hr)
+            if second % 60 == 0:
+                record.steps = rng.randint(0, 120)
+            if second % 86400 == 0:
+                record.weight = round(70 + rng.uniform(-1, 1), 1)
+            yield record
+
+def relation_bytes(engine, tables) -> int:
+    with engine.connect() as conn:
+        return sum(conn.execute(text(f"SELECT pg_total_relation_size('{t}')")).scalar() for t in tables)
+
+def sqlite_bytes(engine, path) -> int:
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+    return os.path.getsize(path)
+
+def make_engine(args, name):
+    if args.database_url:
+        return create_engine(args.database_url), None
+    path = os.path.join(args.workdir, f"{name}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    return create_engine(f"sqlite:///{path}"), path
+
+def reset(engine):
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for model in (HealthRecord, SeriesChunk, SeriesUser):
+            session.exec(delete(model))
+        session.commit()
+    timeseries._series_ids.clear()
+
+def bench_mode(args, mode):
+    engine, path = make_engine(args, mode)
+    reset(engine)
+
+    readings = 0
+    start = time.perf_counter()
+    with Session(engine) as session:
+        for i, record in enumerate(generate_readings(args.users, args.days)):
+            if mode == "row":
+                session.add(record)
+            else:
+                timeseries.append_record(session, record)
+            readings += sum(1 for m in timeseries.METRICS if getattr(record, m) is not None)
+            if i % args.batch == args.batch - 1:
+                session.commit()
+        session.commit()
+    write_seconds = time.perf_counter() - start
+
+    if path:
+        size = sqlite_bytes(engine, path)
+    else:
+        tables = ["healthrecord"] if mode == "row" else ["serieschunk", "seriesuser"]
+        size = relation_bytes(engine, tables)
+
+    # Range scan: one day of one user, repeated
+    range_start = datetime(2024, 1, 1, 12)
+    range_end = range_start + timedelta(days=1)
+    latencies = []
+    rows = 0
+    with Session(engine) as session:
+        for i in range(args.scans):
+            username = f"user{i % args.users}"
+            t0 = time.perf_counter()
+            if mode == "row":
+                statement = select(HealthRecord).where(
+                    HealthRecord.username == username,
+                    HealthRecord.timestamp >= range_start,
+                    HealthRecord.timestamp <= range_end
+                )
+                rows = len(session.exec(statement).all())
+            else:
+                rows = len(timeseries.read_records(session, username, range_start, range_end))
+            latencies.append(time.perf_counter() - t0)
+            session.expunge_all()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "readings": readings,
+        "bytes": size,
+        "bytes_per_reading": round(size / readings, 2),
+        "write_readings_per_second": round(readings / write_seconds, 1),
+        "range_scan_records": rows,
+        "range_scan_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "range_scan_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Row vs compact health storage benchmark")
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--scans", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=1000, help="Readings per commit")
+    parser.add_argument("--database-url", help="Postgres URL (default: temporary SQLite files)")
+    parser.add_argument("--workdir", default=tempfile.gettempdir())
+    args = parser.parse_args()
+
+    results = [bench_mode(args, "row"), bench_mode(args, "compact")]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Runs the benchmark scenarios and writes one JSON document, so results can be
+compared between commits.
+
+    python -m benchmarks.suite                                  # all scenarios, default sizes
+    python -m benchmarks.suite ingest gateway --quick           # a subset, small sizes
+    python -m benchmarks.suite --output base.json               # on the base commit
+    python -m benchmarks.suite --output head.json --compare base.json
+
+Each scenario runs in its own process (every service has its own `app`
+package) against a temporary SQLite database; --database-url runs the
+database-backed ones against e.g. a Postgres container instead. With
+--compare, changes beyond --threshold are listed and the exit status is 1 if
+anything got worse.
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from benchmarks.suite.harness import ROOT
+
+# name -> (command, default arguments, --quick arguments)
+SCENARIOS = {
+    "ingest": (["-m", "benchmarks.suite.ingest"], [], ["--requests", "300"]),
+    "reads": (["-m", "benchmarks.suite.reads"], [], ["--rows", "10000", "--repeat", "3"]),
+    "analytics": (["-m", "benchmarks.suite.analytics"], [], ["--events", "300", "--insight-calls", "2000"]),
+    "fanout": (["-m", "benchmarks.suite.fanout"], [], ["--sockets", "10", "100", "--messages", "10"]),
+    "gateway": (["-m", "benchmarks.suite.gateway"], [], ["--requests", "300"]),
+    "events": (["-m", "benchmarks.suite.events"], [], ["--events", "2000"]),
+    "serialization": ([os.path.join("benchmarks", "serialization.py")], [], ["--rows", "100", "1000", "--repeat", "3"]),
+    "storage": ([os.path.join("benchmarks", "storage_compact.py")], [], ["--users", "1", "--days", "1", "--scans", "5"]),
+}
+USES_DATABASE = {"ingest", "reads", "analytics", "fanout", "storage"}
+
+# Higher is better for throughput; lower is better for everything timed
+HIGHER_IS_BETTER = ("per_s", "speedup")
+LOWER_IS_BETTER = ("_ms", "_us", "_s")
+# Fields that identify a row of a sweep (rather than measure it)
+SWEEP_KEYS = ("model", "mode", "rows", "sockets")
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_scenario(name: str, quick: bool, database_url: str = None):
+    command, defaults, quick_args = SCENARIOS[name]
+    args = list(quick_args if quick else defaults)
+    if database_url and name in USES_DATABASE:
+        args += ["--database-url", database_url]
+    completed = subprocess.run([sys.executable, "-W", "ignore", *command, *args], cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1:] or [f"exit {completed.returncode}"]}
+    return json.loads(completed.stdout)
+
+def flatten(value, prefix: str = ""):
+    """{"a": {"b": 1}, "results": [{"rows": 10, "x_ms": 2}]} -> {"a.b": 1, "results[rows=10].x_ms": 2}"""
+    items = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if key not in SWEEP_KEYS:
+                items.update(flatten(child, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, list):
+        for i, child in enumerate(value):
+            # Rows of a sweep are matched by what they measured, not by position
+            label = ",".join(f"{k}={child[k]}" for k in SWEEP_KEYS if k in child) if isinstance(child, dict) else ""
+            items.update(flatten(child, f"{prefix}[{label or i}]"))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        items[prefix] = value
+    return items
+
+def compare(current: dict, baseline: dict, threshold: float):
+    regressions, improvements = [], []
+    old = flatten(baseline.get("results", {}))
+    for key, new_value in flatten(current.get("results", {})).items():
+        old_value = old.get(key)
+        leaf = key.rsplit(".", 1)[-1]
+        if not old_value or leaf in ("count", "max_ms"):
+            continue # max is a single sample; too noisy to gate on
+        if leaf.endswith(HIGHER_IS_BETTER) or any(marker in leaf for marker in HIGHER_IS_BETTER):
+            change = (old_value - new_value) / old_value
+        elif leaf.endswith(LOWER_IS_BETTER):
+            change = (new_value - old_value) / old_value
+        else:
+            continue
+        entry = {"metric": key, "baseline": old_value, "current": new_value, "worse_by": round(change, 3)}
+        if change > threshold:
+            regressions.append(entry)
+        elif change < -threshold:
+            improvements.append(entry)
+    return regressions, improvements
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite")
+    parser.add_argument("scenarios", nargs="*", help=f"Any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Small sizes, for a smoke run")
+    parser.add_argument("--database-url", help="Run database-backed scenarios against this database")
+    parser.add_argument("--output", help="Write results here as well as to stdout")
+    parser.add_argument("--compare", help="Results file of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change reported by --compare")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "results": {},
+    }
+    for name in args.scenarios or SCENARIOS:
+        print(f" [Bench] {name}...", file=sys.stderr)
+        report["results"][name] = run_scenario(name, args.quick, args.database_url)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions, improvements = compare(report, baseline, args.threshold)
+        report["comparison"] = {"baseline_commit": baseline.get("commit"), "regressions": regressions, "improvements": improvements}
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+In-memory stand-in for the part of aio_pika the services use: topic exchanges,
+queues, bindings, publish and consume. Lets publish_event and the consumers run
+unchanged without a RabbitMQ broker, so the numbers measure the services only.
+
+    broker = InMemoryBroker()
+    events.connect = broker.connect         # health_service/app/events.py
+    on_message = with_retries(channel, "analytics_queue", consumer.handle_message)  # hts_common/retry.py
+    await broker.bind("analytics_queue", "health.record.*", on_message)
+    ...
+    await broker.drain()
+"""
+import re
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+def topic_pattern(binding: str) -> "re.Pattern":
+    """Matches "." + routing_key: '*' is exactly one word, '#' zero or more."""
+    parts = []
+    for word in binding.split("."):
+        if word == "#":
+            parts.append(r"(?:\.[^.]+)*")
+        elif word == "*":
+            parts.append(r"\.[^.]+")
+        else:
+            parts.append(r"\." + re.escape(word))
+    return re.compile("".join(parts) + "$")
+
+class Delivery:
+    """What a consumer callback receives (the IncomingMessage surface used by the services)."""
+    def __init__(self, channel: "Channel", message, routing_key: str):
+        self.channel = channel
+        self.body = message.body
+        self.headers = message.headers or {}
+        self.content_type = message.content_type
+        self.message_id = message.message_id
+        self.timestamp = message.timestamp
+        self.type = message.type
+        self.routing_key = routing_key
+
+    @asynccontextmanager
+    async def process(self, requeue: bool = False, ignore_processed: bool = False):
+        yield
+
+class Queue:
+    def __init__(self, broker: "InMemoryBroker", name: str):
+        self.broker = broker
+        self.name = name
+        self.messages: deque = deque()
+        self.callback: Optional[Callable] = None
+        self.pump: Optional[asyncio.Task] = None
+        self.delivered = 0
+
+    async def bind(self, exchange, routing_key: str):
+        self.broker.bindings.append((topic_pattern(routing_key), self))
+
+    async def consume(self, callback: Callable):
+        self.callback = callback
+        self.kick()
+
+    def put(self, delivery: Delivery):
+        self.messages.append(delivery)
+        self.kick()
+
+    def kick(self):
+        if self.callback and self.messages and (self.pump is None or self.pump.done()):
+            self.pump = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        # One message at a time, like a consumer with prefetch_count=1
+        while self.messages:
+            delivery = self.messages.popleft()
+            try:
+                await self.callback(delivery)
+            except Exception as e:
+                self.broker.errors.append(f"{self.name}: {type(e).__name__}: {e}")
+            self.delivered += 1
+
+class Exchange:
+    def __init__(self, broker: "InMemoryBroker", channel: "Channel", name: str):
+        self.broker = broker
+        self.channel = channel
+        self.name = name
+
+    async def publish(self, message, routing_key: str, **kwargs):
+        self.broker.published += 1
+        for pattern, queue in self.broker.bindings:
+            if pattern.match("." + routing_key):
+                queue.put(Delivery(self.channel, message, routing_key))
+
+class DefaultExchange(Exchange):
+    """Routes by queue name. hts_common/retry.py moves failed messages through it, so
+    anything it receives with an x-last-error header is reported as an error."""
+    async def publish(self, message, routing_key: str, **kwargs):
+        self.broker.published += 1
+        error = (message.headers or {}).get("x-last-error")
+        if error:
+            self.broker.errors.append(f"{routing_key}: {error}")
+        self.broker.queue(routing_key).put(Delivery(self.channel, message, routing_key))
+
+class Channel:
+    def __init__(self, broker: "InMemoryBroker"):
+        self.broker = broker
+        self.default_exchange = DefaultExchange(broker, self, "")
+
+    async def declare_exchange(self, name: str, *args, **kwargs) -> Exchange:
+        return Exchange(self.broker, self, name)
+
+    async def declare_queue(self, name: str = "", *args, **kwargs) -> Queue:
+        return self.broker.queue(name or f"amq.gen-{len(self.broker.queues)}")
+
+    async def set_qos(self, *args, **kwargs):
+        pass
+
+class Connection:
+    def __init__(self, broker: "InMemoryBroker"):
+        self.broker = broker
+
+    async def channel(self, *args, **kwargs) -> Channel:
+        return Channel(self.broker)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+class InMemoryBroker:
+    def __init__(self):
+        self.queues: Dict[str, Queue] = {}
+        self.bindings: List[Tuple["re.Pattern", Queue]] = []
+        self.published = 0
+        self.connections = 0
+        self.errors: List[str] = []
+
+    async def connect(self, url: str = None, *args, **kwargs) -> Connection:
+        self.connections += 1
+        return Connection(self)
+
+    def queue(self, name: str) -> Queue:
+        if name not in self.queues:
+            self.queues[name] = Queue(self, name)
+        return self.queues[name]
+
+    async def bind(self, queue_name: str, routing_key: str, callback: Optional[Callable] = None) -> Queue:
+        queue = self.queue(queue_name)
+        await queue.bind(None, routing_key)
+        if callback:
+            await queue.consume(callback)
+        return queue
+
+    async def drain(self):
+        """Waits until every consumed queue is empty (consumers may publish more)."""
+        while True:
+            pumps = [q.pump for q in self.queues.values() if q.pump and not q.pump.done()]
+            if not pumps:
+                return
+            await asyncio.gather(*pumps)
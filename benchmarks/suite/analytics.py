@@ -0,0 +1,142 @@
+"""
+Analytics worker throughput: created events per second through the real
+consumer (aggregates, rollups, baselines, insights, cache invalidation), and
+the cost of insight generation on its own.
+
+    python -m benchmarks.suite.analytics --events 2000 --users 20
+
+Events are spread over --days days per user, so baselines warm up and the
+anomaly rules get exercised. Afterwards a regression check updates and deletes
+the readings a day's min and max came from, and reports wrong bounds under
+"bounds_errors".
+"""
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+from benchmarks.suite.amqp import InMemoryBroker
+from benchmarks.suite.harness import configure, emit, quiet_stdout
+
+def make_event(rng: random.Random, username: str, day: int, i: int):
+    from hts_common.envelope import new_event
+    # Every 10th day is an outlier, so anomalies (and their insights) show up
+    outlier = day % 10 == 9
+    return new_event("health.record.created", username, {
+        "steps": rng.randint(4000, 6000) // (4 if outlier else 1),
+        "heart_rate": rng.randint(60, 80) + (40 if outlier else 0),
+        "sleep_hours": round(rng.uniform(6, 8), 1),
+        "weight": round(rng.uniform(70, 71), 1),
+        "timestamp": datetime(2024, 1, 1) + timedelta(days=day, minutes=i % 600),
+    }, record_id=i)
+
+BOUNDS_USER = "bounds_check"
+
+async def check_bounds(broker, exchange) -> list:
+    """
+    Readings 60, 70 and 90 on one day, then 90 updated to 75 and 60 deleted:
+    the day and its week and month must end with count 2, min 70, max 75.
+    """
+    from sqlmodel import Session, select
+    from app.database import engine
+    from hts_common.envelope import event_message, new_event
+    from app.models import DailyHealthStats, HealthStatsRollup
+
+    day = datetime(2024, 6, 5, 12)
+    events = [
+        ("created", {"heart_rate": value, "timestamp": day}, record_id)
+        for record_id, value in ((1, 60), (2, 70), (3, 90))
+    ]
+    events.append(("updated", {
+        "updated_fields": {"heart_rate": 75},
+        "old_data": {"heart_rate": 90, "timestamp": day},
+        "timestamp": day,
+    }, 3))
+    events.append(("deleted", {"deleted_record": {"heart_rate": 60, "timestamp": day}}, 1))
+    for kind, data, record_id in events:
+        event = new_event(f"health.record.{kind}", BOUNDS_USER, data, record_id=record_id)
+        await exchange.publish(event_message(event), routing_key=f"health.record.{kind}")
+        await broker.drain()
+
+    expected = (2, 70, 75)
+    with Session(engine) as session:
+        rows = list(session.exec(select(DailyHealthStats).where(DailyHealthStats.username == BOUNDS_USER)))
+        rows += session.exec(select(HealthStatsRollup).where(HealthStatsRollup.username == BOUNDS_USER))
+    errors = [] if len(rows) == 3 else [f"{len(rows)} stats rows, expected 3"]
+    for row in rows:
+        got = (row.heart_rate_count, row.min_heart_rate, row.max_heart_rate)
+        if got != expected:
+            errors.append(f"{type(row).__name__}: heart_rate count/min/max {got}, expected {expected}")
+    return errors
+
+def bench_insights(calls: int) -> dict:
+    from app.models import DailyHealthStats
+    from app.aggregates import add_reading
+    from app.baselines import Anomaly
+    from app.engine import generate_insights
+
+    daily = DailyHealthStats(username="bench", date=datetime(2024, 1, 1).date())
+    for metric, value in (("steps", 12000), ("heart_rate", 72), ("sleep_hours", 5.5), ("weight", 70.2)):
+        add_reading(daily, metric, value)
+    anomalies = [Anomaly("heart_rate", 110.0, 72.0, 4.1), Anomaly("steps", 800.0, 6000.0, -3.4)]
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        generate_insights("bench", daily, anomalies)
+    elapsed = time.perf_counter() - start
+    return {"calls": calls, "per_call_us": round(elapsed / calls * 1e6, 2)}
+
+async def run(args) -> dict:
+    import app.consumer as consumer
+    from app.database import create_db_and_tables
+    from hts_common.envelope import event_message
+    from hts_common.retry import with_retries
+
+    create_db_and_tables()
+    broker = InMemoryBroker()
+    insights = await broker.bind("notification_queue", "analysis.insight.#") # Not consumed: counts insights
+    analytics = broker.queue("analytics_queue")
+    await analytics.bind(None, "health.record.*")
+
+    rng = random.Random(42)
+    per_user = max(1, args.events // args.users)
+    channel = await (await broker.connect()).channel()
+    exchange = await channel.declare_exchange("health_events")
+    for i in range(args.events):
+        user, n = divmod(i, per_user)
+        event = make_event(rng, f"user_{user % args.users}", n * args.days // per_user, i)
+        await exchange.publish(event_message(event), routing_key="health.record.created")
+
+    start = time.perf_counter()
+    await analytics.consume(with_retries(channel, "analytics_queue", consumer.handle_message))
+    await broker.drain()
+    elapsed = time.perf_counter() - start
+    bounds_errors = await check_bounds(broker, exchange)
+
+    return {
+        "scenario": "analytics",
+        "events": args.events,
+        "users": args.users,
+        "events_per_s": round(analytics.delivered / elapsed, 1),
+        "insights_published": len(insights.messages),
+        "errors": broker.errors[:5],
+        "bounds_errors": bounds_errors,
+        "insight_generation": bench_insights(args.insight_calls),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analytics consumer throughput")
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30, help="Days of history per user")
+    parser.add_argument("--insight-calls", type=int, default=20000)
+    parser.add_argument("--database-url", help="Default: a temporary SQLite file")
+    args = parser.parse_args(argv)
+
+    configure("analytics_service", args.database_url)
+    with quiet_stdout():
+        result = asyncio.run(run(args))
+    emit(result)
+
+if __name__ == "__main__":
+    main()
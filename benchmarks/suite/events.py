@@ -0,0 +1,78 @@
+"""
+Size and decode cost of health_events messages: the legacy bare JSON dict
+with ISO timestamps versus the envelope (hts_common/envelope.py) as JSON and msgpack.
+
+    python -m benchmarks.suite.events --events 20000
+"""
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from benchmarks.suite.harness import configure, emit
+
+def make_records(count: int):
+    rng = random.Random(7)
+    records = []
+    for i in range(count):
+        systolic = rng.randint(105, 140)
+        records.append((i + 1, {
+            "steps": rng.randint(0, 400), "sleep_hours": None, "weight": round(rng.uniform(60, 90), 1),
+            "heart_rate": rng.randint(55, 110), "blood_pressure": f"{systolic}/{systolic - 40}",
+            "systolic": systolic, "diastolic": systolic - 40, "blood_sugar": None,
+            "body_temperature": round(rng.uniform(36.2, 37.4), 1),
+            "timestamp": datetime(2024, 1, 1) + timedelta(seconds=30 * i),
+        }))
+    return records
+
+def legacy_body(record_id: int, fields: dict) -> bytes:
+    payload = dict(fields, record_id=record_id, username="alice", timestamp=fields["timestamp"].isoformat())
+    return json.dumps(payload).encode()
+
+def legacy_consume(body: bytes):
+    # What the consumers did per message before the envelope
+    event = json.loads(body)
+    return datetime.fromisoformat(event["timestamp"]).date()
+
+def measure(bodies, decode):
+    start = time.perf_counter()
+    for body in bodies:
+        decode(body)
+    elapsed = time.perf_counter() - start
+    return {
+        "avg_bytes": round(sum(map(len, bodies)) / len(bodies), 1),
+        "decode_us": round(elapsed / len(bodies) * 1e6, 3),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Event encoding size and decode cost")
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    configure("health_service", "sqlite://")
+    from hts_common import envelope
+
+    records = make_records(args.events)
+    # As published by POST /data: fields that are None are left out
+    events = [
+        envelope.new_event("health.record.created", "alice", {k: v for k, v in fields.items() if v is not None}, record_id=record_id)
+        for record_id, fields in records
+    ]
+    result = {"scenario": "events", "events": args.events}
+
+    bodies = [legacy_body(record_id, fields) for record_id, fields in records]
+    result["legacy_json"] = measure(bodies, legacy_consume)
+
+    def consume(content_type):
+        return lambda body: envelope.from_ms(envelope.decode_event(body, content_type).data["timestamp"]).date()
+
+    for encoding, content_type in (("json", envelope.JSON), ("msgpack", envelope.MSGPACK)):
+        if encoding == "msgpack" and envelope.msgpack is None:
+            continue
+        envelope.EVENT_ENCODING = encoding
+        bodies = [envelope.encode_event(event)[0] for event in events]
+        result[f"envelope_{encoding}"] = measure(bodies, consume(content_type))
+    emit(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Notification fan-out: time from an insight event reaching the notification
+consumer until the last of N open WebSockets has been handed the message.
+
+    python -m benchmarks.suite.fanout --sockets 10 100 1000 --messages 50
+
+Sockets are in-process stand-ins for Starlette's WebSocket (send_text only),
+optionally slowed by --send-delay-ms to show what one slow client costs the
+others. For real sockets through the gateway, use benchmarks/ws_load.py.
+"""
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from benchmarks.suite.amqp import InMemoryBroker
+from benchmarks.suite.harness import configure, emit, quiet_stdout, summarize
+
+class FakeSocket:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.last_received = 0.0
+        self.received = 0
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+        self.last_received = time.perf_counter()
+
+async def run(args) -> dict:
+    import app.consumer as consumer
+    from app.database import create_db_and_tables
+    from hts_common.envelope import event_message, new_event
+    from app.manager import manager
+    from hts_common.retry import with_retries
+
+    create_db_and_tables()
+    broker = InMemoryBroker()
+    channel = await (await broker.connect()).channel()
+    queue = await broker.bind("notification_queue", "analysis.insight.#", with_retries(channel, "notification_queue", consumer.handle_message))
+    exchange = await channel.declare_exchange("health_events")
+
+    results = []
+    for count in args.sockets:
+        username = f"fanout_{count}"
+        sockets = [FakeSocket(args.send_delay_ms / 1000) for _ in range(count)]
+        manager.active_connections[username] = list(sockets)
+
+        latencies = []
+        for i in range(args.messages):
+            event = new_event("analysis.insight.Anomaly", username, {
+                "type": "Anomaly", "severity": "WARNING",
+                "message": f"Heart rate was unusually high ({i})", "timestamp": datetime.utcnow(),
+            })
+            start = time.perf_counter()
+            await exchange.publish(event_message(event), routing_key="analysis.insight.Anomaly")
+            await broker.drain()
+            latencies.append(max(s.last_received for s in sockets) - start)
+
+        manager.active_connections.pop(username, None)
+        results.append({
+            "sockets": count,
+            "messages": args.messages,
+            "delivered": sum(s.received for s in sockets),
+            "event_to_last_socket": summarize(latencies),
+        })
+    return {"scenario": "fanout", "send_delay_ms": args.send_delay_ms, "errors": broker.errors[:5], "results": results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Notification fan-out latency")
+    parser.add_argument("--sockets", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--send-delay-ms", type=float, default=0.0)
+    parser.add_argument("--database-url", help="Default: a temporary SQLite file")
+    args = parser.parse_args(argv)
+
+    configure("notification_service", args.database_url)
+    with quiet_stdout():
+        result = asyncio.run(run(args))
+    emit(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Gateway proxy overhead: the same GET against a stub upstream, once directly
+and once through the gateway (auth, rate limiting, breaker, compression,
+tracing), both in-process. The overhead run has request coalescing off, so
+every request takes the full path; a last run with it on reports how many
+upstream calls the same load needed.
+
+    python -m benchmarks.suite.gateway --requests 2000 --concurrency 16 --body-bytes 2048
+"""
+import asyncio
+import argparse
+from benchmarks.suite.harness import asgi_client, configure, emit, make_token, quiet_stdout, run_concurrent, summarize
+
+def stub_upstream(body: bytes, hits: list):
+    async def app(scope, receive, send):
+        hits.append(1)
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())
+        ]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+async def measure(client, path: str, headers: dict, args):
+    failures = []
+
+    async def call(i):
+        response = await client.get(path, headers=headers)
+        if response.status_code != 200:
+            failures.append(response.status_code)
+
+    await run_concurrent(min(200, args.requests), args.concurrency, call) # Warm-up
+    latencies, elapsed = await run_concurrent(args.requests, args.concurrency, call)
+    return dict(summarize(latencies), requests_per_s=round(args.requests / elapsed, 1), failures=len(failures))
+
+async def run(args) -> dict:
+    import httpx
+    import main
+    from app import coalescing, upstream
+
+    body = b'{"items": "' + b"x" * max(0, args.body_bytes - 13) + b'"}'
+    hits = []
+    stub = stub_upstream(body, hits)
+    upstream._clients[upstream.origin_of(main.HEALTH_SERVICE_URL)] = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub))
+    headers = {"Authorization": f"Bearer {make_token('gateway_bench')}", "Accept-Encoding": args.accept_encoding}
+
+    async with asgi_client(stub) as direct_client, asgi_client(main.app) as gateway_client:
+        direct = await measure(direct_client, "/data", headers, args)
+        coalescing.COALESCE_ENABLED = False
+        proxied = await measure(gateway_client, "/health/data", headers, args)
+        coalescing.COALESCE_ENABLED = True
+        hits.clear()
+        coalesced = await measure(gateway_client, "/health/data", headers, args)
+        coalesced["upstream_calls"] = len(hits) # Warm-up included
+
+    return {
+        "scenario": "gateway",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "body_bytes": len(body),
+        "accept_encoding": args.accept_encoding,
+        "direct": direct,
+        "gateway": proxied,
+        "gateway_coalesced": coalesced,
+        "overhead_p50_ms": round(proxied["p50_ms"] - direct["p50_ms"], 3),
+        "overhead_p95_ms": round(proxied["p95_ms"] - direct["p95_ms"], 3),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gateway proxy overhead")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--body-bytes", type=int, default=2048)
+    parser.add_argument("--accept-encoding", default="identity", help="e.g. 'br, gzip' to include compression")
+    args = parser.parse_args(argv)
+
+    # Limits and probes are part of the gateway, but must not shape the measurement
+    configure("api_gateway", "sqlite://", RATE_LIMITS="default=1000000:1000000", UPSTREAM_MAX_CONCURRENCY=1000)
+    with quiet_stdout():
+        result = asyncio.run(run(args))
+    emit(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Shared plumbing for the benchmark scenarios: loading a service's app in this
+process, auth tokens, concurrent request loops and latency summaries.
+
+Every service has its own top-level `app` package, so a scenario process loads
+exactly one service (plus, for the gateway, a stub upstream).
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import tempfile
+import contextlib
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+SECRET_KEY = "benchmark-secret"
+
+def configure(service: str, database_url: str = None, **env):
+    """Environment for `service`; call before anything imports from `app`."""
+    if not database_url:
+        fd, path = tempfile.mkstemp(prefix=f"bench_{service}_", suffix=".db")
+        os.close(fd)
+        database_url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["SECRET_KEY"] = SECRET_KEY
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    os.environ.setdefault("TRACE_SPANS", "false")
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    sys.path.insert(0, os.path.join(ROOT, service))
+    return database_url
+
+def make_token(username: str) -> str:
+    from jose import jwt
+    expire = datetime.utcnow() + timedelta(hours=1)
+    return jwt.encode({"sub": username, "exp": expire}, SECRET_KEY, algorithm="HS256")
+
+def asgi_client(app, **kwargs):
+    """httpx client calling `app` in-process, without sockets."""
+    import httpx
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", **kwargs)
+
+def summarize(latencies: List[float]) -> dict:
+    """Latency percentiles in milliseconds."""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+async def run_concurrent(total: int, concurrency: int, call: Callable[[int], Awaitable[None]]):
+    """Runs call(0..total-1) with `concurrency` in flight. Returns (latencies, elapsed seconds)."""
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+@contextlib.contextmanager
+def quiet_stdout():
+    """Service logs go to stdout; keep stdout for the JSON result."""
+    real = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        yield
+    finally:
+        sys.stdout = real
+
+def emit(result):
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,73 @@
+"""
+Ingest throughput of POST /data on the health service, including publishing
+the created event (to the in-memory broker).
+
+    python -m benchmarks.suite.ingest --requests 2000 --concurrency 32 --storage row
+
+Readings are stamped with the server's time on arrival, like any client's.
+"""
+import random
+import asyncio
+import argparse
+from benchmarks.suite.amqp import InMemoryBroker
+from benchmarks.suite.harness import asgi_client, configure, emit, make_token, quiet_stdout, run_concurrent, summarize
+
+def make_payload(rng: random.Random, i: int) -> dict:
+    systolic = rng.randint(105, 140)
+    return {
+        "steps": rng.randint(0, 400),
+        "heart_rate": rng.randint(55, 110),
+        "blood_pressure": f"{systolic}/{systolic - rng.randint(30, 50)}",
+        "weight": round(rng.uniform(60, 90), 1),
+    }
+
+async def run(args) -> dict:
+    from main import app
+    from app import events
+    from app.database import create_db_and_tables
+
+    create_db_and_tables()
+    broker = InMemoryBroker()
+    events.connect = broker.connect
+    queue = await broker.bind("analytics_queue", "health.record.*") # Not consumed: counts events
+
+    rng = random.Random(42)
+    users = [f"ingest_{n}" for n in range(args.users)]
+    tokens = {user: {"Authorization": f"Bearer {make_token(user)}"} for user in users}
+    failures = []
+
+    async with asgi_client(app) as client:
+        async def call(i):
+            response = await client.post("/data", json=make_payload(rng, i), headers=tokens[users[i % len(users)]])
+            if response.status_code != 200:
+                failures.append(response.status_code)
+
+        latencies, elapsed = await run_concurrent(args.requests, args.concurrency, call)
+
+    return {
+        "scenario": "ingest",
+        "storage": args.storage,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "requests_per_s": round(args.requests / elapsed, 1),
+        "latency": summarize(latencies),
+        "failures": len(failures),
+        "events_published": len(queue.messages),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POST /data ingest throughput")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--storage", choices=["row", "compact"], default="row")
+    parser.add_argument("--database-url", help="Default: a temporary SQLite file")
+    args = parser.parse_args(argv)
+
+    configure("health_service", args.database_url, HEALTH_STORAGE_MODE=args.storage)
+    with quiet_stdout():
+        result = asyncio.run(run(args))
+    emit(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+List latency of GET /data for one user with 10k..1M stored readings: the full
+history (what an export reads) and the last day (what the dashboard reads).
+
+    python -m benchmarks.suite.reads --rows 10000 100000 1000000 --repeat 5
+
+Rows are inserted directly, in batches, before any request is timed.
+"""
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+from benchmarks.suite.harness import asgi_client, configure, emit, make_token, quiet_stdout, summarize
+
+INTERVAL_SECONDS = 60
+SEED_BATCH = 10000
+
+def seed(engine, table, username: str, rows: int, end: datetime):
+    rng = random.Random(rows)
+    start = end - timedelta(seconds=INTERVAL_SECONDS * rows)
+    with engine.begin() as conn:
+        for offset in range(0, rows, SEED_BATCH):
+            batch = []
+            for i in range(offset, min(rows, offset + SEED_BATCH)):
+                systolic = rng.randint(105, 140)
+                batch.append({
+                    "username": username, "steps": rng.randint(0, 200), "heart_rate": rng.randint(55, 110),
+                    "blood_pressure": f"{systolic}/{systolic - 40}", "systolic": systolic, "diastolic": systolic - 40,
+                    "weight": round(rng.uniform(60, 90), 1), "timestamp": start + timedelta(seconds=INTERVAL_SECONDS * i),
+                })
+            conn.execute(table.insert(), batch)
+
+async def run(args) -> dict:
+    from main import app
+    from app.database import create_db_and_tables, engine
+    from app.models import HealthRecord
+
+    create_db_and_tables()
+    end = datetime(2024, 6, 1)
+    results = []
+    async with asgi_client(app, timeout=600) as client:
+        for rows in args.rows:
+            username = f"reader_{rows}"
+            t0 = time.perf_counter()
+            seed(engine, HealthRecord.__table__, username, rows, end)
+            seed_s = time.perf_counter() - t0
+            headers = {"Authorization": f"Bearer {make_token(username)}"}
+
+            timings = {}
+            for name, params in (("full", {}), ("last_day", {"start": (end - timedelta(days=1)).isoformat()})):
+                latencies, size = [], 0
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    response = await client.get("/data", params=params, headers=headers)
+                    latencies.append(time.perf_counter() - start)
+                    size = len(response.content)
+                timings[name] = dict(summarize(latencies), bytes=size)
+
+            results.append({
+                "rows": rows,
+                "seed_s": round(seed_s, 2),
+                "full": timings["full"],
+                "full_rows_per_s": round(rows / (timings["full"]["p50_ms"] / 1000)),
+                "last_day": timings["last_day"],
+            })
+    return {"scenario": "reads", "results": results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GET /data latency by history size")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", help="Default: a temporary SQLite file")
+    args = parser.parse_args(argv)
+
+    configure("health_service", args.database_url)
+    with quiet_stdout():
+        result = asyncio.run(run(args))
+    emit(result)
+
+if __name__ == "__main__":
+    main()
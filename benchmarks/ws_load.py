@@ -0,0 +1,101 @@
+"""
+WebSocket load test for the API Gateway proxy.
+
+Opens N simulated notification clients through the gateway, keeps them idle
+for a while and reports how many connections one gateway process held and
+how much resident memory each socket cost.
+
+    python benchmarks/ws_load.py --url ws://localhost:8000 --username alice \
+        --token <access_token> --clients 5000 --pid <gateway pid>
+
+`--pid` must point at the gateway (uvicorn) process on this host; without it
+only connection counts and timings are reported.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import resource
+from typing import Optional
+import websockets
+
+def read_rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+async def open_client(url: str, connected: list, failures: list, hold: asyncio.Event):
+    try:
+        async with websockets.connect(url, compression=None, max_queue=4, open_timeout=30) as ws:
+            connected.append(ws)
+            # Idle until the test ends; websockets answers the gateway's pings for us
+            await hold.wait()
+    except Exception as e:
+        failures.append(type(e).__name__)
+
+async def run(args):
+    url = f"{args.url.rstrip('/')}/notifications/ws/{args.username}?token={args.token}"
+    connected, failures = [], []
+    hold = asyncio.Event()
+
+    rss_before = read_rss_kb(args.pid) if args.pid else None
+
+    start = time.perf_counter()
+    tasks = []
+    for i in range(args.clients):
+        tasks.append(asyncio.create_task(open_client(url, connected, failures, hold)))
+        if args.ramp and i % args.ramp == args.ramp - 1:
+            await asyncio.sleep(0.05) # Spread the handshakes out a little
+    while len(connected) + len(failures) < args.clients:
+        await asyncio.sleep(0.1)
+    ramp_seconds = time.perf_counter() - start
+
+    print(f" [Load] {len(connected)} connected, {len(failures)} failed in {ramp_seconds:.1f}s. Holding {args.hold}s...")
+    await asyncio.sleep(args.hold)
+    alive = sum(1 for ws in connected if ws.state == websockets.protocol.State.OPEN)
+    rss_after = read_rss_kb(args.pid) if args.pid else None
+
+    hold.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    result = {
+        "clients": args.clients,
+        "connected": len(connected),
+        "alive_after_hold": alive,
+        "failed": len(failures),
+        "failure_types": sorted(set(failures)),
+        "ramp_seconds": round(ramp_seconds, 3),
+        "connections_per_second": round(len(connected) / ramp_seconds, 1) if ramp_seconds else None,
+        "gateway_rss_before_kb": rss_before,
+        "gateway_rss_after_kb": rss_after,
+    }
+    if rss_before is not None and rss_after is not None and alive:
+        result["gateway_kb_per_socket"] = round((rss_after - rss_before) / alive, 2)
+    print(json.dumps(result, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket proxy load test")
+    parser.add_argument("--url", default=os.getenv("GATEWAY_WS_URL", "ws://localhost:8000"))
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--token", required=True, help="Access token for --username")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--ramp", type=int, default=200, help="Handshakes per 50ms batch (0 = all at once)")
+    parser.add_argument("--hold", type=float, default=30.0, help="Seconds to keep the sockets idle")
+    parser.add_argument("--pid", type=int, help="Gateway process id to sample RSS from")
+    args = parser.parse_args()
+
+    # Every simulated client needs a file descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.clients + 100:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.clients + 100), hard))
+
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
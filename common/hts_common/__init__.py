@@ -0,0 +1,15 @@
+"""
+Modules shared by every service, installed into each one from common/
+(`-e ../common` in its requirements.txt):
+
+- instrumentation: metrics, tracing and structured logging
+- envelope: the wire format of health_events messages
+- readiness: waiting for Postgres and RabbitMQ
+- replicas: read-replica routing
+- responses: orjson responses
+- retry: retry and dead-letter topology of consumer queues
+- migrations: the versioned schema migration runner
+
+Service-specific code (models, MIGRATIONS lists, security) stays in each
+service's app/ package.
+"""
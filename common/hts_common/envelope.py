@@ -0,0 +1,128 @@
+"""
+Wire format of messages on the health_events exchange, for every service that
+publishes or consumes them.
+
+Every message carries an envelope:
+
+    schema     envelope version (EVENT_SCHEMA)
+    id         unique event id, also the AMQP message_id; consumers use it to
+               recognise redelivered messages
+    type       routing key, e.g. "health.record.updated"
+    username   owner of the data
+    record_id  HealthRecord id, when the event is about one record
+    version    version of that record after the change, when known
+    ts         when it happened, epoch milliseconds
+    data       event-specific payload; datetimes inside are epoch milliseconds
+
+Bodies are msgpack ("application/msgpack") when the library is installed,
+otherwise JSON; the content_type tells consumers which. In msgpack the envelope
+is an array in the field order above (schema first, so the layout can change
+with it); in JSON it is an object. Messages published before the envelope
+existed (a bare JSON dict) are still decoded, as schema 0.
+"""
+import os
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError: # JSON only
+    msgpack = None
+
+EVENT_SCHEMA = 1
+MSGPACK = "application/msgpack"
+JSON = "application/json"
+EVENT_ENCODING = os.getenv("EVENT_ENCODING", "msgpack") # "msgpack" or "json"
+
+EPOCH = datetime(1970, 1, 1)
+
+class Event(NamedTuple):
+    schema: int
+    id: str
+    type: str
+    username: Optional[str]
+    record_id: Optional[int]
+    version: Optional[int]
+    ts: int
+    data: dict
+
+def to_ms(value: datetime) -> int:
+    """Naive datetimes are UTC, like every timestamp in this system."""
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+def from_ms(value: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=value)
+
+def new_event(
+    type: str,
+    username: Optional[str],
+    data: dict,
+    record_id: Optional[int] = None,
+    version: Optional[int] = None,
+    at: Optional[datetime] = None
+) -> Event:
+    return Event(
+        EVENT_SCHEMA, uuid.uuid4().hex, type, username, record_id, version,
+        to_ms(at or datetime.utcnow()), data
+    )
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return to_ms(value)
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+def encode_event(event: Event) -> Tuple[bytes, str]:
+    """Returns (body, content_type)."""
+    if msgpack is not None and EVENT_ENCODING == "msgpack":
+        return msgpack.packb(tuple(event), default=_plain, use_bin_type=True), MSGPACK
+    return json.dumps(event._asdict(), default=_plain, separators=(",", ":")).encode(), JSON
+
+def decode_event(body: bytes, content_type: Optional[str], routing_key: str = "") -> Event:
+    """Raises ValueError on a body that is neither."""
+    if content_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack event received but msgpack is not installed")
+        try:
+            envelope = msgpack.unpackb(body, raw=False, use_list=False)
+        except Exception as e:
+            raise ValueError(f"Malformed msgpack event: {e}")
+        if not isinstance(envelope, tuple) or len(envelope) != len(Event._fields) or envelope[0] != EVENT_SCHEMA:
+            raise ValueError("Unsupported msgpack event layout")
+        return Event(*envelope)
+
+    envelope = json.loads(body)
+    if not isinstance(envelope, dict):
+        raise ValueError("Event must be an object")
+    if "schema" not in envelope:
+        return _from_legacy(envelope, routing_key)
+    return Event(**{field: envelope.get(field) for field in Event._fields})
+
+def _from_legacy(payload: dict, routing_key: str) -> Event:
+    """A pre-envelope JSON event, with ISO timestamps, as schema 0."""
+    data = dict(payload)
+    for holder in (data, data.get("deleted_record") or {}):
+        if isinstance(holder.get("timestamp"), str):
+            try:
+                holder["timestamp"] = to_ms(datetime.fromisoformat(holder["timestamp"]))
+            except ValueError:
+                holder["timestamp"] = None
+    ts = data.get("timestamp") or (data.get("deleted_record") or {}).get("timestamp") or to_ms(datetime.utcnow())
+    return Event(0, uuid.uuid4().hex, routing_key, data.get("username"), data.get("record_id"), None, ts, data)
+
+def event_message(event: Event, **kwargs):
+    """aio_pika Message for `event` (message_id, timestamp and content_type set)."""
+    from aio_pika import Message, DeliveryMode
+    body, content_type = encode_event(event)
+    kwargs.setdefault("delivery_mode", DeliveryMode.PERSISTENT)
+    return Message(
+        body,
+        content_type=content_type,
+        message_id=event.id,
+        timestamp=from_ms(event.ts),
+        type=event.type,
+        **kwargs
+    )
@@ -0,0 +1,380 @@
+"""
+Metrics, trace propagation and structured logging. Every service uses this one
+module, so the wire formats stay identical.
+
+Metrics: Prometheus text format from a process-local registry, served at /metrics.
+
+Tracing: W3C `traceparent` is read from incoming HTTP requests and AMQP message
+headers and written to outgoing ones, so an ingest request, the analytics event
+it causes, the insight and the resulting notification share one trace_id. Each
+span is logged as one JSON line ({"event": "span", ...}) when it ends.
+
+Logging: JSON lines to stdout. Records are queued by the caller and written by a
+background thread, so a slow stdout never blocks the event loop.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+TRACE_SPANS = os.getenv("TRACE_SPANS", "true").lower() == "true"
+
+# -------------------------------------------------------------------------
+# Metrics
+# -------------------------------------------------------------------------
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.series: Dict[Tuple, float] = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in self.series.items():
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return "\n".join(lines)
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.lock:
+            self.series[key] = value
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[Tuple, list] = {} # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in self.series.items():
+                for bound, count in zip(self.buckets, series):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series[-1]}")
+        return "\n".join(lines)
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+async def serve_metrics(port: int):
+    """/metrics for processes without an HTTP app (e.g. queue workers). Returns the asyncio server."""
+    import asyncio
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render_metrics().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "0.0.0.0", port)
+
+HTTP_SERVER_LATENCY = Histogram("http_server_request_duration_seconds", "Request handling time", ("method", "route", "status"))
+HTTP_CLIENT_LATENCY = Histogram("http_client_request_duration_seconds", "Outgoing request time per attempt", ("upstream", "method", "status"))
+DB_LATENCY = Histogram("db_query_duration_seconds", "Database statement time", ("operation",))
+AMQP_PUBLISH_LATENCY = Histogram("amqp_publish_duration_seconds", "Time to publish a message", ("routing_key",))
+AMQP_CONSUME_LATENCY = Histogram("amqp_consume_duration_seconds", "Time to process a consumed message", ("routing_key", "outcome"))
+AMQP_QUEUE_LAG = Histogram(
+    "amqp_queue_lag_seconds", "Time between publish and start of processing", ("routing_key",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 1800.0)
+)
+
+# -------------------------------------------------------------------------
+# Tracing
+# -------------------------------------------------------------------------
+
+class SpanContext:
+    __slots__ = ("trace_id", "span_id", "attributes")
+
+    def __init__(self, trace_id: str, span_id: str, attributes: Optional[dict] = None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.attributes = attributes or {}
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+_current_span: ContextVar[Optional[SpanContext]] = ContextVar("current_span", default=None)
+
+def current_span() -> Optional[SpanContext]:
+    return _current_span.get()
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return SpanContext(parts[1], parts[2])
+
+@contextmanager
+def start_span(name: str, parent: Optional[SpanContext] = None, **attributes) -> Iterator[SpanContext]:
+    """
+    Runs the block as a span: a child of `parent`, else of the current span,
+    else the root of a new trace. More attributes can be added to the yielded
+    span's `attributes` before the block ends.
+    """
+    parent = parent or _current_span.get()
+    span = SpanContext(parent.trace_id if parent else f"{random.getrandbits(128):032x}", f"{random.getrandbits(64):016x}", attributes)
+    token = _current_span.set(span)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield span
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        if TRACE_SPANS:
+            fields = dict(span.attributes, event="span", span=name, parent_id=parent.span_id if parent else None,
+                          duration_ms=round((time.perf_counter() - start) * 1000, 3))
+            if error:
+                fields["error"] = error
+            _span_logger.info(name, extra={"fields": fields, "trace": span})
+
+def inject_headers(headers: Optional[dict] = None) -> dict:
+    """Returns `headers` (or a new dict) with the current trace context added."""
+    headers = dict(headers or {})
+    span = _current_span.get()
+    if span:
+        headers["traceparent"] = span.traceparent
+    return headers
+
+# -------------------------------------------------------------------------
+# HTTP server
+# -------------------------------------------------------------------------
+
+class InstrumentationMiddleware:
+    """Server span and latency histogram per request; continues the caller's trace."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                parent = parse_traceparent(value.decode("latin-1"))
+                break
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                span = _current_span.get()
+                if span:
+                    message.setdefault("headers", []).append((b"x-trace-id", span.trace_id.encode()))
+            await send(message)
+
+        start = time.perf_counter()
+        with start_span("http.server", parent, method=scope["method"], path=scope["path"]) as span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # Route templates keep the label set small (/stats/{username}, not every user)
+                route = getattr(scope.get("route"), "path", "unmatched")
+                span.attributes.update(route=route, status=status["code"])
+                HTTP_SERVER_LATENCY.observe(time.perf_counter() - start, method=scope["method"], route=route, status=status["code"])
+
+# -------------------------------------------------------------------------
+# AMQP
+# -------------------------------------------------------------------------
+
+def amqp_headers(headers: Optional[dict] = None) -> dict:
+    """Headers for an outgoing message: trace context plus publish time (for queue lag)."""
+    headers = inject_headers(headers)
+    headers["x-published-at"] = time.time()
+    return headers
+
+@contextmanager
+def consume_span(message, routing_key: Optional[str] = None) -> Iterator[SpanContext]:
+    """Wraps the processing of a consumed aio_pika message (routing_key overrides the delivery's)."""
+    headers = message.headers or {}
+    routing_key = routing_key or message.routing_key or ""
+    traceparent = headers.get("traceparent")
+    if isinstance(traceparent, bytes):
+        traceparent = traceparent.decode()
+    published_at = headers.get("x-published-at")
+    if isinstance(published_at, (int, float)):
+        AMQP_QUEUE_LAG.observe(max(0.0, time.time() - published_at), routing_key=routing_key)
+
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        with start_span("amqp.consume", parse_traceparent(traceparent), routing_key=routing_key) as span:
+            yield span
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        AMQP_CONSUME_LATENCY.observe(time.perf_counter() - start, routing_key=routing_key, outcome=outcome)
+
+# -------------------------------------------------------------------------
+# Database
+# -------------------------------------------------------------------------
+
+def instrument_engine(engine):
+    """Records the time of every statement run on `engine`."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_LATENCY.observe(elapsed, operation=operation)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute: drop its start
+        # time, or the pooled connection's list would grow with every failure
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+# -------------------------------------------------------------------------
+# Logging
+# -------------------------------------------------------------------------
+
+class _ContextFilter(logging.Filter):
+    """Captures trace ids in the emitting thread, before the record is queued."""
+    def filter(self, record):
+        span = getattr(record, "trace", None) or _current_span.get()
+        record.trace_id = span.trace_id if span else None
+        record.span_id = span.span_id if span else None
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": _service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+            entry["span_id"] = record.span_id
+        entry.update(getattr(record, "fields", None) or {})
+        return json.dumps(entry, default=str)
+
+class StructuredLogger(logging.LoggerAdapter):
+    """logger.info("Sent event", routing_key=key): keyword arguments become JSON fields."""
+    def process(self, msg, kwargs):
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in ("exc_info", "stack_info", "stacklevel", "extra")}
+        kwargs["extra"] = {"fields": fields}
+        return msg, kwargs
+
+_service = "unknown"
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging(service: str):
+    """Routes all logging through the JSON queue; called once at the top of main.py."""
+    global _service, _listener
+    _service = service
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("httpx").setLevel(logging.WARNING) # One line per request is what the spans are for
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(name), {})
+
+_span_logger = logging.getLogger("trace")
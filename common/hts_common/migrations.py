@@ -0,0 +1,128 @@
+"""
+Versioned schema migrations: the runner and helpers every service with a
+database uses. The MIGRATIONS list is the service's own, in its
+app/migrations.py, which also imports its app.models so that the tables the
+migrations refer to are registered.
+
+Applied versions are recorded in schema_migrations, so starting against an
+up-to-date database costs one query instead of create_all's table and index
+checks. Append new migrations, never edit applied ones; `python migrate.py`
+applies them ahead of a release, and every process also does so at startup.
+
+Version 1 is the schema create_all used to build, from the current models. On
+a database created before migrations existed it adds the missing tables and
+the indexes whose columns exist, but no columns: every column added to an
+existing table has its own migration, which must check for it first
+(has_column, add_columns) as a new database already has it.
+
+On Postgres the runner holds an advisory lock, so workers and replicas starting
+together apply each migration once.
+"""
+import time
+from datetime import datetime
+from typing import Callable, Iterable, List, NamedTuple
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, literal, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import SQLModel
+from hts_common.instrumentation import get_logger
+
+# Arbitrary, shared by every process migrating this database
+MIGRATION_LOCK_KEY = 7268340911
+
+logger = get_logger("migrations")
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable # (connection) -> None, inside the migration transaction
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+def has_column(connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(connection).get_columns(table))
+
+def create_indexes(connection, table: Table):
+    """Creates the model indexes of `table` that are missing, once all their columns exist."""
+    columns = {c["name"] for c in inspect(connection).get_columns(table.name)}
+    for index in table.indexes:
+        if all(column.name in columns for column in index.columns):
+            index.create(connection, checkfirst=True)
+
+def add_columns(connection, table_name: str, names: Iterable[str]):
+    """
+    Adds the model columns `names` that `table_name` lacks, then the indexes
+    they complete. Existing rows get the column's default, or NULL without one.
+    """
+    table = SQLModel.metadata.tables[table_name]
+    dialect = connection.dialect
+    existing = {c["name"] for c in inspect(connection).get_columns(table_name)}
+    for name in names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        ddl = f"ALTER TABLE {table_name} ADD COLUMN {name} {column.type.compile(dialect=dialect)}"
+        if column.default is not None and column.default.is_scalar:
+            default = literal(column.default.arg, column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+            if isinstance(column.default.arg, bytes) and dialect.name == "sqlite":
+                default = f"X'{column.default.arg.hex()}'" # '' would read back as text
+            ddl += f" DEFAULT {default}" if column.nullable else f" NOT NULL DEFAULT {default}"
+        connection.execute(text(ddl))
+    create_indexes(connection, table)
+
+def create_models(connection):
+    SQLModel.metadata.create_all(connection)
+    # create_all skips tables that already exist, so add indexes introduced later.
+    # Those on columns a later migration adds are created by that migration.
+    for table in SQLModel.metadata.sorted_tables:
+        create_indexes(connection, table)
+
+def applied_versions(connection) -> set:
+    if not inspect(connection).has_table("schema_migrations"):
+        return set()
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+def pending_migrations(engine, migrations: List[Migration]) -> List[Migration]:
+    with engine.connect() as connection:
+        applied = applied_versions(connection)
+    return [m for m in migrations if m.version not in applied]
+
+def _apply(engine, migration: Migration) -> bool:
+    """False if another process applied `migration` first."""
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        schema_migrations.create(connection, checkfirst=True)
+        # Re-read under the lock: another process may have got here first
+        if migration.version in applied_versions(connection):
+            return False
+        migration.apply(connection)
+        connection.execute(schema_migrations.insert().values(
+            version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+        ))
+    return True
+
+def migrate(engine, migrations: List[Migration]) -> int:
+    """Applies pending `migrations`, each in its own transaction. Returns how many."""
+    if not pending_migrations(engine, migrations):
+        return 0
+    count = 0
+    for migration in migrations:
+        for attempt in range(3):
+            try:
+                applied = _apply(engine, migration)
+                break
+            except DBAPIError:
+                # SQLite has no advisory lock, so a process migrating at the same
+                # time can make this fail; the next attempt sees what it did
+                if engine.dialect.name == "postgresql" or attempt == 2:
+                    raise
+                time.sleep(0.1 * (attempt + 1))
+        if applied:
+            count += 1
+            logger.info("Applied migration", version=migration.version, name=migration.name)
+    return count
@@ -0,0 +1,64 @@
+"""
+Waiting for Postgres and RabbitMQ at startup, for every service that needs them.
+
+Attempts back off exponentially with full jitter (a random delay up to
+STARTUP_BACKOFF_BASE * 2**attempt, capped at STARTUP_BACKOFF_MAX), so a process
+starts as soon as its dependency does, and replicas restarting together do not
+retry in lockstep. Waits forever unless STARTUP_TIMEOUT is set: a process that
+exits instead only comes back through its supervisor's restart delay.
+"""
+import os
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable, Iterator, TypeVar
+from hts_common.instrumentation import get_logger
+
+STARTUP_BACKOFF_BASE = float(os.getenv("STARTUP_BACKOFF_BASE", "0.1"))
+STARTUP_BACKOFF_MAX = float(os.getenv("STARTUP_BACKOFF_MAX", "10"))
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", "0")) # seconds, 0 = forever
+
+T = TypeVar("T")
+
+logger = get_logger("readiness")
+
+def _delays(dependency: str) -> Iterator[float]:
+    """Yields the next delay, or raises once STARTUP_TIMEOUT has passed."""
+    deadline = time.monotonic() + STARTUP_TIMEOUT if STARTUP_TIMEOUT > 0 else None
+    attempt = 0
+    while deadline is None or time.monotonic() < deadline:
+        yield random.uniform(0, min(STARTUP_BACKOFF_MAX, STARTUP_BACKOFF_BASE * 2 ** attempt))
+        attempt += 1
+    raise TimeoutError(f"{dependency} not ready after {STARTUP_TIMEOUT}s")
+
+def _waiting(dependency: str, delay: float, error: Exception):
+    logger.warning("Waiting for dependency", dependency=dependency, retry_in=round(delay, 2), error=str(error))
+
+def wait_for_database(engine):
+    """Blocks until `engine` accepts connections."""
+    from sqlalchemy import text
+    for delay in _delays("database"):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            return
+        except Exception as e:
+            _waiting("database", delay, e)
+            time.sleep(delay)
+
+async def wait_for(dependency: str, attempt: Callable[[], Awaitable[T]]) -> T:
+    """Result of the first `attempt()` that does not raise."""
+    for delay in _delays(dependency):
+        try:
+            return await attempt()
+        except Exception as e:
+            _waiting(dependency, delay, e)
+            await asyncio.sleep(delay)
+
+async def connect_broker(url: str):
+    """
+    Robust aio_pika connection: after the first connect succeeds it reconnects
+    by itself and restores channels, queues and consumers.
+    """
+    from aio_pika import connect_robust
+    return await wait_for("rabbitmq", lambda: connect_robust(url))
@@ -0,0 +1,117 @@
+"""
+Read-replica routing for the read-only endpoints of every service that has them.
+
+DATABASE_REPLICA_URLS (comma-separated) lists streaming replicas of the primary;
+without it every session uses the primary. Read sessions go round-robin to the
+replicas whose replication lag, polled every REPLICA_CHECK_INTERVAL seconds in
+a background thread, is at most REPLICA_MAX_LAG seconds. A replica that lags
+more or cannot be reached is skipped until a later check finds it current;
+with none left, reads go to the primary.
+
+Read-your-writes: with READ_YOUR_WRITES_SECONDS > 0, a user who wrote through
+this process is read from the primary for that many seconds (mark_write).
+Pins live in process memory, so behind several workers they only cover reads
+that land on the same one. Writes and consumers always use the primary.
+"""
+import os
+import time
+import threading
+import itertools
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+from sqlmodel import Session
+from hts_common.instrumentation import Counter, Gauge, get_logger, instrument_engine
+
+DATABASE_REPLICA_URLS = os.getenv("DATABASE_REPLICA_URLS", "")
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "2"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "0"))
+
+# Seconds since the last replayed transaction, or 0 when everything received is replayed
+# (an idle primary writes nothing, which must not count as lag)
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+DB_READ_ROUTES = Counter("db_read_sessions_total", "Read sessions by target and reason", ("target", "reason"))
+DB_REPLICA_LAG = Gauge("db_replica_lag_seconds", "Replication lag of each replica (-1: unreachable)", ("replica",))
+
+logger = get_logger("replicas")
+
+class Replica:
+    def __init__(self, url: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = create_engine(url, pool_pre_ping=True)
+        instrument_engine(self.engine)
+        self.lag: Optional[float] = None # None until checked, or while unreachable
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                if connection.dialect.name == "postgresql":
+                    self.lag = float(connection.execute(LAG_QUERY).scalar() or 0)
+                else:
+                    connection.execute(text("SELECT 1"))
+                    self.lag = 0.0
+        except Exception as e:
+            if self.lag is not None:
+                logger.warning("Replica unreachable", replica=self.name, error=str(e))
+            self.lag = None
+        DB_REPLICA_LAG.set(-1 if self.lag is None else self.lag, replica=self.name)
+
+class ReadRouter:
+    def __init__(self, primary: Engine, replica_urls: str = DATABASE_REPLICA_URLS):
+        self.primary = primary
+        self.replicas: List[Replica] = [Replica(url.strip()) for url in replica_urls.split(",") if url.strip()]
+        self.pins: Dict[str, float] = {} # username -> monotonic time the pin ends
+        self.turn = itertools.count()
+        self.lock = threading.Lock()
+        self.checker: Optional[threading.Thread] = None
+
+    def _check_forever(self):
+        while True:
+            for replica in self.replicas:
+                replica.check()
+            time.sleep(REPLICA_CHECK_INTERVAL)
+
+    def _start_checker(self):
+        with self.lock:
+            if self.checker is None:
+                self.checker = threading.Thread(target=self._check_forever, name="replica-lag", daemon=True)
+                self.checker.start()
+
+    def pin(self, username: Optional[str], seconds: float):
+        """Reads of `username` go to the primary for `seconds`."""
+        if not username or not self.replicas or seconds <= 0:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if len(self.pins) > 10000:
+                self.pins = {user: until for user, until in self.pins.items() if until > now}
+            self.pins[username] = max(self.pins.get(username, 0), now + seconds)
+
+    def mark_write(self, username: Optional[str]):
+        """Call after committing a user's write (read-your-writes)."""
+        self.pin(username, READ_YOUR_WRITES_SECONDS)
+
+    def pick(self, username: Optional[str] = None) -> Tuple[Engine, str]:
+        """(engine, reason) for a read of `username`'s data."""
+        if not self.replicas:
+            return self.primary, "no_replicas"
+        if self.checker is None:
+            self._start_checker()
+        if username and self.pins.get(username, 0) > time.monotonic():
+            return self.primary, "pinned"
+        current = [r for r in self.replicas if r.lag is not None and r.lag <= REPLICA_MAX_LAG]
+        if not current:
+            return self.primary, "no_current_replica"
+        return current[next(self.turn) % len(current)].engine, "replica"
+
+    def session(self, username: Optional[str] = None) -> Session:
+        engine, reason = self.pick(username)
+        DB_READ_ROUTES.inc(target="primary" if engine is self.primary else "replica", reason=reason)
+        return Session(engine)
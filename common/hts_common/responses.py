@@ -0,0 +1,23 @@
+from typing import List
+import orjson
+from fastapi import Response
+from sqlmodel import Session, SQLModel
+
+def _default(obj):
+    if isinstance(obj, SQLModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(data) -> bytes:
+    return orjson.dumps(data, default=_default)
+
+def json_response(data, status_code: int = 200) -> Response:
+    """
+    Serializes with orjson and skips response_model validation and jsonable_encoder.
+    Only use it for data that already has the documented shape.
+    """
+    return Response(content=dumps(data), status_code=status_code, media_type="application/json")
+
+def fetch_rows(session: Session, statement) -> List[dict]:
+    """Runs `statement` without building ORM objects; rows come back as plain dicts."""
+    return [dict(row) for row in session.connection().execute(statement).mappings()]
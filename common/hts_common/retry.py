@@ -0,0 +1,177 @@
+"""
+Retry and dead-letter topology of a consumer queue, for every service that
+consumes health_events.
+
+For a queue Q:
+
+    Q.retry.<delay>ms  one delay queue per attempt; messages wait there for
+                       RETRY_BASE_DELAY * 2**attempt seconds (x-message-ttl),
+                       then the broker dead-letters them back onto Q
+    Q.dlq              messages that failed RETRY_MAX_ATTEMPTS retries, or can
+                       never succeed (PermanentError); moved back onto Q with
+                       replay_dead_letters.py
+
+A failed message is republished to the next delay queue with its retry count in
+the x-retry-count header and then acked, so it never holds up Q and a poison
+message costs at most RETRY_MAX_ATTEMPTS + 1 runs. Retries and replays go
+through the default exchange, so the routing key the event was published with
+travels in x-original-routing-key; handlers read it with routing_key_of.
+
+A retry runs the handler again from the start: raise only for failures that
+happen before the handler commits anything.
+"""
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+from hts_common.instrumentation import Counter, Gauge, consume_span, get_logger
+
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "2")) # seconds, doubled every attempt
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+QUEUE_DEPTH_INTERVAL = float(os.getenv("QUEUE_DEPTH_INTERVAL", "15"))
+
+RETRY_COUNT = "x-retry-count"
+ORIGINAL_ROUTING_KEY = "x-original-routing-key"
+LAST_ERROR = "x-last-error"
+
+AMQP_RETRIES = Counter("amqp_retries_total", "Messages scheduled for another attempt", ("queue",))
+AMQP_DEAD_LETTERS = Counter("amqp_dead_letters_total", "Messages moved to the dead-letter queue", ("queue", "reason"))
+AMQP_QUEUE_DEPTH = Gauge("amqp_queue_depth", "Messages ready in a queue", ("queue",))
+
+logger = get_logger("retry")
+
+class PermanentError(Exception):
+    """The message can never be processed: dead-lettered without retries."""
+
+def retry_delay(attempt: int) -> float:
+    return RETRY_BASE_DELAY * 2 ** attempt
+
+def retry_queue(queue_name: str, attempt: int) -> str:
+    # The delay is part of the name: queue arguments cannot change once declared
+    return f"{queue_name}.retry.{int(retry_delay(attempt) * 1000)}ms"
+
+def dead_letter_queue(queue_name: str) -> str:
+    return f"{queue_name}.dlq"
+
+def topology_queues(queue_name: str) -> List[str]:
+    """Q, its delay queues and its dead-letter queue."""
+    return [queue_name] + [retry_queue(queue_name, n) for n in range(RETRY_MAX_ATTEMPTS)] + [dead_letter_queue(queue_name)]
+
+def routing_key_of(message) -> str:
+    key = (message.headers or {}).get(ORIGINAL_ROUTING_KEY)
+    if isinstance(key, bytes):
+        key = key.decode()
+    return key or message.routing_key or ""
+
+def retry_count(message) -> int:
+    count = (message.headers or {}).get(RETRY_COUNT)
+    return count if isinstance(count, int) else 0
+
+async def declare_retry_topology(channel, queue_name: str):
+    """Declares the delay queues and the dead-letter queue of `queue_name`."""
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        await channel.declare_queue(retry_queue(queue_name, attempt), durable=True, arguments={
+            "x-message-ttl": int(retry_delay(attempt) * 1000),
+            "x-dead-letter-exchange": "", # default exchange: routes by queue name
+            "x-dead-letter-routing-key": queue_name,
+        })
+    await channel.declare_queue(dead_letter_queue(queue_name), durable=True)
+
+async def _republish(channel, message, target: str, headers: dict):
+    from aio_pika import Message, DeliveryMode
+    await channel.default_exchange.publish(
+        Message(
+            message.body,
+            headers=headers,
+            content_type=message.content_type,
+            message_id=message.message_id,
+            timestamp=message.timestamp,
+            type=message.type,
+            delivery_mode=DeliveryMode.PERSISTENT,
+        ),
+        routing_key=target
+    )
+
+async def _fail(channel, queue_name: str, message, error: BaseException, permanent: bool):
+    attempt = retry_count(message)
+    headers = dict(message.headers or {})
+    headers[ORIGINAL_ROUTING_KEY] = routing_key_of(message)
+    headers[LAST_ERROR] = f"{type(error).__name__}: {error}"[:500]
+    context = dict(queue=queue_name, routing_key=headers[ORIGINAL_ROUTING_KEY], message_id=message.message_id, attempt=attempt, error=headers[LAST_ERROR])
+
+    if permanent or attempt >= RETRY_MAX_ATTEMPTS:
+        reason = "permanent" if permanent else "exhausted"
+        await _republish(channel, message, dead_letter_queue(queue_name), headers)
+        AMQP_DEAD_LETTERS.inc(queue=queue_name, reason=reason)
+        logger.error("Dead-lettered message", reason=reason, **context)
+        return
+
+    headers[RETRY_COUNT] = attempt + 1
+    # Queue lag then counts from when the message is due back, not the first publish
+    headers["x-published-at"] = time.time() + retry_delay(attempt)
+    await _republish(channel, message, retry_queue(queue_name, attempt), headers)
+    AMQP_RETRIES.inc(queue=queue_name)
+    logger.warning("Retrying message", delay=retry_delay(attempt), **context)
+
+def with_retries(channel, queue_name: str, handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """
+    Consumer callback running `handler(message)`. Failures are moved to a delay
+    queue or the dead-letter queue and the delivery acked; only if that publish
+    fails is the delivery requeued.
+    """
+    async def on_message(message):
+        async with message.process(requeue=True):
+            try:
+                with consume_span(message, routing_key_of(message)):
+                    await handler(message)
+            except PermanentError as e:
+                await _fail(channel, queue_name, message, e, permanent=True)
+            except Exception as e:
+                await _fail(channel, queue_name, message, e, permanent=False)
+    return on_message
+
+async def monitor_queue_depths(connection, queue_names: List[str], interval: float = QUEUE_DEPTH_INTERVAL):
+    """Keeps AMQP_QUEUE_DEPTH current; run as a background task."""
+    # Own channel: a failed passive declare closes the channel it ran on
+    channel = await connection.channel()
+    while True:
+        for name in queue_names:
+            try:
+                declared = await channel.declare_queue(name, passive=True)
+                AMQP_QUEUE_DEPTH.set(declared.declaration_result.message_count, queue=name)
+            except Exception as e:
+                logger.warning("Queue depth unavailable", queue=name, error=str(e))
+                if channel.is_closed:
+                    channel = await connection.channel()
+        await asyncio.sleep(interval)
+
+async def replay_dead_letters(channel, queue_name: str, limit: Optional[int] = None, dry_run: bool = False) -> int:
+    """
+    Moves up to `limit` messages from the dead-letter queue back onto
+    `queue_name` with a fresh retry count. dry_run logs them and leaves them in
+    place. Returns how many messages were seen.
+    """
+    dlq = await channel.declare_queue(dead_letter_queue(queue_name), durable=True)
+    held = [] # dry run: unacked until the end, so get() moves on to the next one
+    count = 0
+    while limit is None or count < limit:
+        message = await dlq.get(no_ack=False, fail=False)
+        if message is None:
+            break
+        count += 1
+        headers = dict(message.headers or {})
+        logger.info(
+            "Dead letter", queue=queue_name, message_id=message.message_id, routing_key=routing_key_of(message),
+            retries=retry_count(message), error=headers.get(LAST_ERROR), replayed=not dry_run
+        )
+        if dry_run:
+            held.append(message)
+            continue
+        headers[ORIGINAL_ROUTING_KEY] = routing_key_of(message)
+        headers[RETRY_COUNT] = 0
+        headers["x-published-at"] = time.time()
+        await _republish(channel, message, queue_name, headers)
+        await message.ack()
+    for message in held:
+        await message.nack(requeue=True)
+    return count
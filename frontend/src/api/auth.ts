@@ -15,6 +15,7 @@ export async function registerUser(payload: RegisterPayload) {
 export type LoginResponse = {
   access_token: string;
   token_type: string;
+  refresh_token?: string;
 };
 
 export async function loginUser(username: string, password: string) {
@@ -36,3 +37,10 @@ export async function loginUser(username: string, password: string) {
   }
   return data as LoginResponse;
 }
+
+export async function refreshSession(refreshToken: string) {
+  return request<LoginResponse>("/auth/refresh", {
+    method: "POST",
+    body: JSON.stringify({ refresh_token: refreshToken }),
+  });
+}
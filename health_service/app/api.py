@@ -1,17 +1,25 @@
-import os
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import Optional, Set, Tuple, Union
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
 from app.models import HealthRecord, HealthRecordCreate, HealthRecordUpdate
-from app.database import get_session
-from app.events import publish_event
-from jose import JWTError, jwt
+from app.database import engine, reads
+from app.archive import find_record, naive_utc, with_archived
+from app.records import delete_record, etag, parse_if_match, update_record, write_failure
+from app import idempotency
+from app.events import publish_event, record_image
+from app.security import decode_access_token
+from app.timeseries import STORAGE_MODE, append_record, read_records
+from hts_common.responses import json_response, fetch_rows
+from hts_common.instrumentation import get_logger
+from jose import JWTError
 
 router = APIRouter()
 
-# Configuration (should match Auth Service)
-SECRET_KEY = os.getenv("SECRET_KEY", "secret")
-ALGORITHM = "HS256"
+logger = get_logger("health.api")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login") # This URL likely needs to be full path or relative to gateway if used in Swagger from here, but mostly for Depends
 
@@ -22,7 +30,7 @@ async def get_current_username(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -30,143 +38,183 @@ async def get_current_username(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     return username
 
+def get_read_session(username: str = Depends(get_current_username)):
+    # A replica, unless lagging or this user just wrote (hts_common/replicas.py)
+    with reads.session(username) as session:
+        yield session
+
+def store_record(
+    username: str, record_create: HealthRecordCreate, idempotency_key: Optional[str]
+) -> Union[Tuple[HealthRecord, Optional[idempotency.StoredResponse]], Response]:
+    """
+    The database part of POST /data, run in the threadpool: the new record and,
+    with an Idempotency-Key, the response stored for it; or the stored response
+    of a key already used (app/idempotency.py). The session is closed on
+    return, before the event is published.
+    """
+    with Session(engine, expire_on_commit=False) as session:
+        claim = None
+        if idempotency_key is not None:
+            claim = idempotency.check(session, username, idempotency_key, record_create.dict())
+            if isinstance(claim, Response):
+                return claim
+
+        record = HealthRecord(**record_create.dict(), username=username)
+
+        if STORAGE_MODE == "compact":
+            append_record(session, record)
+        else:
+            session.add(record)
+            session.flush() # Assigns the id the stored response needs
+        try:
+            stored = None
+            if claim:
+                stored = idempotency.record_response(session, claim, record, headers={"ETag": etag(record.version)})
+            session.commit()
+        except IntegrityError: # A concurrent retry claimed the key first
+            replayed = idempotency.concurrent_response(session, claim) if claim else None
+            if replayed is None:
+                raise
+            return replayed
+        if stored:
+            idempotency.committed(claim, stored)
+        if STORAGE_MODE != "compact":
+            session.refresh(record)
+        return record, stored
+
 # Create
 @router.post("/data", response_model=HealthRecord)
 async def create_health_record(
     record_create: HealthRecordCreate, 
-    session: Session = Depends(get_session),
+    response: Response,
+    idempotency_key: Optional[str] = Header(default=None),
     username: str = Depends(get_current_username)
 ):
-    record = HealthRecord(**record_create.dict(), username=username)
-    
-    session.add(record)
-    session.commit()
-    session.refresh(record)
+    # Blocking session work stays off the event loop, which keeps serving other requests
+    result = await run_in_threadpool(store_record, username, record_create, idempotency_key)
+    if isinstance(result, Response):
+        return result
+    record, stored = result
+    reads.mark_write(username)
     
-    event_data = {
-        "record_id": record.id,
-        "username": record.username,
-        "steps": record.steps,
-        "weight": record.weight,
-        "sleep_hours": record.sleep_hours,
-        "heart_rate": record.heart_rate,
-        "blood_pressure": record.blood_pressure,
-        "blood_sugar": record.blood_sugar,
-        "body_temperature": record.body_temperature,
-        "timestamp": record.timestamp.isoformat()
-    }
     try:
-        await publish_event("created", event_data)
+        await publish_event("created", record.username, record_image(record, skip_empty=True), record_id=record.id, version=record.version)
     except Exception as e:
-        print(f"Failed to publish event: {e}")
+        logger.error("Failed to publish event", event_type="created", error=str(e))
 
+    if stored:
+        return idempotency.respond(stored) # The very bytes and headers a retry will get
+    response.headers["ETag"] = etag(record.version)
     return record
 
 # List
 @router.get("/data", response_model=list[HealthRecord])
 def get_health_records(
-    session: Session = Depends(get_session),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    session: Session = Depends(get_read_session),
     username: str = Depends(get_current_username)
 ):
+    start, end = naive_utc(start), naive_utc(end) # ?start=...Z is aware; stored timestamps are not
+    # Lists can hold thousands of rows: serialize plain rows with orjson instead of
+    # validating and encoding every HealthRecord
+    if STORAGE_MODE == "compact":
+        return json_response(read_records(session, username, start, end))
+
     statement = select(HealthRecord).where(HealthRecord.username == username)
-    results = session.exec(statement)
-    return results.all()
+    if start:
+        statement = statement.where(HealthRecord.timestamp >= start)
+    if end:
+        statement = statement.where(HealthRecord.timestamp <= end)
+    # Months moved to the Parquet archive answer like live ones (app/archive.py)
+    return json_response(with_archived(fetch_rows(session, statement), username, start, end))
 
 # Read (Single)
 @router.get("/data/{record_id}", response_model=HealthRecord)
 def get_health_record(
     record_id: int, 
-    session: Session = Depends(get_session),
+    response: Response,
+    session: Session = Depends(get_read_session),
     username: str = Depends(get_current_username)
 ):
     record = session.get(HealthRecord, record_id)
+    if not record:
+        archived = find_record(record_id)
+        record = HealthRecord(**archived) if archived else None
     if not record:
         raise HTTPException(status_code=404, detail="Health record not found")
     if record.username != username:
          raise HTTPException(status_code=403, detail="Not authorized to access this record")
+    # Sent back in If-Match, so a PATCH or DELETE cannot overwrite a change made since
+    response.headers["ETag"] = etag(record.version)
     return record
 
 # Update
+def apply_update(record_id: int, username: str, values: dict, versions: Optional[Set[int]]) -> Tuple[dict, dict]:
+    """The database part of PATCH /data/{id}, run in the threadpool: (before, after) rows."""
+    with Session(engine) as session:
+        # One UPDATE ... RETURNING gives both the old and the new row (app/records.py)
+        images = update_record(session, record_id, username, values, versions)
+        if images is None:
+            status_code, detail = write_failure(session, record_id, username)
+            raise HTTPException(status_code=status_code, detail=detail)
+        session.commit()
+        return images
+
 @router.patch("/data/{record_id}", response_model=HealthRecord)
 async def update_health_record(
     record_id: int, 
     update_data: HealthRecordUpdate, 
-    session: Session = Depends(get_session),
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
     username: str = Depends(get_current_username)
 ):
-    record = session.get(HealthRecord, record_id)
-    if not record:
-        raise HTTPException(status_code=404, detail="Health record not found")
-    if record.username != username:
-         raise HTTPException(status_code=403, detail="Not authorized to access this record")
-    
-    # Capture old state for analytics
-    old_data = {
-        "steps": record.steps,
-        "sleep_hours": record.sleep_hours,
-        "weight": record.weight,
-        "heart_rate": record.heart_rate,
-        # ... capture other relevant metrics for diffing
-    }
-
-    # Update fields
     update_dict = update_data.dict(exclude_unset=True)
-    for key, value in update_dict.items():
-        setattr(record, key, value)
-    
-    session.add(record)
-    session.commit()
-    session.refresh(record)
+    before, after = await run_in_threadpool(apply_update, record_id, username, update_dict, parse_if_match(if_match))
+    reads.mark_write(username)
+    response.headers["ETag"] = etag(after["version"])
 
     # Publish updated event with context
     event_data = {
-        "record_id": record.id,
-        "username": record.username,
         "updated_fields": update_dict,
-        "old_data": old_data, # NEW: Send old data to calculate delta
-        "timestamp": record.timestamp.isoformat()
+        "old_data": record_image(before), # Old values, so consumers can compute deltas
+        "new_data": record_image(after),
+        "timestamp": after["timestamp"]
     }
     try:
-        await publish_event("updated", event_data)
+        await publish_event("updated", username, event_data, record_id=record_id, version=after["version"])
     except Exception as e:
-        print(f"Failed to publish event: {e}")
+        logger.error("Failed to publish event", event_type="updated", error=str(e))
 
-    return record
+    return after
+
+def apply_delete(record_id: int, username: str, versions: Optional[Set[int]]) -> dict:
+    """The database part of DELETE /data/{id}, run in the threadpool: the deleted row."""
+    with Session(engine) as session:
+        record = delete_record(session, record_id, username, versions)
+        if record is None:
+            status_code, detail = write_failure(session, record_id, username)
+            raise HTTPException(status_code=status_code, detail=detail)
+        session.commit()
+        return record
 
 # Delete
 @router.delete("/data/{record_id}")
 async def delete_health_record(
     record_id: int, 
-    session: Session = Depends(get_session),
+    if_match: Optional[str] = Header(default=None),
     username: str = Depends(get_current_username)
 ):
-    record = session.get(HealthRecord, record_id)
-    if not record:
-        raise HTTPException(status_code=404, detail="Health record not found")
-    if record.username != username:
-         raise HTTPException(status_code=403, detail="Not authorized to access this record")
-    
-    # Capture record data before deletion
-    record_data = {
-        "steps": record.steps,
-        "sleep_hours": record.sleep_hours,
-        "weight": record.weight,
-        "heart_rate": record.heart_rate,
-        "timestamp": record.timestamp.isoformat()
-    }
-
-    session.delete(record)
-    session.commit()
+    record = await run_in_threadpool(apply_delete, record_id, username, parse_if_match(if_match))
+    reads.mark_write(username)
 
     # Publish deleted event with data
     event_data = {
-        "record_id": record_id,
-        "username": username,
-        "deleted_record": record_data # NEW: Send deleted payload
+        "deleted_record": record_image(record) # Deleted values, so consumers can subtract them
     }
     try:
-        await publish_event("deleted", event_data)
+        await publish_event("deleted", username, event_data, record_id=record_id, version=record["version"])
     except Exception as e:
-        print(f"Failed to publish event: {e}")
+        logger.error("Failed to publish event", event_type="deleted", error=str(e))
 
     return {"message": "Record deleted successfully"}
@@ -0,0 +1,149 @@
+"""
+Parquet archive of old healthrecord months, written by the partition
+maintenance (app/partitions.py) and read by the /data endpoints, so archived
+ranges answer like live ones.
+
+One zstd-compressed file per month in HEALTH_ARCHIVE_DIR
+(healthrecord_YYYY_MM.parquet), rows sorted by (username, timestamp): the
+row-group statistics then let a read for one user skip most of a file.
+Archived records are read-only; PATCH and DELETE no longer find them.
+
+Needs pyarrow. Without it nothing is archived and reads see Postgres only.
+"""
+import os
+import re
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Archival disabled
+    pa = pq = None
+
+HEALTH_ARCHIVE_DIR = os.getenv("HEALTH_ARCHIVE_DIR", "archive")
+ROW_GROUP_ROWS = 16384
+
+FILE_PATTERN = re.compile(r"^healthrecord_(\d{4})_(\d{2})\.parquet$")
+
+# HealthRecord columns, in table order
+COLUMNS = (
+    ("id", "int64"), ("username", "string"), ("steps", "int64"), ("sleep_hours", "float64"),
+    ("weight", "float64"), ("heart_rate", "int64"), ("blood_pressure", "string"),
+    ("systolic", "int64"), ("diastolic", "int64"), ("blood_sugar", "float64"),
+    ("body_temperature", "float64"), ("timestamp", "timestamp"), ("version", "int64"),
+)
+
+def _schema():
+    types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(), "timestamp": pa.timestamp("us")}
+    return pa.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+def enabled() -> bool:
+    return pq is not None
+
+def archive_path(month: datetime) -> str:
+    return os.path.join(HEALTH_ARCHIVE_DIR, f"healthrecord_{month.year:04d}_{month.month:02d}.parquet")
+
+def archived_months() -> List[datetime]:
+    if not enabled() or not os.path.isdir(HEALTH_ARCHIVE_DIR):
+        return []
+    months = []
+    for name in os.listdir(HEALTH_ARCHIVE_DIR):
+        match = FILE_PATTERN.match(name)
+        if match:
+            months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+def _rows(data) -> List[dict]:
+    rows = data.to_pylist()
+    for row in rows:
+        # Files written before records had a version
+        if row.get("version") is None:
+            row["version"] = 1
+    return rows
+
+def read_month(month: datetime) -> Iterator[List[dict]]:
+    """Batches of the rows archived for `month`."""
+    path = archive_path(month)
+    if os.path.exists(path):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=ROW_GROUP_ROWS):
+            yield _rows(batch)
+
+def write_month(month: datetime, batches: Iterable[List[dict]]) -> int:
+    """Writes (replaces) the archive of `month` from row batches. Returns the row count."""
+    os.makedirs(HEALTH_ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(month)
+    tmp = path + ".tmp"
+    schema = _schema()
+    count = 0
+    writer = pq.ParquetWriter(tmp, schema, compression="zstd")
+    try:
+        for batch in batches:
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema), row_group_size=ROW_GROUP_ROWS)
+                count += len(batch)
+    finally:
+        writer.close()
+    os.replace(tmp, path) # Readers never see a partial file
+    return count
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC; an aware query bound is converted to that."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.replace(tzinfo=None) - value.utcoffset()
+
+def _month_end(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def read_records(username: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    """Archived rows of `username` within [start, end], shaped like fetch_rows' dicts."""
+    start, end = naive_utc(start), naive_utc(end)
+    rows = []
+    for month in archived_months():
+        if (start and _month_end(month) <= start) or (end and month > end):
+            continue
+        filters = [("username", "=", username)]
+        if start:
+            filters.append(("timestamp", ">=", start))
+        if end:
+            filters.append(("timestamp", "<=", end))
+        rows.extend(_rows(pq.read_table(archive_path(month), filters=filters)))
+    return rows
+
+def with_archived(rows: List[dict], username: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    """`rows` from Postgres plus the archived ones in the same range."""
+    archived = read_records(username, start, end)
+    if not archived:
+        return rows
+    # A month being archived is briefly in both places
+    live_ids = {row["id"] for row in rows}
+    return [row for row in archived if row["id"] not in live_ids] + rows
+
+_id_ranges: Dict[str, tuple] = {} # path -> (mtime, [(min_id, max_id) per row group])
+
+def _row_group_id_ranges(path: str) -> list:
+    mtime = os.path.getmtime(path)
+    cached = _id_ranges.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    metadata = pq.ParquetFile(path).metadata
+    column = [metadata.schema.column(i).name for i in range(metadata.num_columns)].index("id")
+    ranges = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(column).statistics
+        ranges.append((stats.min, stats.max) if stats is not None and stats.has_min_max else (None, None))
+    _id_ranges[path] = (mtime, ranges)
+    return ranges
+
+def find_record(record_id: int) -> Optional[dict]:
+    """An archived row by id; only files whose id statistics cover it are read."""
+    for month in archived_months():
+        path = archive_path(month)
+        ranges = _row_group_id_ranges(path)
+        if not any(low is None or low <= record_id <= high for low, high in ranges):
+            continue
+        rows = _rows(pq.read_table(path, filters=[("id", "=", record_id)]))
+        if rows:
+            return rows[0]
+    return None
@@ -1,10 +1,40 @@
 import os
-import json
-from aio_pika import connect, Message, DeliveryMode
+from typing import Optional
+from hts_common.envelope import event_message, new_event
+from hts_common.instrumentation import AMQP_PUBLISH_LATENCY, amqp_headers, get_logger
 
 RABBITMQ_URL = os.getenv("RABBITMQ_URL")
 
-async def publish_event(event_type: str, data: dict):
+# Everything a consumer may need to know about a reading
+RECORD_FIELDS = (
+    "steps", "sleep_hours", "weight", "heart_rate", "blood_pressure",
+    "systolic", "diastolic", "blood_sugar", "body_temperature", "timestamp",
+)
+
+logger = get_logger("health.events")
+
+async def connect(url: str):
+    from aio_pika import connect as amqp_connect # Loaded on the first publish, not at startup
+    return await amqp_connect(url)
+
+def record_image(record, skip_empty: bool = False) -> dict:
+    """Field values of `record` (a model or a row dict); skip_empty leaves out fields that are None."""
+    if isinstance(record, dict):
+        image = {field: record[field] for field in RECORD_FIELDS}
+    else:
+        image = {field: getattr(record, field) for field in RECORD_FIELDS}
+    if skip_empty:
+        return {field: value for field, value in image.items() if value is not None}
+    return image
+
+async def publish_event(event_type: str, username: str, data: dict, record_id: Optional[int] = None, version: Optional[int] = None):
+    routing_key = f"health.record.{event_type}"
+    event = new_event(routing_key, username, data, record_id=record_id, version=version)
+    with AMQP_PUBLISH_LATENCY.time(routing_key=routing_key):
+        await _publish(routing_key, event)
+    logger.info("Sent event", routing_key=routing_key, event_id=event.id, username=username, record_id=record_id)
+
+async def _publish(routing_key: str, event):
     connection = await connect(RABBITMQ_URL)
     async with connection:
         channel = await connection.channel()
@@ -13,12 +43,7 @@ async def publish_event(event_type: str, data: dict):
         # We declare it as a 'topic' exchange so consumers can subscribe to patterns
         exchange = await channel.declare_exchange("health_events", type="topic")
         
-        message_body = json.dumps(data).encode()
-        message = Message(
-            message_body,
-            delivery_mode=DeliveryMode.PERSISTENT
-        )
+        # Trace context in the headers, so consumers continue this request's trace
+        message = event_message(event, headers=amqp_headers())
         
-        routing_key = f"health.record.{event_type}"
         await exchange.publish(message, routing_key=routing_key)
-        print(f" [x] Sent {routing_key}:{data}")
@@ -0,0 +1,165 @@
+"""
+Idempotency-Key support for record ingestion.
+
+A client that sends the same Idempotency-Key again (a retry after a timeout or
+a dropped connection) gets the response of the first request replayed, with
+Idempotent-Replayed: true. No new record is written and no event published,
+so the analytics and notification consumers never see a duplicate.
+
+Keys are scoped by user and kept IDEMPOTENCY_TTL_HOURS in the idempotencykey
+table: a truncated hash of the key, a hash of the request body and the
+response with its headers (ETag), serialized once: the first request and
+every replay send the same bytes. The key row is inserted in the record's
+transaction, so two concurrent retries cannot both write: the loser's commit
+fails on the primary key and it replays the winner's response. Reusing a key with a different
+body is rejected (422). Recently used keys are also kept in process memory
+(IDEMPOTENCY_CACHE_SIZE), so a retry storm does not reach the database.
+"""
+import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional, Union
+from fastapi import HTTPException, Response
+from sqlalchemy import delete, select
+from sqlmodel import Session
+from app.models import IdempotencyKey
+from hts_common.responses import dumps
+from hts_common.instrumentation import Counter, get_logger
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENT_REPLAYS = Counter("idempotent_replays_total", "Requests answered from a stored Idempotency-Key response", ("source",))
+
+logger = get_logger("health.idempotency")
+
+class StoredResponse(NamedTuple):
+    request_hash: bytes
+    status_code: int
+    body: bytes
+    headers: Optional[dict]
+    expires_at: datetime
+
+class Claim(NamedTuple):
+    """An Idempotency-Key seen on a request that has not been answered yet."""
+    username: str
+    key_hash: bytes
+    request_hash: bytes
+    stale: bool # An expired row holds the key and must go first
+
+_cache: "OrderedDict[bytes, StoredResponse]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _digest(*parts: bytes) -> bytes:
+    return hashlib.sha256(b"\0".join(parts)).digest()[:16]
+
+def _cached(key_hash: bytes) -> Optional[StoredResponse]:
+    with _cache_lock:
+        stored = _cache.get(key_hash)
+        if stored is not None:
+            _cache.move_to_end(key_hash)
+    return stored
+
+def _remember(key_hash: bytes, stored: StoredResponse):
+    with _cache_lock:
+        _cache[key_hash] = stored
+        _cache.move_to_end(key_hash)
+        while len(_cache) > IDEMPOTENCY_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def _load(session: Session, key_hash: bytes) -> Optional[StoredResponse]:
+    row = session.connection().execute(
+        select(
+            IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response,
+            IdempotencyKey.headers, IdempotencyKey.expires_at
+        )
+        .where(IdempotencyKey.key_hash == key_hash)
+    ).first()
+    return StoredResponse(*row) if row is not None else None
+
+def respond(stored: StoredResponse, **extra_headers: str) -> Response:
+    """The stored response as sent; the first request answers with it too."""
+    return Response(
+        content=stored.body, status_code=stored.status_code, media_type="application/json",
+        headers={**(stored.headers or {}), **extra_headers}
+    )
+
+def replay(claim: Claim, stored: StoredResponse) -> Response:
+    if stored.request_hash != claim.request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    return respond(stored, **{"Idempotent-Replayed": "true"})
+
+def check(session: Session, username: str, key: str, payload: dict) -> Union[Claim, Response]:
+    """The stored response to replay for `key`, or a Claim to record the new response under."""
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+    key_hash = _digest(username.encode(), key.encode())
+    claim = Claim(username, key_hash, _digest(dumps(payload)), stale=False)
+    now = datetime.utcnow()
+
+    stored = _cached(key_hash)
+    source = "memory"
+    if stored is None or stored.expires_at <= now:
+        stored = _load(session, key_hash)
+        source = "database"
+    if stored is None:
+        return claim
+    if stored.expires_at <= now:
+        return claim._replace(stale=True)
+    _remember(key_hash, stored)
+    IDEMPOTENT_REPLAYS.inc(source=source)
+    logger.info("Replayed idempotent request", username=username, source=source)
+    return replay(claim, stored)
+
+def record_response(
+    session: Session, claim: Claim, body, status_code: int = 200, headers: Optional[Dict[str, str]] = None
+) -> StoredResponse:
+    """
+    Adds the response of `claim`'s request to the session; commit it with the
+    write, then answer with respond(stored).
+    """
+    stored = StoredResponse(
+        claim.request_hash, status_code, dumps(body), headers or {},
+        datetime.utcnow() + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    )
+    connection = session.connection()
+    if claim.stale:
+        connection.execute(delete(IdempotencyKey).where(IdempotencyKey.key_hash == claim.key_hash))
+    connection.execute(IdempotencyKey.__table__.insert().values(
+        key_hash=claim.key_hash, request_hash=stored.request_hash, status_code=status_code,
+        response=stored.body, headers=stored.headers, expires_at=stored.expires_at
+    ))
+    return stored
+
+def committed(claim: Claim, stored: StoredResponse):
+    _remember(claim.key_hash, stored)
+
+def concurrent_response(session: Session, claim: Claim) -> Optional[Response]:
+    """After a failed commit: the response of a concurrent request that claimed the same key."""
+    session.rollback()
+    stored = _load(session, claim.key_hash)
+    if stored is None:
+        return None
+    IDEMPOTENT_REPLAYS.inc(source="concurrent")
+    return replay(claim, stored)
+
+def purge_expired(engine) -> int:
+    with engine.begin() as connection:
+        result = connection.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow()))
+    return result.rowcount
+
+async def run_purge(engine):
+    """Deletes expired keys every IDEMPOTENCY_PURGE_INTERVAL seconds; run as a background task."""
+    while True:
+        try:
+            count = await asyncio.to_thread(purge_expired, engine)
+            if count:
+                logger.info("Purged idempotency keys", count=count)
+        except Exception as e:
+            logger.error("Idempotency key purge failed", error=str(e))
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
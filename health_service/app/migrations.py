@@ -0,0 +1,93 @@
+"""
+Schema migrations of this service, applied in order by the shared runner
+(hts_common.migrations, which documents the rules). Append new ones, never
+edit applied ones.
+"""
+from typing import Iterator, List, Tuple
+from sqlalchemy import bindparam, select, text
+import app.models # Registers the tables the migrations refer to
+from app.partitions import partition_healthrecord
+from hts_common.instrumentation import get_logger
+from hts_common import migrations as runner
+from hts_common.migrations import Migration, add_columns, create_models, has_column
+
+logger = get_logger("migrations")
+
+def add_healthrecord_version(connection):
+    if not has_column(connection, "healthrecord", "version"):
+        connection.execute(text("ALTER TABLE healthrecord ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+def create_idempotency_keys(connection):
+    from app.models import IdempotencyKey
+    IdempotencyKey.__table__.create(connection, checkfirst=True)
+
+def add_blood_pressure_columns(connection):
+    # After partitioning: ALTER TABLE on the partitioned table adds them to every partition
+    add_columns(connection, "healthrecord", ["systolic", "diastolic"])
+
+def blood_pressure_batches(connection, batch_size: int = 1000) -> Iterator[Tuple[int, int, List[int]]]:
+    """
+    Fills systolic/diastolic from the blood_pressure strings of rows that lack
+    them, one batch of ids at a time. Yields (last id, updated, unparseable ids)
+    per batch; commit between batches to keep transactions short.
+    """
+    from app.models import HealthRecord, parse_blood_pressure
+
+    table = HealthRecord.__table__
+    statement = table.update().where(table.c.id == bindparam("record_id")).values(
+        systolic=bindparam("new_systolic"), diastolic=bindparam("new_diastolic")
+    )
+    last_id = 0
+    while True:
+        # Keyset pagination on the primary key keeps every batch an index range scan
+        rows = connection.execute(
+            select(table.c.id, table.c.blood_pressure)
+            .where(table.c.id > last_id, table.c.blood_pressure != None, table.c.systolic == None)
+            .order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        values, skipped = [], []
+        for record_id, blood_pressure in rows:
+            try:
+                systolic, diastolic = parse_blood_pressure(blood_pressure)
+            except ValueError:
+                skipped.append(record_id)
+                continue
+            values.append({"record_id": record_id, "new_systolic": systolic, "new_diastolic": diastolic})
+        if values:
+            connection.execute(statement, values)
+        last_id = rows[-1][0]
+        yield last_id, len(values), skipped
+
+def backfill_blood_pressure(connection):
+    skipped = 0
+    for _, _, unparseable in blood_pressure_batches(connection):
+        skipped += len(unparseable)
+    if skipped:
+        logger.warning("Left unparseable blood_pressure values alone", count=skipped)
+
+def add_series_record_ids(connection):
+    add_columns(connection, "seriesuser", ["last_record_id"])
+    add_columns(connection, "serieschunk", ["ids", "last_id"])
+
+def add_idempotency_headers(connection):
+    add_columns(connection, "idempotencykey", ["headers"])
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", create_models),
+    Migration(2, "partition_healthrecord", partition_healthrecord),
+    Migration(3, "healthrecord_version", add_healthrecord_version),
+    Migration(4, "idempotency_keys", create_idempotency_keys),
+    Migration(5, "blood_pressure_columns", add_blood_pressure_columns),
+    Migration(6, "backfill_blood_pressure", backfill_blood_pressure),
+    Migration(7, "series_record_ids", add_series_record_ids),
+    Migration(8, "idempotency_headers", add_idempotency_headers),
+]
+
+def pending_migrations(engine) -> List[Migration]:
+    return runner.pending_migrations(engine, MIGRATIONS)
+
+def migrate(engine) -> int:
+    """Applies pending migrations, each in its own transaction. Returns how many."""
+    return runner.migrate(engine, MIGRATIONS)
@@ -1,8 +1,44 @@
+import re
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
+from pydantic import model_validator
+from sqlalchemy import JSON, Column, Index, UniqueConstraint
 from sqlmodel import Field, SQLModel
 
+BLOOD_PRESSURE_PATTERN = re.compile(r"^\s*(\d{2,3})\s*/\s*(\d{2,3})\s*(mmhg)?\s*$", re.IGNORECASE)
+
+def parse_blood_pressure(value: str) -> Tuple[int, int]:
+    """Parses "120/80" (optionally suffixed with mmHg) into (systolic, diastolic)."""
+    match = BLOOD_PRESSURE_PATTERN.match(value)
+    if not match:
+        raise ValueError("blood_pressure must look like '120/80'")
+    return int(match.group(1)), int(match.group(2))
+
+def normalize_blood_pressure(data):
+    """Keeps blood_pressure and systolic/diastolic consistent on incoming payloads."""
+    if not isinstance(data, dict):
+        return data
+    data = dict(data)
+    if "blood_pressure" in data and data["blood_pressure"] is None and "systolic" not in data:
+        data["systolic"] = data["diastolic"] = None # Clearing the reading clears both parts
+    elif data.get("blood_pressure"):
+        systolic, diastolic = parse_blood_pressure(data["blood_pressure"])
+        data["systolic"], data["diastolic"] = systolic, diastolic
+    systolic, diastolic = data.get("systolic"), data.get("diastolic")
+    if (systolic is None) != (diastolic is None):
+        raise ValueError("systolic and diastolic must be provided together")
+    if systolic is not None:
+        if not (50 <= systolic <= 300 and 30 <= diastolic <= 200 and systolic > diastolic):
+            raise ValueError("blood pressure values out of range")
+        data["blood_pressure"] = f"{systolic}/{diastolic}"
+    return data
+
 class HealthRecord(SQLModel, table=True):
+    __table_args__ = (
+        # Every read is per user, usually over a time range
+        Index("ix_healthrecord_username_timestamp", "username", "timestamp"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str
     steps: Optional[int] = None
@@ -10,24 +46,78 @@ class HealthRecord(SQLModel, table=True):
     weight: Optional[float] = None
     heart_rate: Optional[int] = None
     blood_pressure: Optional[str] = None
+    systolic: Optional[int] = None # Parsed from blood_pressure at ingest
+    diastolic: Optional[int] = None
     blood_sugar: Optional[float] = None
     body_temperature: Optional[float] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    # Bumped by every update; clients send it back in If-Match (app/records.py)
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+
+class SeriesUser(SQLModel, table=True):
+    """Maps usernames to small integer ids for compact storage."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    username: str = Field(index=True, unique=True)
+    last_record_id: int = 0 # Compact readings are numbered per user
+
+class SeriesChunk(SQLModel, table=True):
+    """
+    One metric of one user over one time bucket (compact storage mode).
+    `timestamps` holds delta-encoded millisecond offsets from `bucket_start` and
+    `values` the packed readings; see app/timeseries.py for the encoding.
+    """
+    __table_args__ = (UniqueConstraint("series_id", "metric", "bucket_start"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    series_id: int = Field(index=True)
+    metric: str
+    bucket_start: datetime = Field(index=True)
+    count: int = 0
+    timestamps: bytes = b""
+    values: bytes = b""
+    ids: bytes = b"" # Record id of each reading, delta-encoded like the offsets
+    # Last decoded offset/value/id so appends can delta-encode without decoding the chunk
+    last_offset_ms: int = 0
+    last_value: int = 0
+    last_id: int = 0
+
+class IdempotencyKey(SQLModel, table=True):
+    """A processed Idempotency-Key and the response to replay for it (app/idempotency.py)."""
+    key_hash: bytes = Field(primary_key=True) # Truncated sha256 of username and key
+    request_hash: bytes
+    status_code: int
+    response: bytes
+    headers: Optional[dict] = Field(default=None, sa_column=Column(JSON)) # ETag etc., replayed with the body
+    expires_at: datetime = Field(index=True)
 
 class HealthRecordCreate(SQLModel):
     steps: Optional[int] = None
     sleep_hours: Optional[float] = None
     weight: Optional[float] = None
     heart_rate: Optional[int] = None
-    blood_pressure: Optional[str] = None
+    blood_pressure: Optional[str] = None # "120/80", or send systolic/diastolic
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
     blood_sugar: Optional[float] = None
     body_temperature: Optional[float] = None
 
+    @model_validator(mode="before")
+    @classmethod
+    def check_blood_pressure(cls, data):
+        return normalize_blood_pressure(data)
+
 class HealthRecordUpdate(SQLModel):
     steps: Optional[int] = None
     sleep_hours: Optional[float] = None
     weight: Optional[float] = None
     heart_rate: Optional[int] = None
-    blood_pressure: Optional[str] = None
+    blood_pressure: Optional[str] = None # "120/80", or send systolic/diastolic
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
     blood_sugar: Optional[float] = None
     body_temperature: Optional[float] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def check_blood_pressure(cls, data):
+        return normalize_blood_pressure(data)
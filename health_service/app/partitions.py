@@ -0,0 +1,237 @@
+"""
+Monthly range partitions of healthrecord on Postgres, and the maintenance that
+keeps them ahead of the clock and moves old months to the Parquet archive
+(app/archive.py).
+
+    healthrecord            PARTITION BY RANGE (timestamp), primary key (id, timestamp)
+      healthrecord_p2026_10   [2026-10-01, 2026-11-01)
+      ...
+      healthrecord_default    anything no monthly partition covers
+
+Migration 2 converts an existing table. maintain() then creates the partitions
+for the next PARTITION_MONTHS_AHEAD months and, when HEALTH_ARCHIVE_AFTER_MONTHS
+is set, archives months older than that and drops their partitions. It runs
+every PARTITION_MAINTENANCE_INTERVAL seconds in the API, in one process at a
+time (advisory lock), and on demand with `python maintain_partitions.py`.
+
+Other databases (SQLite in development) keep a plain table; archiving a month
+deletes its rows instead. Compact storage (app/timeseries.py) is not partitioned.
+"""
+import os
+import random
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import func, select, text
+from app import archive
+from app.models import HealthRecord
+from hts_common.instrumentation import get_logger
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+HEALTH_ARCHIVE_AFTER_MONTHS = int(os.getenv("HEALTH_ARCHIVE_AFTER_MONTHS", "0")) # 0: never archive
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+# Arbitrary, shared by every process maintaining this database
+MAINTENANCE_LOCK_KEY = 7268340912
+
+BATCH_ROWS = 5000
+
+logger = get_logger("health.partitions")
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f"healthrecord_p{month.year:04d}_{month.month:02d}"
+
+def _bounds(month: datetime) -> str:
+    # Literal bounds: partition DDL takes no bind parameters
+    return f"FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+
+def is_partitioned(connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    kind = connection.execute(text("SELECT relkind FROM pg_class WHERE relname = 'healthrecord'")).scalar()
+    return kind == "p"
+
+def partitions(connection) -> Dict[str, Optional[datetime]]:
+    """Partition name -> month (None for the default partition)."""
+    names = connection.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'healthrecord'
+    """)).scalars()
+    result = {}
+    for name in names:
+        try:
+            result[name] = datetime.strptime(name, "healthrecord_p%Y_%m")
+        except ValueError:
+            result[name] = None
+    return result
+
+def create_partition(connection, month: datetime) -> bool:
+    """Creates the partition of `month` unless it exists. True if created."""
+    name = partition_name(month)
+    if name in partitions(connection):
+        return False
+    start, end = month, add_months(month, 1)
+    in_default = connection.execute(text(
+        'SELECT 1 FROM healthrecord_default WHERE "timestamp" >= :start AND "timestamp" < :end LIMIT 1'
+    ), {"start": start, "end": end}).first()
+    if not in_default:
+        connection.execute(text(f"CREATE TABLE {name} PARTITION OF healthrecord FOR VALUES {_bounds(month)}"))
+        return True
+    # Rows that landed in the default partition must move before the range can be attached
+    connection.execute(text(f"CREATE TABLE {name} (LIKE healthrecord INCLUDING DEFAULTS)"))
+    connection.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM healthrecord_default WHERE "timestamp" >= :start AND "timestamp" < :end RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), {"start": start, "end": end})
+    connection.execute(text(f"ALTER TABLE healthrecord ATTACH PARTITION {name} FOR VALUES {_bounds(month)}"))
+    return True
+
+def partition_healthrecord(connection):
+    """Migration 2: healthrecord becomes a partitioned table (Postgres only)."""
+    if connection.dialect.name != "postgresql" or is_partitioned(connection):
+        return
+    for statement in (
+        "ALTER TABLE healthrecord RENAME TO healthrecord_unpartitioned",
+        "ALTER TABLE healthrecord_unpartitioned RENAME CONSTRAINT healthrecord_pkey TO healthrecord_unpartitioned_pkey",
+        "ALTER INDEX IF EXISTS ix_healthrecord_username_timestamp RENAME TO ix_healthrecord_unpartitioned_username_timestamp",
+        # The id default (nextval of healthrecord_id_seq) comes along
+        "CREATE TABLE healthrecord (LIKE healthrecord_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (\"timestamp\")",
+        # A partitioned table's unique keys must include the partition key
+        "ALTER TABLE healthrecord ADD PRIMARY KEY (id, \"timestamp\")",
+        "ALTER SEQUENCE healthrecord_id_seq OWNED BY healthrecord.id",
+        "CREATE INDEX ix_healthrecord_username_timestamp ON healthrecord (username, \"timestamp\")",
+        "CREATE TABLE healthrecord_default PARTITION OF healthrecord DEFAULT",
+    ):
+        connection.execute(text(statement))
+
+    oldest = connection.execute(text('SELECT min("timestamp") FROM healthrecord_unpartitioned')).scalar()
+    month = month_start(oldest or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), PARTITION_MONTHS_AHEAD)
+    while month <= last:
+        create_partition(connection, month)
+        month = add_months(month, 1)
+
+    connection.execute(text("INSERT INTO healthrecord SELECT * FROM healthrecord_unpartitioned"))
+    connection.execute(text("DROP TABLE healthrecord_unpartitioned"))
+
+def ensure_partitions(engine) -> List[str]:
+    """Creates the partitions of this month and the next PARTITION_MONTHS_AHEAD."""
+    created = []
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return created
+        this_month = month_start(datetime.utcnow())
+        for count in range(PARTITION_MONTHS_AHEAD + 1):
+            month = add_months(this_month, count)
+            if create_partition(connection, month):
+                created.append(partition_name(month))
+    return created
+
+def _months_to_archive(engine, cutoff: datetime) -> List[datetime]:
+    table = HealthRecord.__table__
+    with engine.connect() as connection:
+        oldest = connection.execute(select(func.min(table.c.timestamp)).where(table.c.timestamp < cutoff)).scalar()
+        months = set()
+        if is_partitioned(connection):
+            # Old partitions that are already empty are dropped too
+            months.update(m for m in partitions(connection).values() if m is not None and m < cutoff)
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        months.add(month)
+        month = add_months(month, 1)
+    return sorted(months)
+
+def archive_month(engine, month: datetime) -> int:
+    """
+    Writes `month` to the archive and removes it from the database, in one
+    transaction during which writes to the month wait (reads go on). A month
+    archived before (rows written later with old timestamps) is rewritten with
+    both; where a row is in both, the database copy wins. Returns how many rows
+    moved.
+    """
+    table = HealthRecord.__table__
+    in_month = (table.c.timestamp >= month) & (table.c.timestamp < add_months(month, 1))
+    name = partition_name(month)
+    with engine.begin() as connection:
+        partitioned = is_partitioned(connection)
+        has_partition = partitioned and name in partitions(connection)
+        if partitioned:
+            locked = [name, "healthrecord_default"] if has_partition else ["healthrecord_default"]
+            connection.execute(text(f"LOCK TABLE {', '.join(locked)} IN EXCLUSIVE MODE"))
+        live_ids = set(connection.execute(select(table.c.id).where(in_month)).scalars())
+        if not live_ids and not has_partition:
+            return 0
+
+        def batches():
+            for batch in archive.read_month(month):
+                yield [row for row in batch if row["id"] not in live_ids]
+            rows = connection.execution_options(stream_results=True, yield_per=BATCH_ROWS).execute(
+                select(table).where(in_month).order_by(table.c.username, table.c.timestamp)
+            )
+            for batch in rows.mappings().partitions(BATCH_ROWS):
+                yield [dict(row) for row in batch]
+        total = archive.write_month(month, batches())
+
+        # The file is in place before the rows go: a failure from here on leaves
+        # them in both, and reads prefer the database
+        if has_partition:
+            connection.execute(text(f"DROP TABLE {name}"))
+        if live_ids:
+            connection.execute(table.delete().where(in_month))
+    if total == 0:
+        os.remove(archive.archive_path(month)) # Nothing to keep
+    logger.info("Archived month", month=f"{month:%Y-%m}", rows=len(live_ids), archived_rows=total)
+    return len(live_ids)
+
+def archive_old_months(engine) -> List[str]:
+    if HEALTH_ARCHIVE_AFTER_MONTHS <= 0:
+        return []
+    if not archive.enabled():
+        logger.warning("Archiving needs pyarrow, skipped")
+        return []
+    cutoff = add_months(month_start(datetime.utcnow()), -HEALTH_ARCHIVE_AFTER_MONTHS)
+    done = []
+    for month in _months_to_archive(engine, cutoff):
+        if archive_month(engine, month):
+            done.append(f"{month:%Y-%m}")
+    return done
+
+def maintain(engine) -> Optional[dict]:
+    """One maintenance pass; None if another process holds the lock."""
+    with engine.connect() as lock:
+        postgres = lock.dialect.name == "postgresql"
+        if postgres:
+            acquired = lock.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}).scalar()
+            lock.commit() # Session lock: kept, without an idle transaction
+            if not acquired:
+                return None
+        try:
+            result = {"created": ensure_partitions(engine), "archived": archive_old_months(engine)}
+        finally:
+            if postgres:
+                lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+                lock.commit()
+    if result["created"]:
+        logger.info("Created partitions", partitions=result["created"])
+    return result
+
+async def run_maintenance(engine):
+    """Runs maintain() every PARTITION_MAINTENANCE_INTERVAL seconds; run as a background task."""
+    while True:
+        try:
+            await asyncio.to_thread(maintain, engine)
+        except Exception as e:
+            logger.error("Partition maintenance failed", error=str(e))
+        # Jittered, so workers started together do not all try at once
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL * random.uniform(0.9, 1.1))
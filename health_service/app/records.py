@@ -0,0 +1,92 @@
+"""
+Single-statement writes of HealthRecord rows, scoped by owner.
+
+update_record is one UPDATE ... FROM (SELECT ... FOR UPDATE) ... RETURNING on
+Postgres, which hands back the row before and after the change; delete_record
+is one DELETE ... RETURNING. Both bump or check `version`, so a client that
+sends If-Match with the version it read cannot overwrite a change it has not
+seen. Nothing is returned when the row does not exist, belongs to someone
+else, or has another version: write_failure tells which, on that path only.
+
+SQLite cannot return the FROM side of an UPDATE, so there the old row is read
+first, in the same transaction.
+"""
+from typing import Dict, Iterable, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlmodel import Session
+from app.models import HealthRecord
+
+COLUMNS = [column.name for column in HealthRecord.__table__.columns]
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+def parse_if_match(value: Optional[str]) -> Optional[Set[int]]:
+    """Versions an If-Match header accepts; None for any (absent or *)."""
+    if value is None or value.strip() == "*":
+        return None
+    versions = set()
+    for tag in value.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        try:
+            versions.add(int(tag.strip('"')))
+        except ValueError:
+            pass # Not one of ours: matches nothing
+    return versions
+
+def _owned(table, record_id: int, username: str, versions: Optional[Iterable[int]]):
+    clauses = [table.c.id == record_id, table.c.username == username]
+    if versions is not None:
+        clauses.append(table.c.version.in_(list(versions)))
+    return clauses
+
+def update_record(
+    session: Session, record_id: int, username: str, values: Dict, versions: Optional[Set[int]] = None
+) -> Optional[Tuple[dict, dict]]:
+    """Applies `values` and bumps the version. Returns (before, after) rows, or None."""
+    table = HealthRecord.__table__
+    connection = session.connection()
+    if connection.dialect.name == "postgresql":
+        prior = select(table).where(*_owned(table, record_id, username, versions)).with_for_update().subquery("prior")
+        statement = (
+            table.update()
+            .where(table.c.id == prior.c.id, table.c.timestamp == prior.c.timestamp)
+            .values(**values, version=table.c.version + 1)
+            .returning(*[prior.c[name].label(f"prior_{name}") for name in COLUMNS], *table.c)
+        )
+        row = connection.execute(statement).mappings().first()
+        if row is None:
+            return None
+        return {name: row[f"prior_{name}"] for name in COLUMNS}, {name: row[name] for name in COLUMNS}
+
+    before = connection.execute(select(table).where(*_owned(table, record_id, username, versions))).mappings().first()
+    if before is None:
+        return None
+    after = connection.execute(
+        table.update()
+        .where(table.c.id == record_id, table.c.version == before["version"])
+        .values(**values, version=table.c.version + 1)
+        .returning(*table.c)
+    ).mappings().first()
+    if after is None:
+        return None
+    return dict(before), dict(after)
+
+def delete_record(session: Session, record_id: int, username: str, versions: Optional[Set[int]] = None) -> Optional[dict]:
+    """Deletes the row and returns it, or None."""
+    table = HealthRecord.__table__
+    statement = table.delete().where(*_owned(table, record_id, username, versions)).returning(*table.c)
+    row = session.connection().execute(statement).mappings().first()
+    return dict(row) if row is not None else None
+
+def write_failure(session: Session, record_id: int, username: str) -> Tuple[int, str]:
+    """(status, detail) for a write that matched no row."""
+    table = HealthRecord.__table__
+    owner = session.connection().execute(select(table.c.username).where(table.c.id == record_id)).scalar()
+    if owner is None:
+        return 404, "Health record not found"
+    if owner != username:
+        return 403, "Not authorized to access this record"
+    return 412, "Record was changed since it was read (If-Match does not match its version)"
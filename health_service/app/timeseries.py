@@ -0,0 +1,202 @@
+"""
+Compact storage for high-frequency readings (HEALTH_STORAGE_MODE=compact).
+
+Instead of one wide, mostly-NULL HealthRecord row per reading, each metric of a
+user is appended to a SeriesChunk covering CHUNK_SECONDS:
+
+- timestamps: millisecond offsets from bucket_start, delta-encoded as zigzag varints
+- values: fixed-point integers (value * scale), also delta-encoded zigzag varints.
+  blood_pressure is stored as its systolic/diastolic parts and rebuilt on read.
+
+Each ingested record gets an id from its user's SeriesUser row (numbered per
+user) and version 1, and every chunk it touches stores that id alongside the
+reading. The readings of a record are stitched back into a HealthRecord-shaped
+row on read, so the /data API contract is unchanged. Readings stored before
+chunks carried ids come back with id None, one row per timestamp.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.models import HealthRecord, SeriesChunk, SeriesUser
+
+STORAGE_MODE = os.getenv("HEALTH_STORAGE_MODE", "row") # "row" or "compact"
+CHUNK_SECONDS = int(os.getenv("HEALTH_CHUNK_SECONDS", "3600"))
+
+# metric -> fixed-point scale. Floats keep 3 decimals.
+METRICS = {
+    "steps": 1,
+    "heart_rate": 1,
+    "sleep_hours": 1000,
+    "weight": 1000,
+    "systolic": 1,
+    "diastolic": 1,
+    "blood_sugar": 1000,
+    "body_temperature": 1000,
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+_series_ids: Dict[str, int] = {}
+
+def encode_varint(value: int) -> bytes:
+    zigzag = value * 2 if value >= 0 else -value * 2 - 1
+    out = bytearray()
+    while zigzag >= 0x80:
+        out.append((zigzag & 0x7F) | 0x80)
+        zigzag >>= 7
+    out.append(zigzag)
+    return bytes(out)
+
+def decode_varints(data: bytes) -> Iterator[int]:
+    zigzag, shift = 0, 0
+    for byte in data:
+        zigzag |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield zigzag >> 1 if not zigzag & 1 else -((zigzag + 1) >> 1)
+        zigzag, shift = 0, 0
+
+def to_ms(dt: datetime) -> int:
+    return (dt - EPOCH) // timedelta(milliseconds=1)
+
+def bucket_start(ts: datetime) -> datetime:
+    seconds = int((ts - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % CHUNK_SECONDS)
+
+def get_series_id(session: Session, username: str) -> Optional[int]:
+    """For reads. Only a committed row can be found here, so caching its id is safe."""
+    if username in _series_ids:
+        return _series_ids[username]
+
+    series_id = session.exec(select(SeriesUser.id).where(SeriesUser.username == username)).first()
+    if series_id is not None:
+        _series_ids[username] = series_id
+    return series_id
+
+def next_record_id(session: Session, username: str) -> Tuple[int, int]:
+    """(series id, record id) for a new record; the user's row stays locked until the commit."""
+    table = SeriesUser.__table__
+    statement = (
+        table.update()
+        .where(table.c.username == username)
+        .values(last_record_id=table.c.last_record_id + 1)
+        .returning(table.c.id, table.c.last_record_id)
+    )
+    row = session.execute(statement).first()
+    if row is not None:
+        return tuple(row)
+    try:
+        with session.begin_nested():
+            series = SeriesUser(username=username, last_record_id=1)
+            session.add(series)
+        return series.id, 1
+    except IntegrityError:
+        # Another request registered the user first
+        return tuple(session.execute(statement).one())
+
+def get_chunk_for_update(session: Session, series_id: int, metric: str, start: datetime) -> SeriesChunk:
+    statement = select(SeriesChunk).where(
+        SeriesChunk.series_id == series_id,
+        SeriesChunk.metric == metric,
+        SeriesChunk.bucket_start == start
+    ).with_for_update()
+    chunk = session.exec(statement).first()
+    if chunk:
+        return chunk
+
+    try:
+        with session.begin_nested():
+            chunk = SeriesChunk(series_id=series_id, metric=metric, bucket_start=start)
+            session.add(chunk)
+        return chunk
+    except IntegrityError:
+        return session.exec(statement).one()
+
+def append_record(session: Session, record: HealthRecord):
+    """Appends every non-null metric of `record` to its chunk and sets record.id. Caller commits."""
+    # Offsets are stored in milliseconds; truncate so the response matches what is stored
+    record.timestamp = record.timestamp.replace(microsecond=record.timestamp.microsecond // 1000 * 1000)
+    series_id, record.id = next_record_id(session, record.username)
+    start = bucket_start(record.timestamp)
+    offset = to_ms(record.timestamp) - to_ms(start)
+
+    for metric, scale in METRICS.items():
+        value = getattr(record, metric)
+        if value is None:
+            continue
+
+        chunk = get_chunk_for_update(session, series_id, metric, start)
+        chunk.timestamps += encode_varint(offset - chunk.last_offset_ms)
+        chunk.last_offset_ms = offset
+        scaled = round(value * scale)
+        chunk.values += encode_varint(scaled - chunk.last_value)
+        chunk.last_value = scaled
+        chunk.ids += encode_varint(record.id - chunk.last_id)
+        chunk.last_id = record.id
+        chunk.count += 1
+        session.add(chunk)
+
+def _running_sums(data: bytes) -> List[int]:
+    sums, total = [], 0
+    for delta in decode_varints(data):
+        total += delta
+        sums.append(total)
+    return sums
+
+def decode_chunk(chunk: SeriesChunk) -> Iterator[Tuple[datetime, object, Optional[int]]]:
+    """(timestamp, value, record id) per reading."""
+    scale = METRICS[chunk.metric]
+    offsets = _running_sums(chunk.timestamps)
+    ids = _running_sums(chunk.ids)
+    ids = [None] * (len(offsets) - len(ids)) + ids # Readings appended before chunks kept ids
+
+    values = []
+    value = 0
+    for delta in decode_varints(chunk.values):
+        value += delta
+        values.append(value if scale == 1 else value / scale)
+
+    for offset, value, record_id in zip(offsets, values, ids):
+        yield chunk.bucket_start + timedelta(milliseconds=offset), value, record_id
+
+def read_records(
+    session: Session,
+    username: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> List[dict]:
+    """
+    Returns plain dicts shaped like HealthRecord; building table models per reading
+    costs more than decoding the chunks.
+    """
+    series_id = get_series_id(session, username)
+    if series_id is None:
+        return []
+
+    statement = select(SeriesChunk).where(SeriesChunk.series_id == series_id)
+    if start:
+        statement = statement.where(SeriesChunk.bucket_start > start - timedelta(seconds=CHUNK_SECONDS))
+    if end:
+        statement = statement.where(SeriesChunk.bucket_start <= end)
+
+    empty = {metric: None for metric in METRICS}
+    empty["blood_pressure"] = None
+    records: Dict[object, dict] = {} # By record id, or by timestamp for readings without one
+    for chunk in session.exec(statement).all():
+        for ts, value, record_id in decode_chunk(chunk):
+            if (start and ts < start) or (end and ts > end):
+                continue
+            key = record_id if record_id is not None else ts
+            record = records.get(key)
+            if record is None:
+                record = records[key] = dict(empty, id=record_id, username=username, timestamp=ts, version=1)
+            record[chunk.metric] = value
+
+    for record in records.values():
+        if record["systolic"] is not None and record["diastolic"] is not None:
+            record["blood_pressure"] = f"{record['systolic']}/{record['diastolic']}"
+
+    return sorted(records.values(), key=lambda record: (record["timestamp"], record["id"] or 0))
@@ -1,15 +1,35 @@
+import asyncio
 from fastapi import FastAPI
-from app.database import create_db_and_tables
+from fastapi.responses import PlainTextResponse
+from app.database import create_db_and_tables, engine
+from app.partitions import run_maintenance
+from app.idempotency import run_purge
 from app.api import router as health_router
+from hts_common.instrumentation import InstrumentationMiddleware, render_metrics, setup_logging
+
+setup_logging("health_service")
 
 app = FastAPI(title="Health Data Service")
+app.add_middleware(InstrumentationMiddleware)
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     create_db_and_tables()
+    # Future partitions and archival of old months (app/partitions.py)
+    app.state.partition_maintenance = asyncio.create_task(run_maintenance(engine))
+    app.state.idempotency_purge = asyncio.create_task(run_purge(engine))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.partition_maintenance.cancel()
+    app.state.idempotency_purge.cancel()
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    return render_metrics()
+
 app.include_router(health_router)
@@ -0,0 +1,23 @@
+"""
+One pass of the healthrecord partition maintenance (app/partitions.py): creates
+the coming months' partitions and, with HEALTH_ARCHIVE_AFTER_MONTHS set,
+archives older months to HEALTH_ARCHIVE_DIR. The API already does this every
+PARTITION_MAINTENANCE_INTERVAL seconds; run it from cron when the API is not
+running, or to archive right away.
+
+    HEALTH_ARCHIVE_AFTER_MONTHS=12 python maintain_partitions.py
+"""
+from app.database import create_db_and_tables, engine
+from app.partitions import maintain
+
+def main():
+    create_db_and_tables()
+    result = maintain(engine)
+    if result is None:
+        print(" [Partitions] Another process is maintaining the table, nothing done")
+        return
+    print(f" [Partitions] Created {len(result['created'])} partition(s): {', '.join(result['created']) or '-'}")
+    print(f" [Partitions] Archived {len(result['archived'])} month(s): {', '.join(result['archived']) or '-'}")
+
+if __name__ == "__main__":
+    main()
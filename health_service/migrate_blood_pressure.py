@@ -0,0 +1,37 @@
+"""
+Backfills the systolic/diastolic columns of an existing healthrecord table
+from the free-form blood_pressure strings, in batches.
+
+    python migrate_blood_pressure.py [--batch-size 1000]
+
+Migrations 5 and 6 (app/migrations.py) do the same at startup, in one
+transaction; running this ahead of a release on a large table commits batch
+by batch and leaves them little to do. Safe to re-run: only rows with a
+blood_pressure and no systolic value are touched, and unparseable strings
+are reported and left alone.
+"""
+import argparse
+from app.database import engine
+from app.migrations import add_blood_pressure_columns, blood_pressure_batches
+
+def backfill(batch_size: int):
+    updated = skipped = 0
+    with engine.connect() as connection:
+        for last_id, count, unparseable in blood_pressure_batches(connection, batch_size):
+            connection.commit()
+            for record_id in unparseable:
+                print(f" [Migration] Skipping record {record_id}: unparseable blood_pressure")
+            updated += count
+            skipped += len(unparseable)
+            print(f" [Migration] Backfilled up to id {last_id} ({updated} updated, {skipped} skipped)")
+
+    print(f" [Migration] Done: {updated} updated, {skipped} skipped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill systolic/diastolic from blood_pressure")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        add_blood_pressure_columns(connection)
+    backfill(args.batch_size)
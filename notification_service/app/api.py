@@ -1,32 +1,78 @@
 from typing import List
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlmodel import Session, select
-from app.database import get_session
-from app.models import Notification, Reminder
+from sqlmodel import Session, select, update
+from app.database import engine, get_read_session, get_session, reads
+from app.models import Notification, Reminder, ReminderCreate, MarkRead
+from app.unread import adjust_unread, get_unread
+from app.scheduler import scheduler, RECURRENCE_INTERVALS
+from hts_common.responses import json_response, fetch_rows
+from hts_common.instrumentation import get_logger
 
 router = APIRouter()
 
+logger = get_logger("notification.api")
+
 @router.get("/list/{username}", response_model=List[Notification])
-def get_notifications(username: str, session: Session = Depends(get_session)):
+def get_notifications(username: str, session: Session = Depends(get_read_session)):
     statement = select(Notification).where(Notification.username == username).order_by(Notification.timestamp.desc())
-    return session.exec(statement).all()
+    return json_response(fetch_rows(session, statement))
+
+@router.get("/unread_count/{username}")
+def get_unread_count(username: str, session: Session = Depends(get_read_session)):
+    # Replicas are read-only, so only the primary seeds a missing counter
+    return {"username": username, "unread": get_unread(session, username, seed=session.get_bind() is engine)}
+
+@router.post("/read")
+def mark_many_read(mark: MarkRead, session: Session = Depends(get_session)):
+    if mark.ids is None and mark.before is None:
+        raise HTTPException(status_code=400, detail="Provide either ids or before")
+
+    # One UPDATE for the whole batch; only rows that were unread are touched
+    statement = update(Notification).where(
+        Notification.username == mark.username,
+        Notification.read == False
+    )
+    if mark.ids is not None:
+        statement = statement.where(Notification.id.in_(mark.ids))
+    if mark.before is not None:
+        statement = statement.where(Notification.timestamp <= mark.before)
+
+    result = session.exec(statement.values(read=True))
+    adjust_unread(session, mark.username, -result.rowcount)
+    session.commit()
+    reads.mark_write(mark.username)
+    return {"message": "Marked as read", "updated": result.rowcount}
 
 @router.post("/{notification_id}/read")
 def mark_read(notification_id: int, session: Session = Depends(get_session)):
-    notification = session.get(Notification, notification_id)
-    if not notification:
-        raise HTTPException(status_code=404, detail="Notification not found")
-    notification.read = True
-    session.add(notification)
+    # Guarded on read = false, so of two concurrent calls only one decrements the counter
+    username = session.exec(
+        update(Notification)
+        .where(Notification.id == notification_id, Notification.read == False)
+        .values(read=True)
+        .returning(Notification.username)
+    ).scalar()
+    if username is None:
+        if session.get(Notification, notification_id) is None:
+            raise HTTPException(status_code=404, detail="Notification not found")
+        return {"message": "Marked as read"} # Already read
+    adjust_unread(session, username, -1)
     session.commit()
+    reads.mark_write(username)
     return {"message": "Marked as read"}
 
 @router.post("/reminders", response_model=Reminder)
-def create_reminder(reminder: Reminder, session: Session = Depends(get_session)):
+async def create_reminder(reminder_create: ReminderCreate, session: Session = Depends(get_session)):
+    if reminder_create.recurrence and reminder_create.recurrence not in RECURRENCE_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Unsupported recurrence. Use one of: {', '.join(RECURRENCE_INTERVALS)}")
+    reminder = Reminder(**reminder_create.dict())
     session.add(reminder)
     session.commit()
     session.refresh(reminder)
+
+    # Wake the local scheduler right away; other replicas pick it up on their next sync
+    scheduler.schedule(reminder)
     return reminder
 
 from fastapi import WebSocket, WebSocketDisconnect
@@ -35,7 +81,7 @@ from app.manager import manager
 @router.websocket("/ws/{username}")
 @router.websocket("/ws/{username}/")
 async def websocket_endpoint(websocket: WebSocket, username: str):
-    print(f" [API] WebSocket connection attempt for {username}...")
+    logger.info("WebSocket connection attempt", username=username)
     await manager.connect(websocket, username)
     try:
         while True:
@@ -1,13 +1,28 @@
 import os
-from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel import create_engine, Session
+from hts_common.instrumentation import instrument_engine
+from app.migrations import migrate
+from hts_common.readiness import wait_for_database
+from hts_common.replicas import ReadRouter
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 engine = create_engine(DATABASE_URL, echo=True)
+instrument_engine(engine)
+
+# Read-only endpoints may use replicas (DATABASE_REPLICA_URLS)
+reads = ReadRouter(engine)
 
 def get_session():
     with Session(engine) as session:
         yield session
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    """Waits for the database, then applies pending migrations (app/migrations.py)."""
+    wait_for_database(engine)
+    migrate(engine)
+
+def get_read_session(username: str):
+    """For read-only endpoints; `username` is their path parameter (see hts_common/replicas.py)."""
+    with reads.session(username) as session:
+        yield session
@@ -1,5 +1,8 @@
 from typing import List, Dict
 from fastapi import WebSocket
+from hts_common.instrumentation import get_logger
+
+logger = get_logger("notification.manager")
 
 class ConnectionManager:
     def __init__(self):
@@ -12,7 +15,7 @@ class ConnectionManager:
         if username not in self.active_connections:
             self.active_connections[username] = []
         self.active_connections[username].append(websocket)
-        print(f" [Manager] User {username} connected. Total active sessions: {len(self.active_connections[username])}")
+        logger.info("User connected", username=username, sessions=len(self.active_connections[username]))
 
     def disconnect(self, websocket: WebSocket, username: str):
         if username in self.active_connections:
@@ -20,7 +23,7 @@ class ConnectionManager:
                 self.active_connections[username].remove(websocket)
             if not self.active_connections[username]:
                 del self.active_connections[username]
-        print(f" [Manager] User {username} disconnected.")
+        logger.info("User disconnected", username=username)
 
     async def send_personal_message(self, message: str, username: str):
         if username in self.active_connections:
@@ -28,6 +31,6 @@ class ConnectionManager:
                 try:
                     await connection.send_text(message)
                 except Exception as e:
-                    print(f" [Manager] Failed to send to {username}: {e}")
+                    logger.warning("Failed to send", username=username, error=str(e))
 
 manager = ConnectionManager()
@@ -0,0 +1,32 @@
+"""
+Schema migrations of this service, applied in order by the shared runner
+(hts_common.migrations, which documents the rules). Append new ones, never
+edit applied ones.
+"""
+from typing import List
+from sqlalchemy import text
+import app.models # Registers the tables the migrations refer to
+from hts_common import migrations as runner
+from hts_common.migrations import Migration, add_columns, create_models, has_column
+
+def add_reminder_schedule_columns(connection):
+    if not has_column(connection, "reminder", "updated_at"):
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("ALTER TABLE reminder ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT now()"))
+        else:
+            # SQLite only adds columns with a constant default
+            connection.execute(text("ALTER TABLE reminder ADD COLUMN updated_at TIMESTAMP"))
+            connection.execute(text("UPDATE reminder SET updated_at = CURRENT_TIMESTAMP"))
+    add_columns(connection, "reminder", ["recurrence"])
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", create_models),
+    Migration(2, "reminder_schedule_columns", add_reminder_schedule_columns),
+]
+
+def pending_migrations(engine) -> List[Migration]:
+    return runner.pending_migrations(engine, MIGRATIONS)
+
+def migrate(engine) -> int:
+    """Applies pending migrations, each in its own transaction. Returns how many."""
+    return runner.migrate(engine, MIGRATIONS)
@@ -1,8 +1,14 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+from sqlalchemy import Index, text
 from sqlmodel import Field, SQLModel
 
 class Notification(SQLModel, table=True):
+    __table_args__ = (
+        # Unread badges and bulk mark-as-read only touch unread rows
+        Index("ix_notification_unread", "username", "timestamp", postgresql_where=text("NOT read")),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(index=True)
     message: str
@@ -10,9 +16,31 @@ class Notification(SQLModel, table=True):
     read: bool = False
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+class UnreadCounter(SQLModel, table=True):
+    username: str = Field(primary_key=True)
+    unread: int = 0
+
+class MarkRead(SQLModel):
+    username: str
+    ids: Optional[List[int]] = None # Mark these notifications...
+    before: Optional[datetime] = None # ...or everything up to this timestamp
+
 class Reminder(SQLModel, table=True):
+    __table_args__ = (
+        # The scheduler only ever loads active reminders ordered by due time
+        Index("ix_reminder_active_schedule_time", "schedule_time", postgresql_where=text("is_active")),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(index=True)
     message: str
-    schedule_time: datetime # When to trigger
+    schedule_time: datetime # When to trigger (UTC)
+    recurrence: Optional[str] = None # None (one-off), "hourly", "daily", "weekly"
     is_active: bool = True
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True) # Lets replicas sync changes incrementally
+
+class ReminderCreate(SQLModel):
+    username: str
+    message: str
+    schedule_time: datetime
+    recurrence: Optional[str] = None
@@ -0,0 +1,162 @@
+import os
+import heapq
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlmodel import Session, select
+from app.database import engine
+from app.models import Reminder
+from app.consumer import save_notification
+from hts_common.instrumentation import get_logger, start_span
+
+RECURRENCE_INTERVALS = {
+    "hourly": timedelta(hours=1),
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+}
+
+# How often to pick up reminders written by other replicas. Local writes wake the
+# scheduler immediately, so this only bounds cross-replica staleness.
+SYNC_INTERVAL = float(os.getenv("REMINDER_SYNC_INTERVAL", "30"))
+
+logger = get_logger("notification.scheduler")
+
+def next_occurrence(reminder: Reminder, now: datetime) -> Optional[datetime]:
+    """Next due time strictly after `now`, skipping occurrences missed while down."""
+    interval = RECURRENCE_INTERVALS.get(reminder.recurrence or "")
+    if not interval:
+        return None
+    missed = (now - reminder.schedule_time) // interval + 1
+    return reminder.schedule_time + interval * max(missed, 1)
+
+def load_reminders(last_sync: Optional[datetime]) -> List[Reminder]:
+    with Session(engine) as session:
+        statement = select(Reminder)
+        if last_sync is None:
+            statement = statement.where(Reminder.is_active == True)
+        else:
+            # Overlap by one interval to tolerate clock skew between replicas
+            statement = statement.where(Reminder.updated_at >= last_sync - timedelta(seconds=SYNC_INTERVAL))
+        return session.exec(statement).all()
+
+def claim_reminder(reminder_id: int, now: datetime) -> Optional[Reminder]:
+    """
+    Atomically advances a due reminder so that exactly one replica fires it.
+    The row lock (SKIP LOCKED) acts as a lease; once committed, the new
+    schedule_time makes the occurrence no longer due for anyone else.
+    """
+    with Session(engine) as session:
+        statement = select(Reminder).where(
+            Reminder.id == reminder_id,
+            Reminder.is_active == True,
+            Reminder.schedule_time <= now
+        ).with_for_update(skip_locked=True)
+        reminder = session.exec(statement).first()
+        if not reminder:
+            return None
+
+        next_time = next_occurrence(reminder, now)
+        if next_time:
+            reminder.schedule_time = next_time
+        else:
+            reminder.is_active = False
+        reminder.updated_at = now
+        session.add(reminder)
+        session.commit()
+        session.refresh(reminder)
+        return reminder
+
+class ReminderScheduler:
+    def __init__(self):
+        # Min-heap of (due, reminder_id). Entries are invalidated lazily: an entry only
+        # fires if it still matches `self.due_times`.
+        self.heap: List[Tuple[datetime, int]] = []
+        self.due_times: Dict[int, datetime] = {}
+        self.wakeup = asyncio.Event()
+        self.last_sync: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def schedule(self, reminder: Reminder):
+        """Adds, moves or removes a reminder in the queue."""
+        if not reminder.is_active:
+            self.due_times.pop(reminder.id, None)
+            return
+        if self.due_times.get(reminder.id) == reminder.schedule_time:
+            return
+        self.due_times[reminder.id] = reminder.schedule_time
+        heapq.heappush(self.heap, (reminder.schedule_time, reminder.id))
+        self.wakeup.set()
+
+    async def sync(self):
+        """Loads active reminders on cold start, then only rows changed since the last sync."""
+        started = datetime.utcnow()
+        # Database work runs on a thread: this loop also serves the WebSocket pushes
+        reminders = await asyncio.to_thread(load_reminders, self.last_sync)
+
+        for reminder in reminders:
+            self.schedule(reminder)
+        self.last_sync = started
+
+        # Compact the heap if lazy deletion left too many stale entries behind
+        if len(self.heap) > 2 * len(self.due_times) + 64:
+            self.heap = [(due, rid) for rid, due in self.due_times.items()]
+            heapq.heapify(self.heap)
+
+    async def claim(self, reminder_id: int, now: datetime) -> Optional[Reminder]:
+        reminder = await asyncio.to_thread(claim_reminder, reminder_id, now)
+        if reminder:
+            self.schedule(reminder)
+        return reminder
+
+    async def fire_due(self):
+        now = datetime.utcnow()
+        while self.heap and self.heap[0][0] <= now:
+            due, reminder_id = heapq.heappop(self.heap)
+            if self.due_times.get(reminder_id) != due:
+                continue # Stale entry (rescheduled or deactivated)
+            del self.due_times[reminder_id]
+
+            reminder = await self.claim(reminder_id, now)
+            if reminder:
+                with start_span("reminder.fire", reminder_id=reminder_id):
+                    await save_notification(reminder.username, reminder.message, "Reminder")
+
+    async def run(self):
+        logger.info("Scheduler started")
+        while True:
+            try:
+                if self.last_sync is None or (datetime.utcnow() - self.last_sync).total_seconds() >= SYNC_INTERVAL:
+                    await self.sync()
+
+                await self.fire_due()
+
+                # Sleep until the next reminder is due (or a local write wakes us up)
+                timeout = SYNC_INTERVAL
+                if self.heap:
+                    until_due = (self.heap[0][0] - datetime.utcnow()).total_seconds()
+                    timeout = max(0.0, min(timeout, until_due))
+
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Scheduler error")
+                self.last_sync = None # Reload everything so nothing popped is lost
+                await asyncio.sleep(1)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+scheduler = ReminderScheduler()
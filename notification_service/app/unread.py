@@ -0,0 +1,49 @@
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select, update
+from app.models import Notification, UnreadCounter
+
+def _insert(session: Session):
+    # INSERT ... ON CONFLICT is dialect-specific in SQLAlchemy; both spell it the same
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(UnreadCounter)
+
+def adjust_unread(session: Session, username: str, delta: int):
+    """Applies a delta to the user's unread counter in the caller's transaction."""
+    if delta == 0:
+        return
+    result = session.exec(
+        update(UnreadCounter)
+        .where(UnreadCounter.username == username)
+        .values(unread=UnreadCounter.unread + delta)
+    )
+    if result.rowcount == 0:
+        # First notification for this user: seed from the table so pre-existing rows count.
+        # A concurrent seed may win the insert; then the delta goes onto its row.
+        statement = _insert(session).values(username=username, unread=count_unread(session, username))
+        session.exec(statement.on_conflict_do_update(
+            index_elements=[UnreadCounter.username],
+            set_={"unread": UnreadCounter.unread + delta}
+        ))
+
+def count_unread(session: Session, username: str) -> int:
+    """Full count, served by the partial unread index. Only used to seed counters."""
+    statement = select(func.count()).select_from(Notification).where(
+        Notification.username == username,
+        Notification.read == False
+    )
+    return session.exec(statement).one()
+
+def get_unread(session: Session, username: str, seed: bool = True) -> int:
+    """The user's unread count. Without `seed` (a read-only session) a missing counter is only counted."""
+    unread = session.exec(select(UnreadCounter.unread).where(UnreadCounter.username == username)).first()
+    if unread is not None:
+        return unread
+    if not seed:
+        return count_unread(session, username) # adjust_unread seeds it on the user's next change
+
+    statement = _insert(session).values(username=username, unread=count_unread(session, username))
+    session.exec(statement.on_conflict_do_nothing(index_elements=[UnreadCounter.username]))
+    session.commit()
+    # Whichever seed won
+    return session.exec(select(UnreadCounter.unread).where(UnreadCounter.username == username)).one()
@@ -1,23 +1,26 @@
 import os
 import asyncio
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
-from aio_pika import connect
 from app.database import create_db_and_tables
 from app.api import router as notification_router
-from app.consumer import on_message
+from app.consumer import handle_message
+from hts_common.readiness import connect_broker
+from hts_common.retry import declare_retry_topology, monitor_queue_depths, topology_queues, with_retries
+from app.scheduler import scheduler
+from hts_common.instrumentation import InstrumentationMiddleware, get_logger, render_metrics, setup_logging
+
+setup_logging("notification_service")
+logger = get_logger("notification.main")
 
 RABBITMQ_URL = os.getenv("RABBITMQ_URL")
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup: Create DB and Connect to RabbitMQ
-    create_db_and_tables()
-    
-    # Run consumer in background task
-    connection = None
+async def run_consumer(app: FastAPI):
+    """Connects (retrying until RabbitMQ is up) and consumes, in the background so
+    HTTP and WebSockets are served meanwhile. Then keeps the queue depths current."""
     try:
-        connection = await connect(RABBITMQ_URL)
+        connection = app.state.amqp_connection = await connect_broker(RABBITMQ_URL)
         channel = await connection.channel()
         exchange = await channel.declare_exchange("health_events", type="topic")
         queue = await channel.declare_queue("notification_queue", durable=True)
@@ -25,34 +28,58 @@ async def lifespan(app: FastAPI):
         # Bind to health records and insights
         await queue.bind(exchange, routing_key="health.record.#")
         await queue.bind(exchange, routing_key="analysis.insight.#")
+
+        # Failed messages wait in delay queues, then the dead-letter queue
+        await declare_retry_topology(channel, "notification_queue")
         
-        print(" [Notification] Waiting for messages...")
-        await queue.consume(on_message)
-        
-        # yield control back to FastAPI
-        yield
-        
+        logger.info("Waiting for messages", queue="notification_queue")
+        await queue.consume(with_retries(channel, "notification_queue", handle_message))
+        await monitor_queue_depths(connection, topology_queues("notification_queue"))
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        print(f" [Notification] Startup failed: {e}")
-        yield
+        logger.error("Consumer failed", error=str(e))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: wait for the DB and migrate; RabbitMQ connects in the background
+    create_db_and_tables()
+    scheduler.start()
+    app.state.amqp_connection = None
+    consumer = asyncio.create_task(run_consumer(app))
+
+    # yield control back to FastAPI
+    yield
 
     # Shutdown
-    if connection:
-        await connection.close()
+    consumer.cancel()
+    await scheduler.stop()
+    if app.state.amqp_connection:
+        await app.state.amqp_connection.close()
 
 app = FastAPI(title="Notification Service", lifespan=lifespan)
 
+# Browser traffic (including /ws) is proxied through the API Gateway, so only the
+# frontend origins need direct access
+FRONTEND_ORIGINS = os.getenv("FRONTEND_ORIGINS") or "http://localhost:5173,http://127.0.0.1:5173"
+allowed_origins = [origin.strip() for origin in FRONTEND_ORIGINS.split(",") if origin.strip()]
+
 from fastapi.middleware.cors import CORSMiddleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"], # Allow all origins for direct access setup
+    allow_origins=allowed_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(InstrumentationMiddleware)
 
 app.include_router(notification_router)
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    return render_metrics()